@@ -0,0 +1,222 @@
+"""
+Microbenchmarks of the webhook hot path. Outbound HTTP is stubbed, so they run offline.
+
+    python -m benchmarks.bench                    # run and store results/<commit>.json
+    python -m benchmarks.bench --compare abc1234  # run and compare with results of another commit
+    python -m benchmarks.bench --filter auth      # run only cases whose name contains "auth"
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks.common import BENCHMARKS_DIR, load_payload, set_environment, sign
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+
+# Files are saved to a temporary directory, deduplication is not part of the measured path
+set_environment(STORAGE_MODE="unique", DEDUP_BACKEND="none")
+
+from starlette.datastructures import Headers  # noqa: E402
+
+from unapi import util  # noqa: E402
+from unapi.client import ApiClient  # noqa: E402
+from unapi.context import RequestContext  # noqa: E402
+from unapi.event import EventFactory  # noqa: E402
+from unapi.platforms.facebook import FacebookEvent  # noqa: E402
+from unapi.platforms.telegram import TelegramEvent  # noqa: E402
+from unapi.platforms.viber import ViberEvent  # noqa: E402
+
+
+class _Request:
+    """
+    The part of a starlette request the event factory reads
+    """
+
+    def __init__(self, headers: Dict[str, str], body: bytes) -> None:
+        self.headers = Headers(headers)
+        self._body = body
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+def _stub_http() -> None:
+    """
+    Answers every outbound call with a canned getFile result instead of going to the network
+    """
+    result = (200, {"ok": True, "result": {"file_path": "photos/file_1.jpg"}})
+
+    def request_sync(self, method, url, body=None, params=None):
+        return result
+
+    async def request(self, method, url, body=None, params=None):
+        return result
+
+    ApiClient.request_sync = request_sync
+    ApiClient.request = request
+
+
+def _cases() -> Dict[str, Callable[[], object] | Callable[[], Awaitable[object]]]:
+    """
+    Builds the benchmark cases. A case is a function without arguments, either plain or async
+    """
+    messengers = {"telegram": TelegramEvent, "viber": ViberEvent, "facebook": FacebookEvent}
+    cases = {}
+
+    for name, messenger in messengers.items():
+        raw = load_payload(name)
+        headers = sign(name, raw)
+        context = RequestContext(Headers(headers), raw)
+        request = _Request(headers, raw)
+        model = messenger.is_json_valid(raw)
+        event = messenger.create(model, context)
+
+        cases[f"create_event.{name}"] = lambda request=request: EventFactory.create_event(request)
+        if name != "telegram":
+            cases[f"is_request_authentic.{name}"] = lambda m=messenger, c=context: m.is_request_authentic(c)
+        cases[f"is_json_valid.{name}"] = lambda m=messenger, r=raw: m.is_json_valid(r)
+        cases[f"get_attachments.{name}"] = lambda e=event: e._get_attachments()
+
+    file_content = os.urandom(64 * 1024)
+    cases["generate_file_path"] = lambda: util.generate_file_path("photo.jpg", "image")
+    # Every call overwrites one file, so a run does not leave thousands of copies behind
+    file_path = util.generate_file_path("photo.jpg", "image")
+    cases["save_file.64k"] = lambda: util.save_file(file_path, file_content)
+    return cases
+
+
+def _measure(case: Callable, number: int, repeat: int, loop: asyncio.AbstractEventLoop) -> List[float]:
+    """
+    Runs a case `number` times per repeat, awaiting it inside a single loop run if it is async
+    :return: time per call in nanoseconds, one value per repeat
+    """
+    is_async = asyncio.iscoroutine(probe := case())
+    if is_async:
+        loop.run_until_complete(probe)
+
+    async def run_async() -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await case()
+        return time.perf_counter() - start
+
+    def run_sync() -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            case()
+        return time.perf_counter() - start
+
+    timings = []
+    for _ in range(repeat):
+        elapsed = loop.run_until_complete(run_async()) if is_async else run_sync()
+        timings.append(elapsed / number * 1e9)
+    return timings
+
+
+def _commit() -> str:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR,
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                        cwd=BENCHMARKS_DIR, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "local"
+    return commit + ("-dirty" if dirty else "")
+
+
+def run(number: int, repeat: int, name_filter: str | None = None) -> dict:
+    """
+    Runs all benchmark cases
+    :param number: calls per repeat
+    :param repeat: repeats per case; the best and the median of them are reported
+    :param name_filter: if given, only cases whose name contains it are run
+    :return: results with the environment they were measured in
+    """
+    _stub_http()
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        for name, case in _cases().items():
+            if name_filter and name_filter not in name:
+                continue
+            timings = _measure(case, number, repeat, loop)
+            results[name] = {"best_ns": min(timings), "median_ns": statistics.median(timings)}
+            print(f"{name:<36} {min(timings):>12.0f} ns {statistics.median(timings):>12.0f} ns (median)")
+    finally:
+        loop.close()
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "number": number,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def save(result: dict) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    file_path = os.path.join(RESULTS_DIR, f"{result['commit']}.json")
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return file_path
+
+
+def load(baseline: str) -> dict:
+    """
+    Loads stored results
+    :param baseline: a commit the results were stored for or a path to a results file
+    :return: results
+    """
+    file_path = baseline if os.path.exists(baseline) else os.path.join(RESULTS_DIR, f"{baseline}.json")
+    with open(file_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """
+    Prints the change of the best time of every case present in both results
+    :param threshold: relative slowdown, e.g. 0.1, above which a case is reported as a regression
+    :return: names of regressed cases
+    """
+    regressions = []
+    print(f"\n{'case':<36} {baseline['commit']:>12} {current['commit']:>12} {'change':>8}")
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before, after = baseline["results"][name]["best_ns"], result["best_ns"]
+        change = after / before - 1
+        marker = ""
+        if change > threshold:
+            regressions.append(name)
+            marker = "  regression"
+        print(f"{name:<36} {before:>10.0f}ns {after:>10.0f}ns {change:>+8.1%}{marker}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the webhook hot path")
+    parser.add_argument("--number", type=int, default=2000, help="calls per repeat")
+    parser.add_argument("--repeat", type=int, default=5, help="repeats per case")
+    parser.add_argument("--filter", dest="name_filter", help="run only cases whose name contains this")
+    parser.add_argument("--compare", metavar="COMMIT", help="commit or results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    parser.add_argument("--no-save", action="store_true", help="do not store the results")
+    args = parser.parse_args()
+
+    result = run(args.number, args.repeat, args.name_filter)
+    if not args.no_save:
+        print(f"Results saved to {save(result)}")
+    if args.compare and compare(load(args.compare), result, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Broadcast benchmark. Sends one message to many recipients of every platform through unapi.broadcast,
+with replies going to stand-in platform servers, see benchmarks/stubs.py. Reports the send rate and API calls,
+which show how much batching saves: Viber takes 300 receivers per call, a Graph API batch 50, Telegram one.
+Every recipient counts against the message rate of its platform (Viber 100, Facebook 250 and Telegram 30 per
+second), so the rate is capped by these limits, and Telegram is left out unless asked for.
+
+    python -m benchmarks.broadcast --recipients 5000 --platforms viber,facebook --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+from typing import List
+
+from benchmarks.common import set_environment
+from benchmarks.stubs import PlatformStubs
+
+
+async def run(args: argparse.Namespace) -> dict:
+    stubs = PlatformStubs(args.latency, args.jitter, args.error_rate, args.error_status, args.seed)
+    stub_url = await stubs.start(port=args.stub_port)
+    set_environment(TELEGRAM_API_URL=stub_url, VIBER_API_URL=f"{stub_url}/pa/", FACEBOOK_GRAPH_URL=stub_url)
+    # Imported only now, so the clients pick up the stub urls
+    from unapi.broadcast import broadcast
+    from unapi.client import ApiClient
+
+    try:
+        results = {}
+        for platform in args.platforms:
+            result = await broadcast(platform, [f"user{n}" for n in range(args.recipients)], "Benchmark",
+                                     concurrency=args.concurrency)
+            results[platform] = result.stats()
+        return {"broadcasts": results, "stubs": stubs.stats()}
+    finally:
+        await ApiClient.close_all()
+        await stubs.stop()
+
+
+def _platforms(value: str) -> List[str]:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Broadcast benchmark")
+    parser.add_argument("--recipients", type=int, default=1000, help="recipients per platform")
+    parser.add_argument("--platforms", type=_platforms, default=_platforms("viber,facebook"),
+                        help="platforms to broadcast to, e.g. viber,facebook")
+    parser.add_argument("--concurrency", type=int, help="calls in flight, BROADCAST_CONCURRENCY by default")
+    parser.add_argument("--stub-port", type=int, default=0, help="port of the stub servers, 0 picks a free one")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra stub delay of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub calls answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of stub errors")
+    parser.add_argument("--seed", type=int, help="seed for reproducible runs")
+    parser.add_argument("--output", help="file to write the report to as JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
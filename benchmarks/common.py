@@ -0,0 +1,78 @@
+import hashlib
+import hmac
+import os
+import tempfile
+from typing import Dict
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PAYLOADS_DIR = os.path.join(BENCHMARKS_DIR, "payloads")
+
+# Placeholder credentials, so every platform is enabled without a .env
+_environment = {
+    "TELEGRAM_TOKEN": "bench-token",
+    "TELEGRAM_VERIFICATION_TOKEN": "bench-verification-token",
+    "VIBER_TOKEN": "bench-viber-token",
+    "FACEBOOK_API_VERSION": "17.0",
+    "FACEBOOK_PAGE_ID": "104729301829374",
+    "FACEBOOK_PAGE_TOKEN": "bench-page-token",
+    "FACEBOOK_APP_SECRET": "bench-app-secret",
+}
+
+# Files the app writes during a run; the directory is removed when the process exits
+_directory: tempfile.TemporaryDirectory | None = None
+
+
+def set_environment(**overrides: str) -> None:
+    """
+    Fills the environment with placeholder settings. Settings are read on import of unapi,
+    so it must be called before unapi is imported. Variables that are already set are kept
+    :param overrides: additional variables, by name
+    :return: None
+    """
+    global _directory
+    if _directory is None:
+        _directory = tempfile.TemporaryDirectory(prefix="unapi-bench-", ignore_cleanup_errors=True)
+    directory = _directory.name
+    defaults = {
+        **_environment,
+        "LOCAL_STORAGE_PATH": os.path.join(directory, "storage"),
+        "STATE_PATH": os.path.join(directory, "state.sqlite3"),
+        "EVENT_LOG_PATH": os.path.join(directory, "eventlog"),
+        **overrides,
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+def load_payload(platform: str) -> bytes:
+    """
+    Reads a recorded webhook body of a platform
+    :param platform: platform name
+    :return: raw JSON body
+    """
+    with open(os.path.join(PAYLOADS_DIR, f"{platform}.json"), "rb") as f:
+        return f.read()
+
+
+def sign(platform: str, raw: bytes) -> Dict[str, str]:
+    """
+    Builds the headers that authenticate a webhook body of a platform with the current settings
+    :param platform: platform name
+    :param raw: raw body
+    :return: headers, including Content-Type
+    """
+    from unapi.settings import settings
+
+    def signature(secret: str) -> str:
+        return hmac.new(secret.encode("utf-8"), raw, hashlib.sha256).hexdigest()
+
+    headers = {"Content-Type": "application/json"}
+    if platform == "telegram":
+        headers["X-Telegram-Bot-Api-Secret-Token"] = settings.telegram_verification_token
+    elif platform == "viber":
+        headers["X-Viber-Content-Signature"] = signature(settings.viber_token)
+    elif platform == "facebook":
+        headers["X-Hub-Signature-256"] = "sha256=" + signature(settings.facebook_app_secret)
+    else:
+        raise ValueError(f"Unknown platform {platform}")
+    return headers
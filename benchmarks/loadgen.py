@@ -0,0 +1,221 @@
+"""
+End-to-end load generator. Sends correctly signed webhooks at a target rate and reports latency,
+throughput and outbound calls. Replies go to stand-in platform servers, see benchmarks/stubs.py.
+
+By default the ASGI app from unapi.main is driven in-process, sharing the event loop and CPU with the generator:
+
+    python -m benchmarks.loadgen --rps 500 --duration 30 --mix telegram=2,viber=1,facebook=1 --latency 0.05
+
+To load a separately running server, start it with TELEGRAM_API_URL=http://127.0.0.1:8081,
+VIBER_API_URL=http://127.0.0.1:8081/pa/ and FACEBOOK_GRAPH_URL=http://127.0.0.1:8081 and the same credentials:
+
+    python -m benchmarks.loadgen --url https://127.0.0.1:8443 --stub-port 8081 --rps 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.common import load_payload, set_environment, sign
+from benchmarks.stubs import PlatformStubs
+
+
+class PayloadFactory:
+    """
+    Builds signed webhooks from recorded payloads. Every body gets a new delivery id, so none is dropped
+    as a redelivery, and a chat picked out of `chats`, so per-chat rate limits apply as in production
+    """
+
+    def __init__(self, mix: Dict[str, float], chats: int, seed: int | None = None) -> None:
+        self.platforms = list(mix)
+        self.weights = list(mix.values())
+        self.chats = chats
+        self.random = random.Random(seed)
+        self.templates = {name: json.loads(load_payload(name)) for name in self.platforms}
+        self.count = 0
+
+    def _body(self, platform: str, chat: int) -> dict:
+        body = self.templates[platform]
+        n = self.count
+        if platform == "telegram":
+            body["update_id"] = n
+            body["message"]["message_id"] = n
+            body["message"]["chat"]["id"] = chat
+        elif platform == "viber":
+            body["message_token"] = n
+            body["sender"]["id"] = f"chat{chat}="
+        elif platform == "facebook":
+            messaging = body["entry"][0]["messaging"][0]
+            messaging["message"]["mid"] = f"m_{n}"
+            messaging["sender"]["id"] = str(chat)
+        return body
+
+    def next(self) -> tuple:
+        """
+        :return: str - platform name, dict - headers, bytes - raw body
+        """
+        self.count += 1
+        platform = self.random.choices(self.platforms, self.weights)[0]
+        raw = json.dumps(self._body(platform, self.random.randrange(self.chats)), separators=(",", ":")).encode()
+        return platform, sign(platform, raw), raw
+
+
+class LoadResult:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.statuses = Counter()
+        self.by_platform = Counter()
+        self.failures = Counter()
+        self.elapsed = 0.0
+        self.lag = 0.0
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> float:
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def report(self, outbound: dict | None = None, app_stats: dict | None = None) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": sum(self.by_platform.values()),
+            "by_platform": dict(self.by_platform),
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "failures": dict(self.failures),
+            "elapsed": self.elapsed,
+            "throughput": len(latencies) / self.elapsed if self.elapsed else 0.0,
+            "max_lag": self.lag,
+            "latency_ms": {
+                "p50": self._percentile(latencies, 0.5) * 1000,
+                "p90": self._percentile(latencies, 0.9) * 1000,
+                "p99": self._percentile(latencies, 0.99) * 1000,
+                "max": (latencies[-1] if latencies else 0.0) * 1000,
+            },
+            "outbound": outbound,
+            "app": app_stats,
+        }
+
+
+async def generate(client: httpx.AsyncClient, path: str, payloads: PayloadFactory, rps: float,
+                   duration: float) -> LoadResult:
+    """
+    Sends webhooks on an open-loop schedule: a request is started at its planned time whether or not
+    earlier ones are answered, so a slow server builds up latency instead of slowing the generator down
+    :param client: a client bound to the app or server under test
+    :param path: webhook path
+    :param payloads: a payload factory
+    :param rps: target requests per second
+    :param duration: duration of the run in seconds
+    :return: the result of the run
+    """
+    result = LoadResult()
+    loop = asyncio.get_running_loop()
+
+    async def send(platform: str, headers: dict, raw: bytes) -> None:
+        start = time.perf_counter()
+        try:
+            response = await client.post(path, content=raw, headers=headers)
+            result.statuses[response.status_code] += 1
+        except httpx.HTTPError as e:
+            result.failures[type(e).__name__] += 1
+            return
+        result.latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    start = loop.time()
+    for n in range(int(rps * duration)):
+        delay = start + n / rps - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            result.lag = max(result.lag, -delay)
+        platform, headers, raw = payloads.next()
+        result.by_platform[platform] += 1
+        tasks.append(asyncio.create_task(send(platform, headers, raw)))
+    await asyncio.gather(*tasks)
+    result.elapsed = loop.time() - start
+    return result
+
+
+async def run(args: argparse.Namespace) -> dict:
+    stubs = PlatformStubs(args.latency, args.jitter, args.error_rate, args.error_status, args.seed)
+    stub_url = await stubs.start(port=args.stub_port)
+    set_environment(
+        TELEGRAM_API_URL=stub_url, VIBER_API_URL=f"{stub_url}/pa/", FACEBOOK_GRAPH_URL=stub_url,
+        DEDUP_BACKEND="memory",
+    )
+    from unapi.settings import settings
+
+    payloads = PayloadFactory(args.mix, args.chats, args.seed)
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    try:
+        if args.url:
+            async with httpx.AsyncClient(base_url=args.url, limits=limits, verify=False,
+                                         timeout=args.timeout) as client:
+                result = await generate(client, settings.webhook_path, payloads, args.rps, args.duration)
+                await asyncio.sleep(args.drain)
+                app_stats = (await client.get("/stats")).json()
+        else:
+            # Imported only now, so the app picks up the stub urls
+            from unapi import main
+            await main.startup()
+            try:
+                async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://unapi",
+                                             timeout=args.timeout) as client:
+                    result = await generate(client, settings.webhook_path, payloads, args.rps, args.duration)
+                    app_stats = (await client.get("/stats")).json()
+            finally:
+                # Drains the outbound queue, so every reply reaches the stubs before they are counted
+                await main.shutdown()
+        return result.report(stubs.stats(), app_stats)
+    finally:
+        await stubs.stop()
+
+
+def _mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load generator")
+    parser.add_argument("--url", help="base url of a running server; the app is driven in-process if omitted")
+    parser.add_argument("--rps", type=float, default=200, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="duration of the run in seconds")
+    parser.add_argument("--mix", type=_mix, default=_mix("telegram,viber,facebook"),
+                        help="platform weights, e.g. telegram=2,viber=1,facebook=1")
+    parser.add_argument("--chats", type=int, default=10000, help="number of distinct chats")
+    parser.add_argument("--connections", type=int, default=100, help="connection pool size with --url")
+    parser.add_argument("--timeout", type=float, default=30, help="request timeout in seconds")
+    parser.add_argument("--drain", type=float, default=2, help="seconds to wait for replies after a run with --url")
+    parser.add_argument("--stub-port", type=int, default=0, help="port of the stub servers, 0 picks a free one")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra stub delay of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub calls answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of stub errors")
+    parser.add_argument("--seed", type=int, help="seed for reproducible runs")
+    parser.add_argument("--output", help="file to write the report to as JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Stand-in servers of the Telegram Bot API, Viber send_message and broadcast_message, and the Graph
+/messages and batch endpoints.
+Point the app at them with TELEGRAM_API_URL, VIBER_API_URL and FACEBOOK_GRAPH_URL.
+
+    python -m benchmarks.stubs --port 8081 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+from collections import Counter
+
+from aiohttp import web
+
+
+class PlatformStubs:
+    """
+    One aiohttp app that answers outbound calls of every platform after a configurable latency.
+    A share of calls, `error_rate`, is answered with `error_status` instead
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 500, seed: int | None = None) -> None:
+        """
+        :param latency: delay of every response in seconds
+        :param jitter: a random delay of up to this many seconds added to `latency`
+        :param error_rate: share of calls answered with an error, from 0 to 1
+        :param error_status: HTTP status of error responses, e.g. 429 to test retries
+        :param seed: seed of latency and error randomness, for reproducible runs
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.runner: web.AppRunner | None = None
+        self.url: str | None = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.telegram)
+        app.router.add_post("/pa/{method}", self.viber)
+        app.router.add_post("/v{version}/{page_id}/messages", self.graph)
+        app.router.add_post("/v{version}/", self.graph_batch)
+        app.router.add_get("/stats", self.stats_handler)
+        return app
+
+    async def _respond(self, endpoint: str, body: dict | list, error_body: dict) -> web.Response:
+        self.calls[endpoint] += 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors[endpoint] += 1
+            headers = {"Retry-After": "1"} if self.error_status == 429 else None
+            return web.json_response(error_body, status=self.error_status, headers=headers)
+        return web.json_response(body)
+
+    async def telegram(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if method == "getFile":
+            result = {"file_id": request.query.get("file_id"), "file_path": "photos/file_1.jpg"}
+        else:
+            result = {"message_id": self.calls[f"telegram.{method}"]}
+        return await self._respond(f"telegram.{method}", {"ok": True, "result": result}, {
+            "ok": False, "error_code": self.error_status, "description": "Stub error",
+            "parameters": {"retry_after": 1},
+        })
+
+    async def viber(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        return await self._respond(f"viber.{method}", {
+            "status": 0, "status_message": "ok", "message_token": self.calls[f"viber.{method}"],
+        }, {"status": 1, "status_message": "Stub error"})
+
+    async def graph(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        return await self._respond("facebook.messages", {
+            "recipient_id": body.get("recipient", {}).get("id"), "message_id": f"m_{self.calls['facebook.messages']}",
+        }, {"error": {"message": "Stub error", "code": self.error_status}})
+
+    async def graph_batch(self, request: web.Request) -> web.Response:
+        # Every batched request succeeds, an error fails the whole batch
+        batch = (await request.json()).get("batch", [])
+        self.calls["facebook.batch_requests"] += len(batch)
+        return await self._respond("facebook.batch", [
+            {"code": 200, "headers": [], "body": f'{{"message_id": "m_{n}"}}'} for n in range(len(batch))
+        ], {"error": {"message": "Stub error", "code": self.error_status}})
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Starts serving in the running event loop
+        :param host: host to bind
+        :param port: port to bind, 0 picks a free one
+        :return: base url of the servers
+        """
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stand-in servers of platform APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra delay of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered with an error")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of error responses")
+    args = parser.parse_args()
+
+    stubs = PlatformStubs(args.latency, args.jitter, args.error_rate, args.error_status)
+    web.run_app(stubs.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from unapi import outbound
+from unapi.broadcast import broadcast
+from unapi.platforms.viber.event import ViberEvent
+from unapi.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture(autouse=True)
+def limiter(mocker):
+    # Every recipient takes a token, the Viber limit would make these tests wait for seconds
+    limiter = RateLimiter(None, None)
+    mocker.patch.dict(outbound.queue.limiters, {'viber': limiter})
+    return limiter
+
+
+class TestBroadcast:
+    #  Tests that recipients are sent in batches of the platform size, with duplicates dropped
+    @pytest.mark.anyio
+    async def test_batches(self, mocker):
+        send = mocker.patch.object(ViberEvent, 'send_batch_async', side_effect=lambda ids, text: [None] * len(ids))
+        progress = mocker.Mock()
+        chat_ids = [str(i) for i in range(700)] + ['0']
+        result = await broadcast('viber', chat_ids, 'Hello', progress=progress, concurrency=2)
+        assert sorted(len(call.args[0]) for call in send.call_args_list) == [100, 300, 300]
+        assert (result.total, result.sent, result.failed, result.calls) == (700, 700, {}, 3)
+        assert progress.call_count == 3
+
+    #  Tests that every recipient of a call is charged to the rate limit of the platform
+    @pytest.mark.anyio
+    async def test_rate_limit(self, mocker, limiter):
+        mocker.patch.object(ViberEvent, 'send_batch_async', side_effect=lambda ids, text: [None] * len(ids))
+        acquire = mocker.spy(limiter, 'acquire')
+        await broadcast('viber', [str(i) for i in range(400)], 'Hello')
+        assert sorted(call.args[1] for call in acquire.call_args_list) == [100, 300]
+
+    #  Tests that failed recipients are recorded, and only they are sent again when the broadcast is resumed
+    @pytest.mark.anyio
+    async def test_resume(self, mocker, tmp_path):
+        checkpoint = str(tmp_path / 'broadcast.jsonl')
+        mocker.patch.object(ViberEvent, 'send_batch_async',
+                            side_effect=lambda ids, text: ['blocked' if i == 'b' else None for i in ids])
+        result = await broadcast('viber', ['a', 'b', 'c'], 'Hello', checkpoint=checkpoint)
+        assert result.sent == 2 and result.failed == {'b': 'blocked'}
+        with open(checkpoint) as f:
+            assert [json.loads(line)['chat_id'] for line in f] == ['a', 'b', 'c']
+
+        send = mocker.patch.object(ViberEvent, 'send_batch_async', side_effect=ConnectionError('timeout'))
+        result = await broadcast('viber', ['a', 'b', 'c'], 'Hello', checkpoint=checkpoint)
+        send.assert_called_once_with(['b'], 'Hello')
+        assert result.skipped == 2 and result.failed == {'b': 'timeout'}
+
+    #  Tests that receivers of the Viber failed_list are reported as failed
+    @pytest.mark.anyio
+    async def test_viber_failed_list(self, mocker):
+        mocker.patch('unapi.platforms.viber.api.broadcast_message_async', return_value=(200, {
+            'status': 0,
+            'failed_list': [{'receiver': 'b', 'status': 6, 'status_message': 'Not subscribed'}],
+        }))
+        assert await ViberEvent.send_batch_async(['a', 'b'], 'Hello') == [None, 'Not subscribed']
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from unapi.cache import TTLCache
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def cache():
+    cache = TTLCache('test', maxsize=2, ttl=60)
+    yield cache
+    TTLCache.instances.remove(cache)
+
+
+class TestTTLCache:
+    #  Tests that the least recently used entry is evicted first
+    def test_lru_eviction(self, cache):
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1 and cache.get('c') == 3
+
+    #  Tests that entries expire after ttl
+    def test_expiry(self, cache, mocker):
+        cache.set('a', 1)
+        mocker.patch('time.monotonic', return_value=10 ** 9)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    #  Tests that hits and misses are counted
+    def test_stats(self, cache):
+        loader = lambda: 'value'
+        assert cache.get_or_load('a', loader) == 'value'
+        assert cache.get_or_load('a', loader) == 'value'
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    #  Tests that concurrent loads of one key call the loader once
+    @pytest.mark.anyio
+    async def test_collapse_concurrent_loads(self, cache):
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        results = await asyncio.gather(*(cache.get_or_load_async('a', load) for _ in range(10)))
+        assert results == ['value'] * 10
+        assert len(calls) == 1
+        assert cache.collapsed == 9
+
+    #  Tests that a failed load is propagated to every waiter and not cached
+    @pytest.mark.anyio
+    async def test_failed_load(self, cache):
+        async def load():
+            await asyncio.sleep(0.01)
+            raise ValueError('Error getting file path')
+
+        results = await asyncio.gather(*(cache.get_or_load_async('a', load) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert cache.get('a') is None
@@ -0,0 +1,38 @@
+import pytest
+
+from unapi.client import ApiClient
+
+
+@pytest.fixture
+def client():
+    client = ApiClient('test', 'https://api.test/', headers={'X-Token': 'token'}, timeout=5)
+    yield client
+    ApiClient.instances.remove(client)
+
+
+class TestApiClient:
+    #  Tests that blocking calls reuse one session with prebuilt headers and a timeout
+    def test_post_sync(self, client, mocker):
+        request = mocker.patch('requests.Session.request',
+                               return_value=mocker.Mock(status_code=200, content=b'{"ok": true}'))
+        assert client.post_sync(client.url('send'), {'a': 1}) == (200, {'ok': True})
+        assert client.post_sync(client.url('send'), {'a': 2}) == (200, {'ok': True})
+        assert request.call_args.kwargs['timeout'] == 5
+        assert request.call_args.args == ('POST', 'https://api.test/send')
+        assert client.sync_session.headers['X-Token'] == 'token'
+        assert client.sync_session.headers['Content-Type'] == 'application/json'
+
+    #  Tests that a non-JSON response body is returned as None
+    def test_non_json_response(self, client, mocker):
+        mocker.patch('requests.Session.request', return_value=mocker.Mock(status_code=502, content=b'Bad gateway'))
+        assert client.get_sync(client.url('get')) == (502, None)
+
+    #  Tests that the async session is created lazily, reused and closed
+    @pytest.mark.anyio
+    @pytest.mark.parametrize('anyio_backend', ['asyncio'])
+    async def test_session_lifecycle(self, client, anyio_backend):
+        session = client.session
+        assert client.session is session
+        await ApiClient.close_all()
+        assert session.closed
+        assert client._session is None
@@ -0,0 +1,84 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from unapi.cluster import Cluster, FileMembership, HashRing, MemoryMembership, PLATFORM_HEADER, SIGNATURE_HEADER
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+class TestHashRing:
+    #  Tests that keys are spread over nodes and a new node takes over only a fraction of them
+    def test_balance_and_movement(self):
+        keys = [f'telegram:{i}' for i in range(10000)]
+        ring = HashRing(['a', 'b', 'c'])
+        owners = {key: ring.owner(key) for key in keys}
+        for node in 'abc':
+            assert 2500 < list(owners.values()).count(node) < 4200
+        bigger = HashRing(['a', 'b', 'c', 'd'])
+        moved = [key for key in keys if bigger.owner(key) != owners[key]]
+        assert all(bigger.owner(key) == 'd' for key in moved)
+        assert len(moved) < 3500
+
+    #  Tests that an empty ring has no owners
+    def test_empty(self):
+        assert HashRing().owner('viber:1') is None
+
+
+class TestMembership:
+    #  Tests that nodes in the membership file expire without heartbeats and can leave
+    @pytest.mark.anyio
+    async def test_file(self, tmp_path, mocker):
+        backend = FileMembership(str(tmp_path / 'cluster.json'), ttl=10)
+        await backend.heartbeat('a', 'http://a')
+        await backend.heartbeat('b', 'http://b')
+        assert await backend.members() == {'a': 'http://a', 'b': 'http://b'}
+        await backend.leave('a')
+        assert await backend.members() == {'b': 'http://b'}
+        mocker.patch('unapi.cluster.time.time', return_value=2e10)
+        assert await backend.members() == {}
+
+
+class TestCluster:
+    #  Tests that nodes agree on owners and a forwarded event is verified with the shared secret
+    @pytest.mark.anyio
+    async def test_forward(self, mocker):
+        backend = MemoryMembership()
+        a = Cluster('a', 'http://a', backend, 'secret')
+        b = Cluster('b', 'http://b', backend, 'secret')
+        await a.refresh()
+        await b.refresh()
+        await a.refresh()
+        chat_id = next(i for i in range(100) if a.owner('viber', i)[0] == 'b')
+        assert b.owner('viber', chat_id) == ('b', 'http://b') and b.is_local('viber', chat_id)
+
+        request = mocker.patch.object(a.client, 'request', return_value=(200, 'OK'))
+        assert await a.forward('http://b', 'viber', b'{}')
+        method, url, body = request.call_args.args
+        headers = request.call_args.kwargs['headers']
+        assert url == 'http://b/cluster/forward'
+        b.receive(headers[PLATFORM_HEADER], body, headers[SIGNATURE_HEADER])
+        for platform, signature in (('viber', 'forged'), ('telegram', headers[SIGNATURE_HEADER])):
+            with pytest.raises(ValueError):
+                b.receive(platform, body, signature)
+
+    #  Tests that only an owner that could not be connected to lets the event be handled locally
+    @pytest.mark.anyio
+    async def test_forward_errors(self, mocker):
+        a = Cluster('a', 'http://a', MemoryMembership(), 'secret')
+        refused = aiohttp.ClientConnectorError(mocker.Mock(), ConnectionRefusedError('refused'))
+        mocker.patch.object(a.client, 'request', side_effect=refused)
+        assert not await a.forward('http://b', 'viber', b'{}')
+        mocker.patch.object(a.client, 'request', return_value=(503, 'Unavailable'))
+        assert not await a.forward('http://b', 'viber', b'{}')
+        mocker.patch.object(a.client, 'request', return_value=(500, 'Internal Server Error'))
+        with pytest.raises(ValueError):
+            await a.forward('http://b', 'viber', b'{}')
+        mocker.patch.object(a.client, 'request', side_effect=asyncio.TimeoutError())
+        with pytest.raises(ValueError):
+            await a.forward('http://b', 'viber', b'{}')
+        assert a.stats()['forward_errors'] == 4
@@ -0,0 +1,78 @@
+import pytest
+
+from unapi.dedup import Deduplicator, MemoryDedupBackend
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+class TestMemoryDedupBackend:
+    #  Tests that a key is reported as seen on its second add
+    @pytest.mark.anyio
+    async def test_add(self):
+        backend = MemoryDedupBackend(ttl=60)
+        assert await backend.add('telegram:1') is False
+        assert await backend.add('telegram:1') is True
+        assert await backend.add('telegram:2') is False
+
+    #  Tests that keys expire once their bucket rotates out
+    @pytest.mark.anyio
+    async def test_expiry(self, mocker):
+        monotonic = mocker.patch('time.monotonic', return_value=0)
+        backend = MemoryDedupBackend(ttl=10, bucket_count=2)
+        await backend.add('telegram:1')
+        monotonic.return_value = 5
+        assert await backend.add('telegram:1') is True
+        monotonic.return_value = 25
+        assert await backend.add('telegram:2') is False
+        assert await backend.add('telegram:1') is False
+
+    #  Tests that keys expire after the ttl even if only one key was added since
+    @pytest.mark.anyio
+    async def test_expiry_sparse(self, mocker):
+        monotonic = mocker.patch('time.monotonic', return_value=0)
+        backend = MemoryDedupBackend(ttl=600)
+        await backend.add('telegram:1')
+        monotonic.return_value = 700
+        assert await backend.add('telegram:2') is False
+        assert await backend.add('telegram:1') is False
+        assert len(backend) == 2
+
+    #  Tests that the index size stays bounded
+    @pytest.mark.anyio
+    async def test_max_size(self, mocker):
+        monotonic = mocker.patch('time.monotonic', return_value=0)
+        backend = MemoryDedupBackend(ttl=100, max_size=10, bucket_count=10)
+        for i in range(100):
+            monotonic.return_value = i
+            await backend.add(str(i))
+        assert len(backend) <= 20
+
+    #  Tests that a discarded key is processed again
+    @pytest.mark.anyio
+    async def test_discard(self):
+        backend = MemoryDedupBackend()
+        await backend.add('viber:1')
+        await backend.discard('viber:1')
+        assert await backend.add('viber:1') is False
+
+
+class TestDeduplicator:
+    #  Tests that a redelivered event is detected by its delivery key
+    @pytest.mark.anyio
+    async def test_is_duplicate(self, mocker):
+        deduplicator = Deduplicator(MemoryDedupBackend())
+        event = mocker.Mock(delivery_key='facebook:mid.1')
+        assert await deduplicator.is_duplicate(event) is False
+        assert await deduplicator.is_duplicate(event) is True
+        assert deduplicator.stats() == {'checked': 2, 'duplicates': 1}
+
+    #  Tests that deduplication can be disabled
+    @pytest.mark.anyio
+    async def test_disabled(self, mocker):
+        deduplicator = Deduplicator(None)
+        event = mocker.Mock(delivery_key='facebook:mid.1')
+        assert await deduplicator.is_duplicate(event) is False
+        assert await deduplicator.is_duplicate(event) is False
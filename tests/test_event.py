@@ -0,0 +1,218 @@
+import hashlib
+import hmac
+
+import pytest
+from starlette.datastructures import Headers
+
+from unapi import jsonlib
+from unapi.context import RequestContext
+from unapi.event import EventFactory
+from unapi.platforms.telegram import TelegramEvent
+from unapi.platforms.viber import ViberEvent
+from unapi.platforms.facebook import FacebookEvent
+
+
+@pytest.fixture
+def make_request(mocker):
+    def make(headers: dict, body: bytes = b'{}'):
+        return mocker.Mock(headers=Headers(headers), body=mocker.AsyncMock(return_value=body))
+
+    return make
+
+
+class TestEventFactory:
+    #  Tests that each platform is picked by its discriminator header
+    @pytest.mark.parametrize('header, messenger', [
+        ('X-Telegram-Bot-Api-Secret-Token', TelegramEvent),
+        ('X-Viber-Content-Signature', ViberEvent),
+        ('X-Hub-Signature-256', FacebookEvent),
+    ])
+    def test_resolve_by_header(self, make_request, header, messenger):
+        request = make_request({'Content-Type': 'application/json', header: 'value'})
+        assert EventFactory.resolve(request) is messenger
+
+    #  Tests that a request without any discriminator header is not resolved
+    def test_resolve_unknown(self, make_request):
+        assert EventFactory.resolve(make_request({'Content-Type': 'application/json'})) is None
+
+    #  Tests that an unknown origin is rejected before the body is read
+    @pytest.mark.anyio
+    async def test_create_event_unknown_origin(self, make_request):
+        request = make_request({})
+        with pytest.raises(ValueError, match='Unknown request origin'):
+            await EventFactory.create_event(request)
+        request.body.assert_not_called()
+
+    #  Tests that only the resolved platform is tried
+    @pytest.mark.anyio
+    async def test_create_event_invalid(self, make_request, mocker):
+        telegram = mocker.patch.object(TelegramEvent, 'create_if_valid', return_value=None)
+        viber = mocker.patch.object(ViberEvent, 'create_if_valid')
+        with pytest.raises(ValueError, match='Invalid TelegramEvent request'):
+            await EventFactory.create_event(make_request({'X-Telegram-Bot-Api-Secret-Token': 'wrong'}))
+        telegram.assert_called_once()
+        viber.assert_not_called()
+
+    #  Tests that a header cannot be claimed by two platforms
+    def test_register_duplicate_header(self):
+        with pytest.raises(ValueError):
+            EventFactory.register('X-Telegram-Bot-Api-Secret-Token')(ViberEvent)
+
+
+class TestRequestContext:
+    #  Tests that the body is decoded only once however many times the payload is read
+    def test_payload_decoded_once(self, mocker):
+        loads = mocker.spy(jsonlib, 'loads')
+        context = RequestContext(Headers({}), b'{"object": "page"}')
+        assert context.payload == {'object': 'page'}
+        assert context.payload == {'object': 'page'}
+        loads.assert_called_once()
+
+    #  Tests that an invalid body raises ValueError
+    def test_payload_invalid(self):
+        with pytest.raises(ValueError):
+            RequestContext(Headers({}), b'not json').payload
+
+    #  Tests that the body is validated straight from bytes, without decoding it to a dict
+    @pytest.mark.anyio
+    async def test_facebook_is_request_valid_from_bytes(self, mocker):
+        from unapi.platforms.facebook.event import facebook_app_secret
+        raw = b'{"object": "page", "entry": []}'
+        signature = hmac.new(facebook_app_secret.encode('utf-8'), raw, hashlib.sha256).hexdigest()
+        loads = mocker.spy(jsonlib, 'loads')
+        context = RequestContext(Headers({'X-Hub-Signature-256': f'sha256={signature}'}), raw)
+        assert await FacebookEvent.is_request_valid(context)
+        loads.assert_not_called()
+
+    #  Tests that a body without the discriminator key is rejected before validation
+    @pytest.mark.anyio
+    async def test_is_request_valid_no_marker(self, mocker):
+        from unapi.platforms.telegram.event import telegram_verification_token
+        from unapi.platforms.telegram.model import Model
+        validate = mocker.spy(Model, 'model_validate_json')
+        context = RequestContext(Headers({'X-Telegram-Bot-Api-Secret-Token': telegram_verification_token}), b'{}')
+        assert await TelegramEvent.is_request_valid(context) is None
+        validate.assert_not_called()
+
+    #  Tests that a Facebook body of another object type is rejected
+    @pytest.mark.anyio
+    async def test_facebook_other_object(self):
+        from unapi.platforms.facebook.event import facebook_app_secret
+        raw = b'{"object": "user", "entry": []}'
+        signature = hmac.new(facebook_app_secret.encode('utf-8'), raw, hashlib.sha256).hexdigest()
+        context = RequestContext(Headers({'X-Hub-Signature-256': f'sha256={signature}'}), raw)
+        assert await FacebookEvent.is_request_valid(context) is None
+
+    #  Tests that a missing or malformed signature header is rejected instead of raising
+    @pytest.mark.anyio
+    @pytest.mark.parametrize('headers, event', [
+        ({}, FacebookEvent),
+        ({'X-Hub-Signature-256': 'sha256'}, FacebookEvent),
+        ({'X-Hub-Signature-256': 'sha256=\u00e9'}, FacebookEvent),
+        ({}, ViberEvent),
+        ({'X-Viber-Content-Signature': '\u00e9'}, ViberEvent),
+    ])
+    async def test_is_request_authentic_malformed(self, headers, event):
+        assert not await event.is_request_authentic(RequestContext(Headers(headers), b'{}'))
+
+    #  Tests that a body that is not JSON is rejected instead of raising
+    @pytest.mark.anyio
+    async def test_is_request_valid_invalid_json(self):
+        from unapi.platforms.telegram.event import telegram_verification_token
+        context = RequestContext(Headers({'X-Telegram-Bot-Api-Secret-Token': telegram_verification_token}), b'not json')
+        assert await TelegramEvent.is_request_valid(context) is None
+
+
+class TestFacebookBatch:
+    @pytest.fixture
+    def context(self):
+        from unapi.platforms.facebook.event import facebook_app_secret
+
+        def messaging(sender, text):
+            return {'sender': {'id': sender}, 'recipient': {'id': 'page'}, 'timestamp': 1,
+                    'message': {'mid': f'mid.{sender}', 'text': text}}
+
+        raw = jsonlib.dumps({'object': 'page', 'entry': [
+            {'id': 'page', 'time': 1, 'messaging': [messaging('1', 'a'), messaging('2', 'b')]},
+            {'id': 'page', 'time': 2, 'messaging': [
+                messaging('3', 'c'),
+                {'sender': {'id': '3'}, 'recipient': {'id': 'page'}, 'timestamp': 2, 'delivery': {'mids': []}},
+            ]},
+        ]})
+        signature = hmac.new(facebook_app_secret.encode('utf-8'), raw, hashlib.sha256).hexdigest()
+        return RequestContext(Headers({'X-Hub-Signature-256': f'sha256={signature}'}), raw)
+
+    #  Tests that every batched message becomes an event and receipts are skipped
+    @pytest.mark.anyio
+    async def test_fan_out(self, context):
+        events = await FacebookEvent.create_all_if_valid(context)
+        assert [(event.chat_id, event.text) for event in events] == [('1', 'a'), ('2', 'b'), ('3', 'c')]
+
+    #  Tests that the signature is checked once per request, not once per item
+    @pytest.mark.anyio
+    async def test_authenticated_once(self, context, mocker):
+        authentic = mocker.spy(FacebookEvent, 'is_request_authentic')
+        await FacebookEvent.create_all_if_valid(context)
+        authentic.assert_called_once()
+
+
+class TestAttachmentsAsync:
+    @pytest.fixture
+    def event(self):
+        from unapi.platforms.facebook.model import Model
+        attachments = [{'type': 'image', 'payload': {'url': f'https://cdn.test/{i}.png?x=1'}} for i in range(3)]
+        return FacebookEvent.create(Model.model_validate({'object': 'page', 'entry': [{'id': 'page', 'time': 1, 'messaging': [
+            {'sender': {'id': '1'}, 'recipient': {'id': 'page'}, 'timestamp': 1,
+             'message': {'mid': 'mid.1', 'attachments': attachments}},
+        ]}]}))
+
+    #  Tests that attachments are downloaded concurrently, in about the time of the slowest one
+    @pytest.mark.anyio
+    @pytest.mark.parametrize('anyio_backend', ['asyncio'])
+    async def test_download_attachments_concurrently(self, event, mocker, anyio_backend):
+        import asyncio
+        import time
+
+        async def download(attachment, save=True, stream=False):
+            await asyncio.sleep(0.1)
+            return attachment.name
+
+        mocker.patch('unapi.attachment.download_attachment_async', side_effect=download)
+        start = time.monotonic()
+        assert await event.download_attachments_async() == ['0', '1', '2']
+        assert time.monotonic() - start < 0.25
+
+    #  Tests that Telegram resolves attachments through the awaitable getFile and caches them
+    @pytest.mark.anyio
+    @pytest.mark.parametrize('anyio_backend', ['asyncio'])
+    async def test_telegram_attachments_async(self, mocker, anyio_backend):
+        from unapi.platforms.telegram import api
+        from unapi.platforms.telegram.model import Model
+        get_file = mocker.patch.object(api, 'get_file_async', return_value='photos/file_1.jpg')
+        event = TelegramEvent.create(Model.model_validate({'update_id': 1, 'message': {
+            'message_id': 1, 'date': 1, 'caption': 'hi',
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'a', 'username': 'a', 'language_code': 'en'},
+            'chat': {'id': 1, 'first_name': 'a', 'username': 'a', 'type': 'private'},
+            'photo': [{'file_id': 'small', 'file_unique_id': 's', 'file_size': 1, 'width': 1, 'height': 1},
+                      {'file_id': 'big', 'file_unique_id': 'b', 'file_size': 2, 'width': 2, 'height': 2}],
+        }}))
+        attachments = await event.get_attachments_async()
+        assert [attachment.name for attachment in attachments] == ['file_1']
+        assert attachments[0].url == api.file_url('photos/file_1.jpg')
+        assert event.attachments is attachments
+        get_file.assert_called_once_with('big', 'b')
+
+    #  Tests that the raw body of an event creates an equal event without resolving its attachments
+    def test_to_raw(self, mocker):
+        from unapi.platforms.telegram import api
+        from unapi.platforms.telegram.model import Model
+        get_file = mocker.patch.object(api, 'get_file_async')
+        event = TelegramEvent.create(Model.model_validate({'update_id': 1, 'message': {
+            'message_id': 1, 'date': 1, 'caption': 'hi',
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'a', 'username': 'a', 'language_code': 'en'},
+            'chat': {'id': 1, 'first_name': 'a', 'username': 'a', 'type': 'private'},
+            'photo': [{'file_id': 'big', 'file_unique_id': 'b', 'file_size': 2, 'width': 2, 'height': 2}],
+        }}))
+        [copy] = TelegramEvent.create_all_from_raw(event.to_raw())
+        assert copy.original == event.original
+        get_file.assert_not_called()
@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+import pytest
+
+from unapi.eventlog import EventLog, LogConsumer
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+class TestEventLog:
+    #  Tests that concurrent appends are committed together and read back in order
+    @pytest.mark.anyio
+    async def test_group_commit(self, tmp_path):
+        log = EventLog(str(tmp_path))
+        offsets = await asyncio.gather(*(log.append('telegram', b'{"n": %d}' % i) for i in range(50)))
+        assert offsets == sorted(offsets)
+        assert log.stats()['commits'] < 50
+        entries = log.read(0)
+        assert [entry.raw for entry in entries] == [b'{"n": %d}' % i for i in range(50)]
+        assert entries[0].platform == 'telegram' and entries[1].offset == entries[0].next_offset
+        await log.stop()
+
+    #  Tests that records span segments, survive a reopen and that an incomplete last record is dropped
+    @pytest.mark.anyio
+    async def test_segments_and_recovery(self, tmp_path):
+        log = EventLog(str(tmp_path), segment_size=64)
+        for i in range(5):
+            await log.append('viber', b'x' * 30 + b'%d' % i)
+        await log.stop()
+        segments = sorted(name for name in os.listdir(tmp_path) if name.endswith('.log'))
+        assert len(segments) == 5
+        with open(tmp_path / segments[-1], 'ab') as f:
+            f.write(b'\x10\x00\x00\x00partial')
+
+        log = EventLog(str(tmp_path), segment_size=64)
+        log.open()
+        assert log.recovered == 1
+        assert [entry.raw[-1:] for entry in log.read(0)] == [b'0', b'1', b'2', b'3', b'4']
+        await log.stop()
+
+    #  Tests that a consumer resumes from its committed offset and deletes segments it is done with
+    @pytest.mark.anyio
+    async def test_consumer(self, tmp_path):
+        log = EventLog(str(tmp_path), segment_size=64)
+        handled = []
+
+        async def handler(platform, raw):
+            handled.append(raw)
+
+        for i in range(3):
+            await log.append('facebook', b'y' * 30 + b'%d' % i)
+        consumer = LogConsumer(log, 'main', handler)
+        consumer.start()
+        while consumer.offset < log.committed:
+            await asyncio.sleep(0.01)
+        await consumer.stop()
+        assert len(handled) == 3
+        assert log.stats()['segments'] == 1
+
+        await log.append('facebook', b'y' * 30 + b'3')
+        consumer = LogConsumer(log, 'main', handler)
+        consumer.start()
+        while consumer.offset < log.committed:
+            await asyncio.sleep(0.01)
+        await consumer.stop()
+        assert handled[-1].endswith(b'3') and len(handled) == 4
+        await log.stop()
+
+    #  Tests that a consumer skips the rest of a segment with a corrupt record and reports one it cannot skip
+    @pytest.mark.anyio
+    async def test_consumer_corrupt(self, tmp_path):
+        log = EventLog(str(tmp_path), segment_size=64)
+        handled = []
+
+        async def handler(platform, raw):
+            handled.append(raw)
+
+        for i in range(3):
+            await log.append('viber', b'z' * 30 + b'%d' % i)
+        segments = sorted(name for name in os.listdir(tmp_path) if name.endswith('.log'))
+        for name in (segments[0], segments[-1]):
+            with open(tmp_path / name, 'r+b') as f:
+                f.seek(-1, os.SEEK_END)
+                f.write(b'!')
+        consumer = LogConsumer(log, 'main', handler)
+        consumer.start()
+        while consumer.stats()['running']:
+            await asyncio.sleep(0.01)
+        stats = consumer.stats()
+        assert handled == [b'z' * 30 + b'1']
+        assert stats['skipped'] > 0 and 'corrupt' in stats['error']
+        await consumer.stop()
+        await log.stop()
+
+    #  Tests that after a failed fsync nothing more is committed and appends are refused
+    @pytest.mark.anyio
+    async def test_commit_failed(self, tmp_path, mocker):
+        log = EventLog(str(tmp_path))
+        await log.append('viber', b'{"n": 0}')
+        committed = log.committed
+        mocker.patch('unapi.eventlog._fsync', side_effect=[OSError('EIO'), None])
+        with pytest.raises(OSError):
+            await log.append('viber', b'{"n": 1}')
+        with pytest.raises(ValueError):
+            await log.append('viber', b'{"n": 2}')
+        assert log.committed == committed
+        assert log.stats()['commit_errors'] == 1 and log.stats()['failed']
+        await log.stop()
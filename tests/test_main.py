@@ -24,6 +24,15 @@ class TestMain:
         assert response.status_code == 200
         assert response.json() == "I'm ok"
 
+    #  Tests that metrics are exposed in the Prometheus text format
+    @pytest.mark.anyio
+    @pytest.mark.parametrize('anyio_backend', ['asyncio'])
+    async def test_metrics(self, client: AsyncClient, anyio_backend):
+        response = await client.get('/metrics')
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert '# TYPE unapi_stage_seconds histogram' in response.text
+
     # @pytest.mark.anyio
     # async def test_init(self, client: AsyncClient, mocker):
     #     mocker.patch('unapi.webhooks.init', return_value=None)
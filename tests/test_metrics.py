@@ -0,0 +1,59 @@
+import pytest
+from starlette.datastructures import Headers
+
+from unapi import metrics
+from unapi.context import RequestContext
+from unapi.metrics import Counter, Histogram
+from unapi.platforms.telegram import TelegramEvent
+from unapi.platforms.viber import ViberEvent
+
+
+@pytest.fixture
+def registry(mocker):
+    return mocker.patch.object(metrics.Metric, 'instances', [])
+
+
+class TestMetrics:
+    #  Tests that counters are rendered per label values in the Prometheus text format
+    def test_counter_render(self, registry):
+        counter = Counter('requests_total', 'Requests', ('platform',))
+        counter.inc('viber')
+        counter.inc('viber', amount=2)
+        assert metrics.render() == ('# HELP requests_total Requests\n# TYPE requests_total counter\n'
+                                    'requests_total{platform="viber"} 3\n')
+
+    #  Tests that histogram buckets are cumulative and end with +Inf
+    def test_histogram_render(self, registry):
+        histogram = Histogram('latency_seconds', 'Latency', ('stage',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'send')
+        histogram.observe(0.5, 'send')
+        histogram.observe(5, 'send')
+        assert metrics.render().splitlines()[2:] == [
+            'latency_seconds_bucket{stage="send",le="0.1"} 1',
+            'latency_seconds_bucket{stage="send",le="1.0"} 2',
+            'latency_seconds_bucket{stage="send",le="+Inf"} 3',
+            'latency_seconds_sum{stage="send"} 5.55',
+            'latency_seconds_count{stage="send"} 3',
+        ]
+
+    #  Tests that label values are escaped
+    def test_label_escaping(self, registry):
+        Counter('errors_total', 'Errors', ('cause',)).inc('a "quoted"\nvalue')
+        assert 'errors_total{cause="a \\"quoted\\"\\nvalue"} 1' in metrics.render()
+
+
+class TestFailureCauses:
+    #  Tests that a bad signature and a malformed body are counted as different causes
+    @pytest.mark.anyio
+    async def test_causes(self, mocker):
+        failures = mocker.patch.object(metrics, 'failures', Counter('failures_total', 'Failures', ('platform', 'cause')))
+        from unapi.platforms.telegram.event import telegram_verification_token
+        await ViberEvent.is_request_valid(RequestContext(Headers({'X-Viber-Content-Signature': 'wrong'}), b'{}'))
+        headers = Headers({'X-Telegram-Bot-Api-Secret-Token': telegram_verification_token})
+        await TelegramEvent.is_request_valid(RequestContext(headers, b'{"update_id": '))
+        await TelegramEvent.is_request_valid(RequestContext(headers, b'{"update_id": 1}'))
+        assert failures.values == {
+            ('viber', 'bad_signature'): 1,
+            ('telegram', 'invalid_json'): 1,
+            ('telegram', 'invalid_payload'): 1,
+        }
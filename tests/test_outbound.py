@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from unapi.outbound import SendQueue
+from unapi.ratelimit import RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+class Messenger:
+    platform = 'test'
+    rate_limit = 1000
+    chat_rate_limit = 10
+
+
+class TestTokenBucket:
+    #  Tests that a full bucket allows a burst up to its capacity and then asks to wait
+    def test_burst_then_delay(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        now = bucket.updated
+        for _ in range(2):
+            assert bucket.delay(now) == 0
+            bucket.consume()
+        assert bucket.delay(now) == pytest.approx(0.5)
+
+    #  Tests that tokens are refilled with time
+    def test_refill(self):
+        bucket = TokenBucket(rate=10, capacity=1)
+        now = bucket.updated
+        bucket.consume()
+        assert bucket.delay(now) > 0
+        assert bucket.delay(now + 0.2) == pytest.approx(0)
+
+
+class TestRateLimiter:
+    #  Tests that messages to one chat are spaced by the per-chat limit
+    @pytest.mark.anyio
+    async def test_per_chat_limit(self):
+        limiter = RateLimiter(rate=None, chat_rate=20)
+        assert await limiter.acquire(1) == 0
+        assert await limiter.acquire(2) == 0
+        assert await limiter.acquire(1) >= 0.04
+        assert limiter.throttled == 1
+
+    #  Tests that a call sending many messages takes a token per message, and may go into debt beyond the capacity
+    def test_many_messages(self):
+        limiter = RateLimiter(rate=100, chat_rate=None)
+        assert limiter.reserve('a', 300) == 0
+        assert limiter.reserve('a', 1) == pytest.approx(2.01, abs=0.01)
+
+    #  Tests that the number of tracked chats is bounded
+    @pytest.mark.anyio
+    async def test_chat_buckets_bounded(self):
+        limiter = RateLimiter(rate=None, chat_rate=1, max_chats=10)
+        for chat_id in range(100):
+            await limiter.acquire(chat_id)
+        assert len(limiter.chat_buckets) == 10
+
+
+class TestSendQueue:
+    #  Tests that enqueued messages are sent by workers and counted
+    @pytest.mark.anyio
+    async def test_enqueue_and_drain(self):
+        queue = SendQueue(workers=2)
+        sent = []
+
+        async def send(chat_id, text):
+            sent.append((chat_id, text))
+
+        for i in range(5):
+            await queue.enqueue(Messenger, i, send, i, f'text {i}')
+        await queue.stop()
+        assert sorted(sent) == [(i, f'text {i}') for i in range(5)]
+        stats = queue.stats()
+        assert stats['sent'] == 5 and stats['depth'] == 0 and stats['workers'] == 0
+
+    #  Tests that a failing send is counted and does not stop the worker
+    @pytest.mark.anyio
+    async def test_failed_send(self):
+        queue = SendQueue(workers=1)
+        sent = []
+
+        async def send(text):
+            if text == 'fail':
+                raise RuntimeError(text)
+            sent.append(text)
+
+        await queue.enqueue(Messenger, 1, send, 'fail')
+        await queue.enqueue(Messenger, 2, send, 'ok')
+        await queue.stop()
+        assert sent == ['ok']
+        assert queue.failed == 1 and queue.sent == 1
+
+    #  Tests that a chat held back by its rate limit delays neither other chats nor its own order
+    @pytest.mark.anyio
+    async def test_busy_chat(self):
+        queue = SendQueue(workers=4)
+        sent = []
+
+        async def send(chat_id, n):
+            sent.append((chat_id, n, asyncio.get_running_loop().time()))
+
+        start = asyncio.get_running_loop().time()
+        for n in range(4):
+            await queue.enqueue(Messenger, 'hot', send, 'hot', n)
+        await queue.enqueue(Messenger, 'idle', send, 'idle', 0)
+        await queue.stop()
+        assert [n for chat_id, n, _ in sent if chat_id == 'hot'] == [0, 1, 2, 3]
+        assert next(at for chat_id, _, at in sent if chat_id == 'idle') - start < 0.05
+        assert queue.limiters['test'].throttled == 3
+
+    #  Tests that an error status of the API response is counted as a failure
+    @pytest.mark.anyio
+    async def test_error_status(self):
+        queue = SendQueue(workers=1)
+
+        async def send(status):
+            return status, {}
+
+        await queue.enqueue(Messenger, 1, send, 429)
+        await queue.enqueue(Messenger, 2, send, 200)
+        await queue.stop()
+        assert queue.failed == 1 and queue.sent == 1
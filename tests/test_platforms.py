@@ -0,0 +1,52 @@
+import sys
+
+import pytest
+
+from unapi import platforms
+from unapi.platforms import PlatformSpec
+from unapi.settings import Settings
+
+
+@pytest.fixture
+def registry(mocker):
+    mocker.patch.dict(platforms._specs)
+    mocker.patch.dict(platforms._headers)
+    return platforms
+
+
+class TestSettings:
+    #  Tests that settings are read from upper case environment variables and typed
+    def test_from_env(self, mocker):
+        mocker.patch.dict('os.environ', {'PLATFORMS': 'telegram, viber', 'OUTBOUND_WORKERS': '4'})
+        settings = Settings.from_env()
+        assert settings.platforms == ['telegram', 'viber']
+        assert settings.outbound_workers == 4
+
+
+class TestRegistry:
+    #  Tests that a platform is not imported until it is used
+    def test_lazy_load(self, registry):
+        spec = registry.register(PlatformSpec('json', 'json:JSONDecoder', 'X-Json-Test'), enable=True)
+        assert not spec.loaded
+        assert registry.by_header('x-json-test') is spec
+        assert spec.load() is sys.modules['json'].JSONDecoder
+        assert spec.loaded and spec.import_time is not None
+
+    #  Tests that a platform with missing settings is disabled instead of crashing the app
+    def test_missing_settings_disable_platform(self, registry, mocker):
+        mocker.patch.object(platforms.settings, 'platforms', ['test'])
+        mocker.patch.object(platforms.settings, 'telegram_token', None)
+        spec = registry.register(PlatformSpec('test', 'json:JSONDecoder', 'X-Test', ('telegram_token',)))
+        assert spec.missing_settings == ['telegram_token']
+        assert registry.by_header('x-test') is None
+
+    #  Tests that a platform not listed in PLATFORMS is disabled
+    def test_not_listed_platform_disabled(self, registry):
+        registry.register(PlatformSpec('unlisted', 'json:JSONDecoder', 'X-Unlisted'))
+        assert registry.by_header('x-unlisted') is None
+        assert registry.stats()['unlisted'] == {'enabled': False, 'loaded': False, 'import_time': None}
+
+    #  Tests that two platforms cannot share a header
+    def test_duplicate_header(self, registry):
+        with pytest.raises(ValueError):
+            registry.register(PlatformSpec('copy', 'json:JSONDecoder', 'X-Telegram-Bot-Api-Secret-Token'))
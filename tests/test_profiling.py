@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from unapi import profiling, tracing
+from unapi.profiling import LoopWatchdog, SamplingProfiler
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+def busy_function(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestSamplingProfiler:
+    #  Tests that samples of the sampled thread are collapsed into semicolon-separated stacks
+    @pytest.mark.anyio
+    async def test_profile(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        busy_function(0.1)
+        samples = profiler.stop()
+        assert any(stack.endswith('test_profiling.py:busy_function') for stack in samples)
+        assert profiler.collapsed().splitlines()[0].rsplit(' ', 1)[1].isdigit()
+
+    #  Tests that the profiler cannot be started twice
+    def test_start_twice(self):
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            with pytest.raises(ValueError):
+                profiler.start()
+        finally:
+            profiler.stop()
+
+
+class TestLoopWatchdog:
+    #  Tests that a blocking call inside a coroutine is reported with its stack
+    @pytest.mark.anyio
+    async def test_blocking_reported(self, caplog):
+        watchdog = LoopWatchdog(threshold=0.05)
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.05)
+            with caplog.at_level(logging.WARNING):
+                time.sleep(0.2)
+                await asyncio.sleep(0.1)
+        finally:
+            await watchdog.stop()
+        assert watchdog.blocks == 1
+        assert watchdog.max_block >= 0.1
+        assert any('test_blocking_reported' in record.getMessage() for record in caplog.records)
+
+
+class TestTracing:
+    #  Tests that spans are recorded only inside a trace and the trace id is added to log records
+    def test_trace(self, mocker):
+        mocker.patch.object(tracing.settings, 'tracing', True)
+        record = logging.LogRecord('unapi', logging.INFO, __file__, 1, 'inside', None, None)
+        with tracing.span('outside'):
+            pass
+        with tracing.trace('abc'):
+            with tracing.span('is_json_valid'):
+                pass
+            spans = tracing._spans_var.get()
+            tracing.TraceIdFilter().filter(record)
+        assert [name for name, _, _ in spans] == ['is_json_valid']
+        assert record.trace_id == 'abc'
+        assert tracing.trace_id_var.get() is None
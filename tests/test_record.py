@@ -0,0 +1,53 @@
+import pytest
+
+from unapi import record
+from unapi.record import EventRecord
+from unapi.platforms.telegram import TelegramEvent
+from unapi.platforms.viber import ViberEvent
+from unapi.platforms.facebook import FacebookEvent
+
+
+@pytest.fixture
+def event_record():
+    return EventRecord('viber', 'abc==', 'hi', 5, 1700000000.5,
+                       (('photo', 'image', '.jpg', 'https://cdn.test/photo.jpg', 'viber:https://cdn.test/photo.jpg'),))
+
+
+class TestEventRecord:
+    #  Tests that a record survives serialization with JSON
+    def test_json_round_trip(self, event_record, mocker):
+        mocker.patch.object(record, 'msgpack', None)
+        data = event_record.dumps()
+        assert data[:1] == b'j'
+        assert EventRecord.loads(data) == event_record
+
+    #  Tests that data of an unknown format is rejected
+    def test_loads_unknown_format(self):
+        with pytest.raises(ValueError):
+            EventRecord.loads(b'x')
+
+    #  Tests that a record is converted back to an event of its platform with the same fields
+    @pytest.mark.parametrize('platform, messenger, chat_id, message_id', [
+        ('telegram', TelegramEvent, 1, 10),
+        ('viber', ViberEvent, 'abc==', 5),
+        ('facebook', FacebookEvent, '1', 'mid.1'),
+    ])
+    def test_to_event(self, platform, messenger, chat_id, message_id):
+        event_record = EventRecord(platform, chat_id, 'hi', message_id, 1700000000.0,
+                                   (('photo', 'image', '.jpg', 'https://cdn.test/photo.jpg', None),))
+        event = event_record.to_event()
+        assert type(event) is messenger
+        assert (event.chat_id, event.text, event.delivery_id, event.timestamp) == (chat_id, 'hi', message_id, 1700000000.0)
+        assert [attachment.url for attachment in event.attachments] == ['https://cdn.test/photo.jpg']
+        assert event.to_record() == event_record
+
+    #  Tests that an event is converted to a record with its attachments resolved
+    def test_from_event(self):
+        from unapi.platforms.facebook.model import Model
+        event = FacebookEvent.create(Model.model_validate({'object': 'page', 'entry': [{'id': 'page', 'time': 1, 'messaging': [
+            {'sender': {'id': '1'}, 'recipient': {'id': 'page'}, 'timestamp': 1500,
+             'message': {'mid': 'mid.1', 'text': 'hi', 'attachments': [
+                 {'type': 'image', 'payload': {'url': 'https://cdn.test/photo.png?x=1'}}]}},
+        ]}]}))
+        assert event.to_record() == EventRecord('facebook', '1', 'hi', 'mid.1', 1.5,
+                                                (('photo', 'image', '.png', 'https://cdn.test/photo.png?x=1', None),))
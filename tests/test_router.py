@@ -0,0 +1,96 @@
+import re
+import threading
+
+import pytest
+
+from unapi.router import Router
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def make_event(mocker):
+    def make(text, platform='telegram'):
+        return mocker.Mock(text=text, platform=platform)
+
+    return make
+
+
+def handler(name):
+    async def handle(event):
+        return name
+
+    handle.__name__ = name
+    return handle
+
+
+class TestRouter:
+    #  Tests that commands match the first word, ignoring case and bot mentions
+    def test_command(self, make_event):
+        router = Router()
+        start = router.command('/start', 'begin')(handler('start'))
+        assert router.match(make_event('/START@my_bot now')).handler is start
+        assert router.match(make_event('begin')).handler is start
+        assert router.match(make_event('please /start')) is None
+
+    #  Tests that the longest matching prefix wins
+    def test_prefix(self, make_event):
+        router = Router()
+        short = router.prefix('pri')(handler('short'))
+        long = router.prefix('price')(handler('long'))
+        assert router.match(make_event('Price of tea')).handler is long
+        assert router.match(make_event('print')).handler is short
+        assert router.match(make_event('pr')) is None
+
+    #  Tests that regular expressions are combined and the earliest match wins
+    def test_regex(self, make_event):
+        router = Router()
+        order = router.regex(r'order #(?P<order>\d+)')(handler('order'))
+        refund = router.regex(r'refund', flags=re.IGNORECASE)(handler('refund'))
+        assert router.match(make_event('REFUND order #1')).handler is refund
+        assert router.match(make_event('order #1, refund')).handler is order
+        assert router.match(make_event('order #x')) is None
+
+    #  Tests that a route of another platform is skipped in favor of the next matching one
+    def test_platform_filter(self, make_event):
+        router = Router()
+        viber = router.command('/help', platforms=['viber'])(handler('viber'))
+        fallback = router.default(handler('fallback'))
+        assert router.match(make_event('/help', 'viber')).handler is viber
+        assert router.match(make_event('/help', 'telegram')).handler is fallback
+
+    #  Tests that a later default overrides an earlier one and a platform default overrides a global one
+    def test_default_priority(self, make_event):
+        router = Router()
+        viber = router.default(handler('viber'), platforms=['viber'])
+        router.default(handler('echo'))
+        app = router.default(handler('app'))
+        assert router.match(make_event('hi', 'telegram')).handler is app
+        assert router.match(make_event('hi', 'viber')).handler is viber
+
+    #  Tests that commands take precedence over prefixes and expressions
+    def test_precedence(self, make_event):
+        router = Router()
+        router.regex('stop')(handler('regex'))
+        router.prefix('/st')(handler('prefix'))
+        command = router.command('/stop')(handler('command'))
+        assert router.match(make_event('/stop')).handler is command
+
+    #  Tests that sync handlers run outside the event loop thread and async ones inside it
+    @pytest.mark.anyio
+    async def test_dispatch(self, make_event):
+        router = Router()
+        threads = {}
+        router.command('/sync')(lambda event: threads.setdefault('sync', threading.get_ident()))
+
+        @router.command('/async')
+        async def handle_async(event):
+            threads['async'] = threading.get_ident()
+
+        assert await router.dispatch(make_event('/sync'))
+        assert await router.dispatch(make_event('/async'))
+        assert not await router.dispatch(make_event('other'))
+        assert threads['async'] == threading.get_ident() != threads['sync']
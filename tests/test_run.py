@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip('uvicorn')
+
+from unapi import run  # noqa: E402
+
+
+class TestServerOptions:
+    #  Tests that development mode keeps the single reloading process
+    def test_development(self, mocker):
+        mocker.patch.object(run.settings, 'server_mode', 'development')
+        options = run.server_options()
+        assert options['reload'] is True
+        assert 'workers' not in options
+
+    #  Tests that production mode runs one worker and recycles it
+    def test_production(self, mocker):
+        mocker.patch.object(run.settings, 'server_mode', 'production')
+        mocker.patch.object(run.settings, 'limit_max_requests', 10000)
+        options = run.server_options()
+        assert options['workers'] == 1
+        assert options['limit_max_requests'] == 10000
+        assert 'reload' not in options
+
+    #  Tests that several workers are rejected, they would overwrite each other's chat states
+    def test_workers(self, mocker):
+        mocker.patch.object(run.settings, 'server_mode', 'production')
+        mocker.patch.object(run.settings, 'workers', 8)
+        with pytest.raises(ValueError):
+            run.server_options()
+
+    #  Tests that an unknown mode is rejected
+    def test_unknown_mode(self, mocker):
+        mocker.patch.object(run.settings, 'server_mode', 'staging')
+        with pytest.raises(ValueError):
+            run.server_options()
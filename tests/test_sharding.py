@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from unapi.sharding import ShardedExecutor
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+class TestShardedExecutor:
+    #  Tests that jobs of one chat run in order while jobs of other chats run in parallel
+    @pytest.mark.anyio
+    async def test_ordering(self):
+        executor = ShardedExecutor(shards=8)
+        log = []
+        slow_started = asyncio.Event()
+
+        async def job(chat_id, n, delay):
+            if delay:
+                slow_started.set()
+            await asyncio.sleep(delay)
+            log.append((chat_id, n))
+
+        first = asyncio.create_task(executor.run('telegram', 1, job, 1, 1, 0.05))
+        await slow_started.wait()
+        second = await executor.submit('telegram', 1, job, 1, 2, 0)
+        other = next(chat_id for chat_id in range(2, 100)
+                     if executor.shard_of('telegram', chat_id) != executor.shard_of('telegram', 1))
+        await executor.run('telegram', other, job, other, 1, 0)
+        assert log == [(other, 1)]
+        await asyncio.gather(first, second)
+        assert log == [(other, 1), (1, 1), (1, 2)]
+        assert executor.stats()['processed'] == 3
+        await executor.stop()
+
+    #  Tests that the exception of a job is raised to the caller and counted
+    @pytest.mark.anyio
+    async def test_exception(self):
+        executor = ShardedExecutor(shards=1)
+
+        async def fail():
+            raise ValueError('broken')
+
+        with pytest.raises(ValueError):
+            await executor.run('viber', 'a', fail)
+        stats = executor.stats()
+        assert stats['failed'] == 1 and stats['hot'][0]['processed'] == 1
+        await executor.stop()
+
+    #  Tests that submitting waits once the queue of a shard is full
+    @pytest.mark.anyio
+    async def test_bounded(self):
+        executor = ShardedExecutor(shards=1, maxsize=1)
+        release = asyncio.Event()
+        futures = [await executor.submit('viber', 'a', release.wait)]
+        await asyncio.sleep(0)
+        futures.append(await executor.submit('viber', 'a', release.wait))
+        blocked = asyncio.create_task(executor.submit('viber', 'a', release.wait))
+        await asyncio.sleep(0.01)
+        assert not blocked.done() and executor.stats()['depth'] == 1
+        release.set()
+        futures.append(await blocked)
+        await asyncio.gather(*futures)
+        await executor.stop()
+
+    #  Tests that a job raising CancelledError fails without stopping the worker of its shard
+    @pytest.mark.anyio
+    async def test_cancelled_job(self):
+        executor = ShardedExecutor(shards=1)
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def ok():
+            return 'ok'
+
+        with pytest.raises(ValueError):
+            await executor.run('viber', 'a', cancelled)
+        assert await asyncio.wait_for(executor.run('viber', 'a', ok), 1) == 'ok'
+        assert executor.stats()['failed'] == 1
+        await executor.stop()
+
+    #  Tests that a caller stops waiting after the timeout while the job is still completed
+    @pytest.mark.anyio
+    async def test_timeout(self):
+        executor = ShardedExecutor(shards=1)
+        done = asyncio.Event()
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            done.set()
+
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run('viber', 'a', slow, timeout=0.01)
+        await asyncio.wait_for(done.wait(), 1)
+        assert executor.stats()['timeouts'] == 1
+        await executor.stop()
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from unapi.state import ChatStateStore
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    def make(**kwargs):
+        return ChatStateStore(str(tmp_path / 'state.sqlite3'), **kwargs)
+
+    return make
+
+
+class TestChatStateStore:
+    #  Tests that writes are served from memory and reach the disk only on flush
+    @pytest.mark.anyio
+    async def test_write_behind(self, make_store, mocker):
+        store = make_store()
+        write = mocker.spy(store, '_write')
+        await store.set('telegram', 1, {'step': 'name'})
+        assert await store.get('telegram', 1) == {'step': 'name'}
+        write.assert_not_called()
+        assert store.stats()['pending'] == 1
+        assert await store.flush() == 1
+        assert store.stats()['pending'] == 0
+        await store.stop()
+
+    #  Tests that a state evicted from memory is read back from the disk, or from pending writes before a flush
+    @pytest.mark.anyio
+    async def test_read_through(self, make_store):
+        store = make_store(maxsize=1)
+        await store.set('viber', 'a', {'step': 1})
+        await store.set('viber', 'b', {'step': 2})
+        assert await store.get('viber', 'a') == {'step': 1}
+        assert store.disk_reads == 0
+        await store.stop()
+
+        store = make_store()
+        assert await store.get('viber', 'b') == {'step': 2}
+        assert await store.get('viber', 'c') is None
+        assert store.disk_reads == 2
+        assert await store.get('viber', 'c') is None
+        assert store.disk_reads == 2
+        await store.stop()
+
+    #  Tests that changing a dict passed to set or returned by get does not change the stored state
+    @pytest.mark.anyio
+    async def test_copies(self, make_store):
+        store = make_store()
+        value = {'items': [1]}
+        await store.set('telegram', 1, value)
+        value['items'].append(2)
+        (await store.get('telegram', 1))['items'].append(3)
+        assert await store.get('telegram', 1) == {'items': [1]}
+        await store.stop()
+
+    #  Tests that a deletion is persisted
+    @pytest.mark.anyio
+    async def test_delete(self, make_store):
+        store = make_store()
+        await store.set('facebook', '1', {'step': 1})
+        await store.flush()
+        await store.delete('facebook', '1')
+        await store.stop()
+        assert await make_store().get('facebook', '1') is None
+
+    #  Tests that a write made while the same chat is read from the disk is not overwritten by the read
+    @pytest.mark.anyio
+    async def test_write_during_read(self, make_store):
+        store = make_store()
+        read = store._read
+
+        def slow_read(key):
+            import time
+            time.sleep(0.05)
+            return read(key)
+
+        store._read = slow_read
+        loading = asyncio.create_task(store.get('telegram', 1))
+        await asyncio.sleep(0.01)
+        await store.set('telegram', 1, {'step': 'new'})
+        assert await loading == {'step': 'new'}
+        assert await store.get('telegram', 1) == {'step': 'new'}
+        await store.stop()
+
+    #  Tests that the background flusher writes pending states once the batch size is reached
+    @pytest.mark.anyio
+    async def test_flush_batch(self, make_store):
+        store = make_store(flush_interval=60, flush_batch=2)
+        store.start()
+        await store.set('telegram', 1, {})
+        await store.set('telegram', 2, {})
+        for _ in range(100):
+            if store.flushed:
+                break
+            await asyncio.sleep(0.01)
+        assert store.flushed == 2
+        await store.stop()
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from unapi.attachment import Attachment, AttachmentType
+from unapi.storage import ContentAddressedStorage
+from unapi.util import store_attachment
+
+
+@pytest.fixture
+def content_storage(tmp_path):
+    return ContentAddressedStorage(str(tmp_path))
+
+
+class TestContentAddressedStorage:
+    #  Tests that identical content is stored once and the existing path is returned
+    def test_deduplicates_content(self, content_storage, tmp_path):
+        first = content_storage.store([b'same ', b'content'], 'image', '.png')
+        second = content_storage.store([b'same content'], 'image', '.png')
+        assert first == second
+        assert open(first, 'rb').read() == b'same content'
+        assert content_storage.stats() == {'stored': 1, 'duplicates': 1, 'index_hits': 0}
+        assert os.listdir(tmp_path / '.tmp') == []
+
+    #  Tests that different content is stored under different paths
+    def test_distinct_content(self, content_storage):
+        assert content_storage.store([b'a'], 'image', 'png') != content_storage.store([b'b'], 'image', 'png')
+
+    #  Tests that a stored file is found by its source id
+    def test_lookup_by_source_id(self, content_storage):
+        assert content_storage.lookup('telegram:abc') is None
+        path = content_storage.store([b'content'], 'image', '.jpg', source_id='telegram:abc')
+        assert content_storage.lookup('telegram:abc') == path
+
+    #  Tests that a failed download leaves no temporary file behind
+    def test_store_failure(self, content_storage, tmp_path):
+        def chunks():
+            yield b'partial'
+            raise ValueError('file exceeds the maximum size')
+
+        assert content_storage.store(chunks(), 'image', '.jpg') is None
+        assert os.listdir(tmp_path / '.tmp') == []
+
+    #  Tests that an attachment with a known source id is not downloaded again
+    def test_store_attachment_skips_known_source(self, content_storage, mocker):
+        path = content_storage.store([b'content'], 'image', '.jpg', source_id='telegram:abc')
+        open_download = mocker.patch('unapi.util.open_download')
+        attachment = Attachment(name='file', type_=AttachmentType.Image, extension='.jpg',
+                                url='https://test/file.jpg', source_id='telegram:abc')
+        assert store_attachment(attachment, content_storage) == path
+        open_download.assert_not_called()
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from unapi.platforms.telegram.polling import TelegramPoller
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+def update(update_id, chat_id, text='Hi'):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test', 'username': 'test', 'language_code': 'en'},
+            'chat': {'id': chat_id, 'first_name': 'Test', 'username': 'test', 'type': 'private'},
+            'date': 1700000000,
+            'text': text,
+        },
+    }
+
+
+class TestTelegramPoller:
+    #  Tests that a batch is handled concurrently, updates of other kinds are skipped and the offset moves past it
+    @pytest.mark.anyio
+    async def test_handle(self):
+        handled = []
+
+        async def handler(event):
+            if event.text == 'fail':
+                raise ValueError('broken')
+            handled.append((event.chat_id, event.delivery_id))
+
+        poller = TelegramPoller(handler)
+        await poller.handle([update(10, 1), {'update_id': 11, 'edited_message': {}}, update(12, 2, 'fail'),
+                             update(13, 3)])
+        assert handled == [(1, 10), (3, 13)]
+        assert poller.offset == 14
+        assert (poller.invalid, poller.failed, poller.updates) == (1, 1, 4)
+
+    #  Tests that every getUpdates call confirms the batch handled before it, and stopping confirms the last one
+    @pytest.mark.anyio
+    async def test_poll_loop(self, mocker):
+        mocker.patch('unapi.platforms.telegram.api.delete_webhook_async', return_value=(200, {'ok': True}))
+        batches = [[update(1, 1), update(2, 2)], [update(3, 1)]]
+
+        async def get_updates(offset, limit, timeout):
+            if batches:
+                return 200, {'ok': True, 'result': batches.pop(0)}
+            await asyncio.sleep(timeout if timeout else 0)
+            return 200, {'ok': True, 'result': []}
+
+        get = mocker.patch('unapi.platforms.telegram.api.get_updates_async', side_effect=get_updates)
+        handler = mocker.AsyncMock()
+        poller = TelegramPoller(handler, timeout=30)
+        poller.start()
+        while poller.offset != 4:
+            await asyncio.sleep(0.01)
+        await poller.stop()
+        assert handler.await_count == 3
+        assert [call.args[0] for call in get.call_args_list] == [None, 3, 4, 4]
@@ -4,7 +4,9 @@ import uuid
 from pathlib import Path
 import pytest
 import requests
-from unapi.util import generate_file_path, save_file, download_file, download_attachment
+from unapi import util
+from unapi.util import generate_file_path, save_file, download_file, download_attachment, download_file_to, \
+    open_download, download_attachment_async, save_stream_async
 from unapi.attachment import Attachment, AttachmentType
 from os import environ
 from dotenv import load_dotenv
@@ -12,6 +14,11 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
 @pytest.fixture
 def local_storage_path():
     return environ["LOCAL_STORAGE_PATH"]
@@ -27,6 +34,15 @@ def uuid_str():
     return '00000000-0000-0000-0000-000000000000'
 
 
+@pytest.fixture
+def response(mocker):
+    def make(chunks, ok=True, content_length=None):
+        headers = {'Content-Length': str(content_length)} if content_length is not None else {}
+        return mocker.Mock(ok=ok, headers=headers, iter_content=mocker.Mock(return_value=iter(chunks)))
+
+    return make
+
+
 @pytest.fixture()
 def mock_datetime(dt_str):
     class MockDateTime(datetime.datetime):
@@ -109,10 +125,16 @@ class TestSaveFile:
 
 
 class TestDownloadFile:
-    #  Tests that a valid URL returns content
-    def test_valid_url(self, mocker):
-        mocker.patch('requests.get', return_value=mocker.Mock(ok=True, content=b'file content'))
+    #  Tests that a valid URL returns content, downloaded with a timeout
+    def test_valid_url(self, mocker, response):
+        mocker.patch('requests.get', return_value=response([b'file ', b'content']))
         assert download_file('http://validurl.com') == b'file content'
+        requests.get.assert_called_once_with('http://validurl.com', stream=True, timeout=mocker.ANY)
+
+    #  Tests that a file over the size limit is not returned
+    def test_too_large(self, mocker, response):
+        mocker.patch('requests.get', return_value=response([b'ab', b'cd', b'ef']))
+        assert download_file('http://validurl.com', max_size=4) is None
 
     #  Tests that an empty response returns None
     def test_empty_response(self, mocker):
@@ -144,21 +166,93 @@ class TestDownloadAttachment:
     def attachment(self):
         return Attachment(name='test', type_=AttachmentType.Image, extension='png', url='http://test.com/test.png')
 
-    #  Tests that attachment is downloaded successfully and saved to file when save=True
-    def test_download_success_save_true(self, mocker, attachment, dt_str, uuid_str, mock_datetime, tmp_path):
-        file_path = Path(tmp_path) / attachment.type_.value / f'{dt_str}_{uuid_str}.{attachment.extension}'
+    #  Tests that attachment is streamed to a file when save=True
+    def test_download_success_save_true(self, mocker, attachment, dt_str, uuid_str, mock_datetime, tmp_path,
+                                        response):
+        file_path = str(Path(tmp_path) / attachment.type_.value / f'{dt_str}_{uuid_str}.{attachment.extension}')
         mocker.patch(
             'unapi.util.generate_file_path',
             return_value=file_path
         )
-        content = b'test content'
-        mocker.patch('requests.get', return_value=mocker.MagicMock(ok=True, content=content))
+        mocker.patch('requests.get', return_value=response([b'test ', b'content']))
         assert download_attachment(attachment) == file_path
-        assert file_path.read_bytes() == content
-        requests.get.assert_called_once_with(attachment.url)
+        assert Path(file_path).read_bytes() == b'test content'
+        requests.get.assert_called_once_with(attachment.url, stream=True, timeout=mocker.ANY)
 
     #  Tests that attachment is downloaded successfully and returned as bytes when save=False
-    def test_download_success_save_false(self, mocker, attachment):
-        mocker.patch('requests.get', return_value=mocker.MagicMock(ok=True, content=b'test content'))
+    def test_download_success_save_false(self, mocker, attachment, response):
+        mocker.patch('requests.get', return_value=response([b'test content']))
         assert download_attachment(attachment, save=False) == b'test content'
-        requests.get.assert_called_once_with(attachment.url)
+        requests.get.assert_called_once_with(attachment.url, stream=True, timeout=mocker.ANY)
+
+
+class TestDownloadStream:
+    #  Tests that a streamed file is written chunk by chunk and renamed into place
+    def test_download_file_to(self, mocker, response, tmp_path):
+        mocker.patch('requests.get', return_value=response([b'ab', b'cd']))
+        file_path = str(tmp_path / 'dir' / 'file.bin')
+        assert download_file_to('http://validurl.com', file_path) == file_path
+        assert Path(file_path).read_bytes() == b'abcd'
+        assert os.listdir(tmp_path / 'dir') == ['file.bin']
+        requests.get.assert_called_once_with('http://validurl.com', stream=True, timeout=mocker.ANY)
+
+    #  Tests that a file over the size limit is not saved and leaves no temporary file behind
+    def test_download_file_to_too_large(self, mocker, response, tmp_path):
+        mocker.patch('requests.get', return_value=response([b'ab', b'cd', b'ef']))
+        assert download_file_to('http://validurl.com', str(tmp_path / 'file.bin'), max_size=4) is None
+        assert os.listdir(tmp_path) == []
+
+    #  Tests that a declared Content-Length over the limit is rejected before reading the body
+    def test_open_download_content_length(self, mocker, response):
+        mocker.patch('requests.get', return_value=response([], content_length=10))
+        assert open_download('http://validurl.com', max_size=4) is None
+
+    #  Tests that save=False with stream=True returns a chunk iterator that counts bytes
+    def test_download_attachment_stream(self, mocker, response):
+        mocker.patch('requests.get', return_value=response([b'ab', b'cd']))
+        attachment = Attachment(name='test', type_=AttachmentType.Image, extension='png', url='http://test.com/test.png')
+        stream = download_attachment(attachment, save=False, stream=True)
+        assert b''.join(stream) == b'abcd'
+        assert stream.bytes_transferred == 4
+
+
+class TestDownloadAsync:
+    @pytest.fixture
+    def session(self, mocker):
+        def make(chunks, status=200):
+            async def iter_chunked(size):
+                for chunk in chunks:
+                    yield chunk
+
+            response = mocker.Mock(status=status, content_length=None)
+            response.content.iter_chunked = iter_chunked
+            get = mocker.AsyncMock(return_value=response)
+            mocker.patch.object(util, 'download_client', mocker.Mock(session=mocker.Mock(get=get)))
+            return response
+
+        return make
+
+    #  Tests that an async chunk iterator is saved and renamed into place
+    @pytest.mark.anyio
+    async def test_save_stream_async(self, tmp_path):
+        async def chunks():
+            yield b'ab'
+            yield b'cd'
+
+        file_path = str(tmp_path / 'dir' / 'file.bin')
+        assert await save_stream_async(file_path, chunks()) == (file_path, 4)
+        assert Path(file_path).read_bytes() == b'abcd'
+        assert os.listdir(tmp_path / 'dir') == ['file.bin']
+
+    #  Tests that save=False with stream=True returns an async chunk iterator that frees its slot when exhausted
+    @pytest.mark.anyio
+    async def test_download_attachment_stream(self, session):
+        response = session([b'ab', b'cd'])
+        attachment = Attachment(name='test', type_=AttachmentType.Image, extension='png', url='http://test.com/test.png')
+        free = util.download_semaphore._value
+        stream = await download_attachment_async(attachment, save=False, stream=True)
+        assert util.download_semaphore._value == free - 1
+        assert b''.join([chunk async for chunk in stream]) == b'abcd'
+        assert stream.bytes_transferred == 4
+        assert util.download_semaphore._value == free
+        response.release.assert_called_once()
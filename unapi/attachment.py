@@ -16,6 +16,8 @@ class Attachment(BaseModel):
     type_: AttachmentType
     extension: str
     url: str
+    # A platform-stable id of the file, if the platform has one. Lets storage skip files it already has
+    source_id: str | None = None
 
     @property
     def full_name(self) -> str:
@@ -23,9 +25,14 @@ class Attachment(BaseModel):
             return f'{self.name}.{self.extension}'
         return self.name
 
-    # Downloading method. May be overridden in subclasses
-    def download(self, save=True) -> str | bytes | None:
-        return download_attachment(self, save)
+    # Downloading method. May be overridden in subclasses.
+    # Saved files and, with stream=True, unsaved ones are streamed, so memory use does not depend on the file size,
+    # see util.download_attachment
+    def download(self, save=True, stream=False) -> "str | bytes | DownloadStream | None":
+        return download_attachment(self, save, stream)
 
+    async def download_async(self, save=True, stream=False) -> "str | bytes | AsyncDownloadStream | None":
+        return await download_attachment_async(self, save, stream)
 
-from unapi.util import download_attachment
+
+from unapi.util import download_attachment, download_attachment_async, DownloadStream, AsyncDownloadStream
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, List
+
+from unapi import jsonlib
+from unapi import outbound
+from unapi import platforms
+from unapi.settings import settings
+
+
+class BroadcastResult:
+    """
+    Progress and per-recipient results of a broadcast
+    """
+
+    def __init__(self, platform: str, total: int) -> None:
+        self.platform = platform
+        self.total = total
+        self.sent = 0
+        self.skipped = 0
+        self.failed: Dict[int | str, str] = {}
+        self.calls = 0
+        self.start = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.skipped + len(self.failed)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.start
+        return {
+            "platform": self.platform,
+            "total": self.total,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "failed": len(self.failed),
+            "calls": self.calls,
+            "elapsed": elapsed,
+            "rate": (self.sent + len(self.failed)) / elapsed if elapsed else 0.0,
+        }
+
+
+class _Checkpoint:
+    """
+    A JSON lines file with the result of every recipient, appended after every call.
+    Recipients the message was sent to are skipped when the same broadcast is resumed
+    """
+
+    def __init__(self, path: str | None) -> None:
+        self.path = path
+        self.file = None
+
+    def load(self) -> set:
+        if self.path is None or not os.path.exists(self.path):
+            return set()
+        sent = set()
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = jsonlib.loads(line)
+                except ValueError:
+                    # The last line of an interrupted broadcast may be incomplete
+                    continue
+                if record["error"] is None:
+                    sent.add(record["chat_id"])
+                else:
+                    sent.discard(record["chat_id"])
+        return sent
+
+    def append(self, chat_ids: List[int | str], errors: List[str | None]) -> None:
+        if self.path is None:
+            return
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, "ab")
+        self.file.write(b"".join(jsonlib.dumps({"chat_id": chat_id, "error": error}) + b"\n"
+                                 for chat_id, error in zip(chat_ids, errors)))
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _batches(chat_ids: Iterable[int | str], size: int) -> Iterator[List[int | str]]:
+    batch = []
+    for chat_id in chat_ids:
+        batch.append(chat_id)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def broadcast(platform: str, chat_ids: Iterable[int | str], text: str, checkpoint: str | None = None,
+                    progress: Callable[[BroadcastResult], None] | None = None,
+                    concurrency: int | None = None) -> BroadcastResult:
+    """
+    Sends one message to many chats of a platform with as few API calls as the platform allows:
+    Viber broadcast_message takes 300 receivers per call, a Graph API batch 50 requests, and Telegram
+    takes one chat per call. Calls are made concurrently through the rate limiter of the platform
+    shared with the outbound queue, which counts every recipient of a call as one message
+    :param platform: platform name
+    :param chat_ids: recipients
+    :param text: a message to send
+    :param checkpoint: path of a file to record results in; recipients it records as sent are skipped,
+    so an interrupted broadcast is resumed by calling it again with the same file
+    :param progress: a function called with the result so far after every call
+    :param concurrency: calls in flight, BROADCAST_CONCURRENCY by default
+    :return: the result
+    """
+    messenger = platforms.get(platform).load()
+    limiter = outbound.queue.limiter(messenger)
+    journal = _Checkpoint(checkpoint)
+    already_sent = journal.load()
+
+    # Duplicates are dropped, so nobody gets the message twice
+    recipients = list(dict.fromkeys(chat_ids))
+    result = BroadcastResult(platform, len(recipients))
+    pending = [chat_id for chat_id in recipients if chat_id not in already_sent]
+    result.skipped = len(recipients) - len(pending)
+
+    batches = _batches(pending, messenger.broadcast_batch_size)
+
+    async def worker() -> None:
+        for batch in batches:
+            # Every recipient counts against the message rate of the platform, not every call
+            await limiter.acquire(batch[0], len(batch))
+            try:
+                errors = await messenger.send_batch_async(batch, text)
+            except Exception as e:
+                errors = [str(e) or type(e).__name__] * len(batch)
+            result.calls += 1
+            for chat_id, error in zip(batch, errors):
+                if error is None:
+                    result.sent += 1
+                else:
+                    result.failed[chat_id] = error
+            journal.append(batch, errors)
+            if progress is not None:
+                progress(result)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency or settings.broadcast_concurrency)))
+    finally:
+        journal.close()
+        result.elapsed = time.monotonic() - result.start
+    logging.info(f"Broadcast to {platform} done: {result.sent} sent, {len(result.failed)} failed, "
+                 f"{result.skipped} skipped in {result.elapsed:.1f} s")
+    return result
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    In-process LRU cache of at most `maxsize` entries that expire `ttl` seconds after being set.
+    Concurrent awaitable loads of the same key are collapsed into a single call of the loader
+    """
+    instances: List["TTLCache"] = []
+
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        TTLCache.instances.append(self)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns a cached value, refreshing its LRU position. Expired entries are dropped
+        :param key: a key
+        :param default: a value to return on a miss
+        :return: the cached value or `default`
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], T]) -> T:
+        """
+        Returns a cached value or loads and caches it
+        :param key: a key
+        :param loader: a function that loads the value on a miss
+        :return: the value
+        """
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    async def get_or_load_async(self, key: Hashable, loader: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns a cached value or loads and caches it. While a key is being loaded,
+        other callers wait for the same load instead of starting their own
+        :param key: a key
+        :param loader: a coroutine function that loads the value on a miss
+        :return: the value
+        """
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.collapsed += 1
+            return await asyncio.shield(pending)
+
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve the exception so it is not reported as never retrieved when nobody else waits
+            future.exception()
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> dict:
+        """
+        Returns size and hit/miss counters
+        :return: dict of stats
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "collapsed": self.collapsed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
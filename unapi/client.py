@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+import aiohttp
+import requests
+
+from unapi import jsonlib
+from unapi import metrics
+from unapi.settings import settings
+
+
+class ApiClient:
+    """
+    Outbound HTTP client of a single platform.
+    It keeps keep-alive connection pools for the lifetime of the app: an aiohttp session for awaitable
+    calls and a requests session for blocking ones. Both send the same prebuilt headers.
+    Awaitable calls answered with 429 are retried after the delay the platform asks for
+    """
+    instances: List["ApiClient"] = []
+
+    def __init__(self, name: str, base_url: str, headers: Dict[str, str] | None = None,
+                 timeout: float | None = None, pool_size: int | None = None,
+                 max_retries: int | None = None, stage: str = "send") -> None:
+        """
+        :param name: client name, the platform label of its metrics
+        :param base_url: base url of the API
+        :param headers: headers sent with every request
+        :param timeout: request timeout in seconds, OUTBOUND_TIMEOUT if None
+        :param pool_size: connections kept open, OUTBOUND_POOL_SIZE if None
+        :param max_retries: retries of a request answered with 429, OUTBOUND_MAX_RETRIES if None
+        :param stage: the stage requests are timed as, so e.g. polling and downloads are not counted as sends
+        """
+        self.name = name
+        self.stage = stage
+        self.base_url = base_url
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.timeout = timeout if timeout is not None else settings.outbound_timeout
+        self.pool_size = pool_size if pool_size is not None else settings.outbound_pool_size
+        self.max_retries = max_retries if max_retries is not None else settings.outbound_max_retries
+        self.throttled = 0
+        self._session: aiohttp.ClientSession | None = None
+        self._sync_session: requests.Session | None = None
+        ApiClient.instances.append(self)
+
+    def url(self, path: str = "") -> str:
+        """
+        Builds an absolute url of an API method. Meant to be called once, at import time
+        :param path: a path relative to the base url
+        :return: absolute url
+        """
+        return self.base_url + path
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        A property that returns the pooled aiohttp session, creating it on first use inside the running loop
+        :return: aiohttp session
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+        return self._session
+
+    @property
+    def sync_session(self) -> requests.Session:
+        """
+        A property that returns the pooled requests session used by blocking calls
+        :return: requests session
+        """
+        if self._sync_session is None:
+            self._sync_session = requests.Session()
+            self._sync_session.headers.update(self.headers)
+        return self._sync_session
+
+    async def request(self, method: str, url: str, body: Any = None, params: Dict[str, Any] | None = None,
+                      headers: Dict[str, str] | None = None) -> Tuple[int, Any]:
+        """
+        Sends a request through the pooled session
+        :param method: HTTP method
+        :param url: absolute url, usually prebuilt with `url`
+        :param body: an object to send as JSON, bytes to send as is, or None to send no body
+        :param params: query parameters
+        :param headers: headers of this request only, on top of the prebuilt ones
+        :return: int - response status, Any - decoded response body or None if it is not JSON
+        """
+        data = body if isinstance(body, bytes) else jsonlib.dumps(body) if body is not None else None
+        for attempt in range(self.max_retries + 1):
+            with metrics.stage_seconds.time(self.name, self.stage):
+                async with self.session.request(method, url, data=data, params=params, headers=headers) as resp:
+                    raw = await resp.read()
+                    retry_after = resp.headers.get("Retry-After")
+            status, response_body = self._result(resp.status, raw)
+            if status != 429 or attempt == self.max_retries:
+                break
+            await asyncio.sleep(self._retry_after(retry_after, response_body))
+        return status, response_body
+
+    async def post(self, url: str, body: Any) -> Tuple[int, Any]:
+        return await self.request("POST", url, body)
+
+    async def get(self, url: str, params: Dict[str, Any] | None = None) -> Tuple[int, Any]:
+        return await self.request("GET", url, params=params)
+
+    def request_sync(self, method: str, url: str, body: Any = None, params: Dict[str, Any] | None = None) \
+            -> Tuple[int, Any]:
+        """
+        Blocking counterpart of `request`. Must not be called from inside the event loop
+        """
+        data = jsonlib.dumps(body) if body is not None else None
+        with metrics.stage_seconds.time(self.name, self.stage):
+            resp = self.sync_session.request(method, url, data=data, params=params, timeout=self.timeout)
+        return self._result(resp.status_code, resp.content)
+
+    def post_sync(self, url: str, body: Any) -> Tuple[int, Any]:
+        return self.request_sync("POST", url, body)
+
+    def get_sync(self, url: str, params: Dict[str, Any] | None = None) -> Tuple[int, Any]:
+        return self.request_sync("GET", url, params=params)
+
+    def _result(self, status: int, raw: bytes) -> Tuple[int, Any]:
+        try:
+            body = jsonlib.loads(raw) if raw else None
+        except ValueError:
+            body = None
+        metrics.outbound_responses.inc(self.name, str(status))
+        if status == 429:
+            self.throttled += 1
+        if status >= 400:
+            # Urls are not logged since they may contain tokens
+            logging.warning(f"Error: {self.name} API responded with {status}: {body}")
+        return status, body
+
+    @staticmethod
+    def _retry_after(header: str | None, body: Any) -> float:
+        # Telegram reports the delay in the body, the others in the Retry-After header
+        try:
+            if header is not None:
+                return min(float(header), 60.0)
+            return min(float(body["parameters"]["retry_after"]), 60.0)
+        except (TypeError, KeyError, ValueError):
+            return 1.0
+
+    async def close(self) -> None:
+        """
+        Closes both connection pools
+        :return: None
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._sync_session is not None:
+            self._sync_session.close()
+            self._sync_session = None
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """
+        Closes connection pools of every client. Called on app shutdown
+        :return: None
+        """
+        for client in cls.instances:
+            await client.close()
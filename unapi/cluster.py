@@ -0,0 +1,347 @@
+import asyncio
+import bisect
+import hashlib
+import hmac
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Hashable, Iterable, Tuple
+
+import aiohttp
+
+from unapi import jsonlib
+from unapi.client import ApiClient
+from unapi.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the membership file is not locked there
+    fcntl = None
+
+FORWARD_PATH = "/cluster/forward"
+SIGNATURE_HEADER = "X-Cluster-Signature"
+PLATFORM_HEADER = "X-Cluster-Platform"
+# Responses of a proxy in front of the owner, which mean the owner did not get the event
+_UNREACHABLE = frozenset((502, 503, 504))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Every node is placed on the ring `vnodes` times, so keys
+    are spread evenly and a node joining or leaving moves only about 1/N of the keys
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 128) -> None:
+        """
+        :param nodes: node ids
+        :param vnodes: points of every node on the ring
+        """
+        self.vnodes = vnodes
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str | None:
+        """
+        Returns the node owning a key: the first node point clockwise of the hash of the key
+        :param key: a key
+        :return: node id or None if the ring is empty
+        """
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class MembershipBackend(ABC):
+    """
+    The registry of live nodes and their base urls. Nodes join, renew their membership with
+    heartbeats and leave; a node that stops sending heartbeats is dropped after `ttl` seconds
+    """
+
+    def __init__(self, ttl: float = 10) -> None:
+        self.ttl = ttl
+
+    @abstractmethod
+    async def heartbeat(self, node_id: str, url: str) -> None:
+        """
+        Adds a node or renews its membership
+        :param node_id: id of the node
+        :param url: base url other nodes forward events to
+        :return: None
+        """
+        raise NotImplementedError("heartbeat is a subclass-implemented method")
+
+    @abstractmethod
+    async def leave(self, node_id: str) -> None:
+        """
+        Removes a node
+        :param node_id: id of the node
+        :return: None
+        """
+        raise NotImplementedError("leave is a subclass-implemented method")
+
+    @abstractmethod
+    async def members(self) -> Dict[str, str]:
+        """
+        Returns the live nodes
+        :return: base urls by node id
+        """
+        raise NotImplementedError("members is a subclass-implemented method")
+
+    def _alive(self, nodes: Dict[str, dict], now: float) -> Dict[str, dict]:
+        return {node_id: node for node_id, node in nodes.items() if now - node["heartbeat"] < self.ttl}
+
+
+class MemoryMembership(MembershipBackend):
+    """
+    Membership of nodes in one process, e.g. of several apps in tests
+    """
+
+    def __init__(self, ttl: float = 10) -> None:
+        super().__init__(ttl)
+        self._nodes: Dict[str, dict] = {}
+
+    async def heartbeat(self, node_id: str, url: str) -> None:
+        self._nodes[node_id] = {"url": url, "heartbeat": time.time()}
+
+    async def leave(self, node_id: str) -> None:
+        self._nodes.pop(node_id, None)
+
+    async def members(self) -> Dict[str, str]:
+        self._nodes = self._alive(self._nodes, time.time())
+        return {node_id: node["url"] for node_id, node in self._nodes.items()}
+
+
+class FileMembership(MembershipBackend):
+    """
+    Membership kept in a JSON file that every node can reach, e.g. on a shared volume.
+    Updates are made under an exclusive lock of the file
+    """
+
+    def __init__(self, path: str, ttl: float = 10) -> None:
+        super().__init__(ttl)
+        self.path = path
+
+    def _update(self, node_id: str, url: str | None) -> Dict[str, dict]:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.seek(0)
+            data = f.read()
+            try:
+                nodes = jsonlib.loads(data) if data else {}
+            except ValueError:
+                logging.warning(f"Error: the cluster membership file {self.path} is corrupt, it is rewritten")
+                nodes = {}
+            now = time.time()
+            nodes = self._alive(nodes, now)
+            if url is not None:
+                nodes[node_id] = {"url": url, "heartbeat": now}
+            else:
+                nodes.pop(node_id, None)
+            f.seek(0)
+            f.truncate()
+            f.write(jsonlib.dumps(nodes))
+        return nodes
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "rb") as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+                return jsonlib.loads(f.read() or b"{}")
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    async def heartbeat(self, node_id: str, url: str) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._update, node_id, url)
+
+    async def leave(self, node_id: str) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._update, node_id, None)
+
+    async def members(self) -> Dict[str, str]:
+        nodes = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        return {node_id: node["url"] for node_id, node in self._alive(nodes, time.time()).items()}
+
+
+def sign(secret: str, platform: str, body: bytes) -> str:
+    return hmac.new(secret.encode("utf-8"), platform.encode("utf-8") + b"\n" + body, hashlib.sha256).hexdigest()
+
+
+class Cluster:
+    """
+    Partitions chats across nodes. Every (platform, chat_id) is owned by one node of a consistent hash ring
+    built from the live members, so its state, caches and ordering stay on that node. An event received
+    by another node is forwarded to the owner as the JSON body of that single event, signed with the shared
+    secret. Attachments are resolved by the owner, which handles the event
+    """
+
+    def __init__(self, node_id: str, url: str, backend: MembershipBackend, secret: str, vnodes: int = 128,
+                 heartbeat_interval: float = 2.0) -> None:
+        """
+        :param node_id: id of this node, unique in the cluster
+        :param url: base url of this node other nodes forward events to
+        :param backend: membership backend
+        :param secret: secret shared by all nodes, forwarded events are signed with it
+        :param vnodes: points of every node on the ring
+        :param heartbeat_interval: seconds between heartbeats, membership is reloaded as often
+        """
+        if not secret:
+            raise ValueError("Cluster mode requires CLUSTER_SECRET")
+        self.node_id = node_id
+        self.url = url.rstrip("/")
+        self.backend = backend
+        self.secret = secret
+        self.vnodes = vnodes
+        self.heartbeat_interval = heartbeat_interval
+        self.members: Dict[str, str] = {}
+        self.ring = HashRing((), vnodes)
+        self.client = ApiClient("cluster", "", stage="forward")
+        self.forwarded = 0
+        self.forward_errors = 0
+        self.received = 0
+        self.rebalances = 0
+        self._task: asyncio.Task | None = None
+
+    async def refresh(self) -> None:
+        """
+        Renews the membership of this node and rebuilds the ring if the members changed
+        :return: None
+        """
+        await self.backend.heartbeat(self.node_id, self.url)
+        members = await self.backend.members()
+        # This node owns its partitions even if the backend has not caught up yet
+        members.setdefault(self.node_id, self.url)
+        if members != self.members:
+            if self.members:
+                self.rebalances += 1
+                logging.info(f"Cluster members changed to {sorted(members)}")
+            self.members = members
+            self.ring = HashRing(members, self.vnodes)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Error: could not refresh the cluster membership:\n{e}")
+
+    async def start(self) -> None:
+        if self._task is None:
+            await self.refresh()
+            self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+
+    async def stop(self) -> None:
+        """
+        Leaves the cluster, so other nodes take over its partitions
+        :return: None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.backend.leave(self.node_id)
+
+    def owner(self, platform: str, chat_id: Hashable) -> Tuple[str, str]:
+        """
+        Returns the node owning a chat
+        :param platform: platform name
+        :param chat_id: a chat id
+        :return: node id and its base url
+        """
+        node_id = self.ring.owner(f"{platform}:{chat_id}") or self.node_id
+        return node_id, self.members.get(node_id, self.url)
+
+    def is_local(self, platform: str, chat_id: Hashable) -> bool:
+        return self.owner(platform, chat_id)[0] == self.node_id
+
+    async def forward(self, url: str, platform: str, body: bytes) -> bool:
+        """
+        Sends an event to the node that owns its chat and waits until it is handled there
+        :param url: base url of the owner
+        :param platform: platform name
+        :param body: JSON body of the event, see Event.to_raw
+        :return: True if the owner handled or queued the event, False if it could not be reached
+        :raises ValueError: if the owner may have received the event but did not confirm it, so it must not
+        be handled again
+        """
+        try:
+            status, response = await self.client.request("POST", url + FORWARD_PATH, body, headers={
+                "Content-Type": "application/json",
+                PLATFORM_HEADER: platform,
+                SIGNATURE_HEADER: sign(self.secret, platform, body),
+            })
+        except aiohttp.ClientConnectorError as e:
+            # No connection was made, so the owner never got the event
+            status, response = None, e
+        except Exception as e:
+            # The owner may have got the event, e.g. on a read timeout, so it must not be handled here as well
+            self.forward_errors += 1
+            raise ValueError(f"{url} did not answer a forwarded event: {e!r}")
+        if status == 200:
+            self.forwarded += 1
+            return True
+        self.forward_errors += 1
+        if status is None or status in _UNREACHABLE:
+            logging.warning(f"Error: could not forward an event to {url}: {status} {response}")
+            return False
+        raise ValueError(f"{url} could not handle a forwarded event: {status} {response}")
+
+    def receive(self, platform: str | None, body: bytes, signature: str | None) -> None:
+        """
+        Checks the signature of a forwarded event
+        :param platform: value of the platform header
+        :param body: request body
+        :param signature: value of the signature header
+        :return: None
+        :raises ValueError: if the signature is invalid
+        """
+        if platform is None or signature is None or not hmac.compare_digest(sign(self.secret, platform, body),
+                                                                             signature):
+            raise ValueError("Invalid cluster signature")
+        self.received += 1
+
+    def stats(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "members": sorted(self.members),
+            "forwarded": self.forwarded,
+            "forward_errors": self.forward_errors,
+            "received": self.received,
+            "rebalances": self.rebalances,
+        }
+
+
+def create_cluster() -> Cluster | None:
+    """
+    Creates the cluster selected by CLUSTER_BACKEND: memory, file (with CLUSTER_MEMBERSHIP_PATH) or none
+    :return: a cluster or None if cluster mode is disabled
+    """
+    if settings.cluster_backend == "none":
+        return None
+    if settings.cluster_backend == "memory":
+        backend = MemoryMembership(settings.cluster_node_ttl)
+    elif settings.cluster_backend == "file":
+        backend = FileMembership(settings.cluster_membership_path, settings.cluster_node_ttl)
+    else:
+        logging.warning(f"Unknown CLUSTER_BACKEND {settings.cluster_backend}, cluster mode is disabled")
+        return None
+    node_id = settings.cluster_node_id or f"{socket.gethostname()}:{settings.port}"
+    url = settings.cluster_node_url or f"http://{socket.gethostname()}:{settings.port}"
+    return Cluster(node_id, url, backend, settings.cluster_secret, settings.cluster_vnodes,
+                   settings.cluster_heartbeat_interval)
+
+
+cluster = create_cluster()
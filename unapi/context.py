@@ -0,0 +1,40 @@
+from typing import Any, Mapping
+
+from fastapi import Request
+
+from unapi import jsonlib
+
+
+class RequestContext:
+    """
+    Per-request context shared by authentication, validation and event creation.
+    It stores headers and the raw body, and decodes the body at most once
+    """
+    __slots__ = ("headers", "raw", "_payload", "_decoded")
+
+    def __init__(self, headers: Mapping[str, str], raw: bytes) -> None:
+        self.headers = headers
+        self.raw = raw
+        self._payload = None
+        self._decoded = False
+
+    @classmethod
+    async def from_request(cls, request: Request) -> "RequestContext":
+        """
+        A class method that reads the request body once and wraps it into a context
+        :param request: an incoming request object
+        :return: a request context
+        """
+        return cls(request.headers, await request.body())
+
+    @property
+    def payload(self) -> Any:
+        """
+        A property that returns the decoded body, decoding it on first access
+        :return: decoded JSON body
+        :raises ValueError: if the body is not valid JSON
+        """
+        if not self._decoded:
+            self._payload = jsonlib.loads(self.raw)
+            self._decoded = True
+        return self._payload
@@ -0,0 +1,153 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Set, Tuple
+
+from unapi.settings import settings
+
+
+class DedupBackend(ABC):
+    """
+    An index of recently seen delivery ids
+    """
+
+    @abstractmethod
+    async def add(self, key: str) -> bool:
+        """
+        Adds a key to the index
+        :param key: a delivery key
+        :return: True if the key was already present, False otherwise
+        """
+        raise NotImplementedError("add is a subclass-implemented method")
+
+    @abstractmethod
+    async def discard(self, key: str) -> None:
+        """
+        Removes a key from the index, so a redelivery of a failed event is processed again
+        :param key: a delivery key
+        :return: None
+        """
+        raise NotImplementedError("discard is a subclass-implemented method")
+
+
+class MemoryDedupBackend(DedupBackend):
+    """
+    In-process index of a time-bucketed ring of sets. Keys live for about `ttl` seconds;
+    once more than `max_size` keys are stored, the oldest buckets are dropped early
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 1_000_000, bucket_count: int = 10) -> None:
+        self.ttl = ttl
+        self.bucket_span = ttl / bucket_count
+        self.bucket_count = bucket_count
+        self.max_size = max_size
+        self._buckets: Deque[Tuple[float, Set[str]]] = deque([(time.monotonic(), set())])
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _rotate(self, now: float) -> None:
+        if now - self._buckets[0][0] >= self.bucket_span:
+            self._buckets.appendleft((now, set()))
+        # Buckets expire by age, so keys do not outlive `ttl` however rarely keys are added
+        while len(self._buckets) > 1 and now - self._buckets[-1][0] >= self.ttl:
+            self._size -= len(self._buckets.pop()[1])
+        while len(self._buckets) > self.bucket_count or (self._size > self.max_size and len(self._buckets) > 1):
+            self._size -= len(self._buckets.pop()[1])
+
+    async def add(self, key: str) -> bool:
+        self._rotate(time.monotonic())
+        for _, bucket in self._buckets:
+            if key in bucket:
+                return True
+        self._buckets[0][1].add(key)
+        self._size += 1
+        return False
+
+    async def discard(self, key: str) -> None:
+        for _, bucket in self._buckets:
+            if key in bucket:
+                bucket.remove(key)
+                self._size -= 1
+
+
+class RedisDedupBackend(DedupBackend):
+    """
+    Index shared by all processes and nodes, kept in Redis with one expiring key per delivery.
+    Requires the optional redis package
+    """
+
+    def __init__(self, url: str, ttl: float = 600, prefix: str = "unapi:dedup:") -> None:
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise ImportError("RedisDedupBackend requires the redis package")
+        self.client = redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    async def add(self, key: str) -> bool:
+        return not await self.client.set(self.prefix + key, 1, nx=True, ex=self.ttl)
+
+    async def discard(self, key: str) -> None:
+        await self.client.delete(self.prefix + key)
+
+
+class Deduplicator:
+    """
+    Drops redeliveries of events that were already received. Platforms retry slow or failed webhooks,
+    and every retry carries the same delivery id
+    """
+
+    def __init__(self, backend: DedupBackend | None) -> None:
+        self.backend = backend
+        self.checked = 0
+        self.duplicates = 0
+
+    async def is_duplicate(self, event: "Event") -> bool:
+        """
+        Records an event as received
+        :param event: an incoming event
+        :return: True if the event was already received, False otherwise
+        """
+        if self.backend is None:
+            return False
+        self.checked += 1
+        if await self.backend.add(event.delivery_key):
+            self.duplicates += 1
+            return True
+        return False
+
+    async def forget(self, event: "Event") -> None:
+        """
+        Forgets an event whose processing failed, so its redelivery is processed
+        :param event: an event
+        :return: None
+        """
+        if self.backend is not None:
+            await self.backend.discard(event.delivery_key)
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+        }
+
+
+def create_backend() -> DedupBackend | None:
+    """
+    Creates the backend selected by DEDUP_BACKEND: memory, redis (with DEDUP_REDIS_URL) or none
+    :return: a backend or None if deduplication is disabled
+    """
+    if settings.dedup_backend == "memory":
+        return MemoryDedupBackend(settings.dedup_ttl, settings.dedup_max_size)
+    if settings.dedup_backend == "redis":
+        return RedisDedupBackend(settings.dedup_redis_url, settings.dedup_ttl)
+    if settings.dedup_backend != "none":
+        logging.warning(f"Unknown DEDUP_BACKEND {settings.dedup_backend}, deduplication is disabled")
+    return None
+
+
+deduplicator = Deduplicator(create_backend())
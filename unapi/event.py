@@ -1,38 +1,70 @@
+import asyncio
+import time
+
 from pydantic import BaseModel
-from typing import Union, List
+from typing import Any, Union, List, Type, Callable, Tuple
 
-from unapi.util import AbcNoPublicConstructor
-from unapi.attachment import Attachment
+from unapi.util import AbcNoPublicConstructor, AsyncDownloadStream, DownloadStream
+from unapi.attachment import Attachment, AttachmentType
+from unapi.context import RequestContext
+from unapi.record import EventRecord
+from unapi import outbound
+from unapi import metrics
+from unapi import tracing
+from unapi import platforms
+from unapi import state
+from unapi.settings import settings
 
 from abc import abstractmethod
 from fastapi import Request
-from os import environ
 
 
 class Event(metaclass=AbcNoPublicConstructor):
     """
     Event class for all messengers with a private constructor.
-    It stores text, chat_id and original request body
+    It stores text, chat_id, original request body and the request context it was created from
     """
+    # Platform name and outbound limits in messages per second, globally and per chat. None means unlimited
+    platform: str
+    rate_limit: float | None = None
+    chat_rate_limit: float | None = None
+    # Recipients one call of `send_batch_async` takes
+    broadcast_batch_size: int = 1
+    # A key every valid body of the platform contains. Bodies without it are rejected before validation
+    json_marker: bytes | None = None
+
     original: BaseModel
+    context: RequestContext | None = None
     __attachments: List[Attachment] | None = None
 
-    def __init__(self, original: BaseModel) -> None:
+    def __init__(self, original: BaseModel, context: RequestContext | None = None) -> None:
         if not isinstance(original, BaseModel):
             raise ValueError("original must be a pydantic BaseModel subclass")
 
         self.original = original
+        self.context = context
 
     @classmethod
-    def create(cls, data: BaseModel) -> "Event":
+    def create(cls, data: BaseModel, context: RequestContext | None = None) -> "Event":
         """
         A class method that creates an event from respective pydantic model
         :param data: an incoming request body, already checked for validity and in pydantic model format
+        :param context: the request context the body was decoded from
         :return: an event object
         """
         if cls is Event:
             raise NotImplementedError("create should never be called on Event directly")
-        return cls._create(data)
+        return cls._create(data, context)
+
+    @classmethod
+    def split(cls, data: BaseModel) -> List[BaseModel]:
+        """
+        A class method that splits a request body into bodies of single events.
+        Most platforms deliver exactly one event per request, so the body is returned as is
+        :param data: an incoming request body in pydantic model format
+        :return: a list of bodies, one per event
+        """
+        return [data]
 
     @property
     @abstractmethod
@@ -43,6 +75,31 @@ class Event(metaclass=AbcNoPublicConstructor):
         """
         raise NotImplementedError("chat_id is a subclass-implemented property")
 
+    @property
+    @abstractmethod
+    def delivery_id(self) -> int | str:
+        """
+        A property that returns an id the platform keeps when it redelivers the event
+        :return: a delivery id
+        """
+        raise NotImplementedError("delivery_id is a subclass-implemented property")
+
+    @property
+    def delivery_key(self) -> str:
+        """
+        A property that returns the delivery id qualified with the platform name
+        :return: a delivery key
+        """
+        return f"{self.platform}:{self.delivery_id}"
+
+    @property
+    def timestamp(self) -> float:
+        """
+        A property that returns Unix time the message was sent at
+        :return: a timestamp in seconds
+        """
+        raise NotImplementedError("timestamp is a subclass-implemented property")
+
     @property
     @abstractmethod
     def text(self) -> str:
@@ -60,7 +117,8 @@ class Event(metaclass=AbcNoPublicConstructor):
         :return: List[Attachment]
         """
         if self.__attachments is None:
-            self.__attachments = self._get_attachments()
+            with tracing.span("get_attachments"):
+                self.__attachments = self._get_attachments()
 
         return self.__attachments
 
@@ -72,52 +130,194 @@ class Event(metaclass=AbcNoPublicConstructor):
         """
         raise NotImplementedError("text is a subclass-implemented property")
 
-    def download_attachments(self, save: bool = True) -> List[str | bytes | None]:
+    async def get_attachments_async(self) -> List[Attachment]:
+        """
+        Awaitable counterpart of `attachments` that shares its cache
+        :return: List[Attachment]
+        """
+        if self.__attachments is None:
+            with tracing.span("get_attachments"):
+                self.__attachments = await self._get_attachments_async()
+
+        return self.__attachments
+
+    async def _get_attachments_async(self) -> List[Attachment]:
+        """
+        A method that gathers message attachments without blocking the event loop.
+        Gathering is pure by default; platforms that make API calls to resolve attachments must override it
+        :return: List[Attachment]
+        """
+        return self._get_attachments()
+
+    def download_attachments(self, save: bool = True, stream: bool = False) -> List[str | bytes | DownloadStream | None]:
         """
         A method that downloads message attachments
         :param save: if True, saves attachments to local storage and returns paths
-        :return: List[str | bytes | None]
+        :param stream: without `save`, if True chunk iterators are returned instead of bytes
+        :return: List[str | bytes | DownloadStream | None]
         """
-        return [attachment.download(save) for attachment in self.attachments]
+        attachments = self.attachments
+        with metrics.stage_seconds.time(self.platform, "download"):
+            return [attachment.download(save, stream) for attachment in attachments]
+
+    async def download_attachments_async(self, save: bool = True,
+                                         stream: bool = False) -> List[str | bytes | AsyncDownloadStream | None]:
+        """
+        A method that resolves and downloads all message attachments concurrently
+        :param save: if True, saves attachments to local storage and returns paths
+        :param stream: without `save`, if True async chunk iterators are returned instead of bytes
+        :return: List[str | bytes | AsyncDownloadStream | None]
+        """
+        attachments = await self.get_attachments_async()
+        with metrics.stage_seconds.time(self.platform, "download"):
+            return list(await asyncio.gather(*(attachment.download_async(save, stream)
+                                               for attachment in attachments)))
+
+    def to_record(self) -> EventRecord:
+        """
+        A method that converts the event to a compact record. Attachments are resolved if they were not yet
+        :return: an event record
+        """
+        return self._record(self.attachments)
+
+    async def to_record_async(self) -> EventRecord:
+        """
+        Awaitable counterpart of `to_record` that resolves attachments without blocking the event loop
+        :return: an event record
+        """
+        return self._record(await self.get_attachments_async())
+
+    def to_raw(self) -> bytes:
+        """
+        A method that serializes the body of this event alone back to JSON, e.g. to hand it to another node.
+        Attachments are not resolved, `create_all_from_raw` of the result creates an equal event
+        :return: JSON bytes
+        """
+        return self.original.model_dump_json(by_alias=True).encode("utf-8")
+
+    def _record(self, attachments: List[Attachment]) -> EventRecord:
+        return EventRecord(
+            self.platform, self.chat_id, self.text, self.delivery_id, self.timestamp,
+            tuple((a.name, a.type_.value, a.extension, a.url, a.source_id) for a in attachments),
+        )
+
+    @classmethod
+    def from_record(cls, record: EventRecord) -> "Event":
+        """
+        A class method that creates an event from a record. Attachments of the record are reused as is
+        :param record: an event record of this platform
+        :return: an event object without a request context
+        """
+        event = cls._create(cls._original_from_record(record))
+        event.__attachments = [
+            Attachment(name=name, type_=AttachmentType(type_), extension=extension, url=url, source_id=source_id)
+            for name, type_, extension, url, source_id in record.attachments
+        ]
+        return event
+
+    @classmethod
+    def _original_from_record(cls, record: EventRecord) -> BaseModel:
+        """
+        A class method that builds a minimal original body, filled with the fields the record keeps
+        :param record: an event record of this platform
+        :return: an unvalidated pydantic model
+        """
+        raise NotImplementedError("_original_from_record is a subclass-implemented method")
 
     @classmethod
-    async def create_if_valid(cls, request: Request) -> Union["Event", None]:
+    async def create_if_valid(cls, context: RequestContext) -> Union["Event", None]:
         """
         A class method that creates an event from json if it is valid
-        :param request: an incoming request object
+        :param context: a context of an incoming request
         :return: an event object or None if request is invalid
         """
-        data = await cls.is_request_valid(request)
-        if data:
-            return cls.create(data)
+        with tracing.span("create_if_valid"):
+            data = await cls.is_request_valid(context)
+            if data:
+                return cls.create(data, context)
         return None
 
     @classmethod
-    async def is_request_valid(cls, request: Request) -> BaseModel | None:
+    async def create_all_if_valid(cls, context: RequestContext) -> List["Event"] | None:
         """
-        A static method that checks if json is valid for this event
-        :param request: an incoming request object
-        :return: True if request is valid, False otherwise
+        A class method that creates all events batched into one request if it is valid.
+        The request is authenticated and validated once, not once per event
+        :param context: a context of an incoming request
+        :return: a list of events, possibly empty, or None if request is invalid
+        """
+        with tracing.span("create_if_valid"):
+            data = await cls.is_request_valid(context)
+            if data:
+                return [cls.create(item, context) for item in cls.split(data)]
+        return None
+
+    @classmethod
+    async def is_request_valid(cls, context: RequestContext) -> BaseModel | None:
+        """
+        A class method that checks if request is authentic and its json is valid for this event.
+        The raw body is validated directly, without decoding it to a dict first
+        :param context: a context of an incoming request
+        :return: a parsed pydantic model if request is valid, None otherwise
         """
-        return (await cls.is_request_authentic(request)) and cls.is_json_valid(await request.json())
+        with metrics.stage_seconds.time(cls.platform, "authentication"), tracing.span("is_request_authentic"):
+            authentic = await cls.is_request_authentic(context)
+        if not authentic:
+            metrics.failures.inc(cls.platform, "bad_signature")
+            return None
+        return cls._validate(context)
+
+    @classmethod
+    def _validate(cls, context: RequestContext) -> BaseModel | None:
+        with metrics.stage_seconds.time(cls.platform, "validation"), tracing.span("is_json_valid"):
+            data = None
+            if cls.json_marker is None or cls.json_marker in context.raw:
+                data = cls.is_json_valid(context.raw)
+        if data is None:
+            cls._count_invalid(context)
+        return data
+
+    @classmethod
+    def create_all_from_raw(cls, raw: bytes) -> List["Event"] | None:
+        """
+        A class method that creates all events of a body that was authenticated before, e.g. one read
+        from the event log. The body is validated, but not authenticated again
+        :param raw: a request body as JSON bytes
+        :return: a list of events, possibly empty, or None if the body is invalid
+        """
+        context = RequestContext({}, raw)
+        with tracing.span("create_if_valid"):
+            data = cls._validate(context)
+            if data:
+                return [cls.create(item, context) for item in cls.split(data)]
+        return None
+
+    @classmethod
+    def _count_invalid(cls, context: RequestContext) -> None:
+        # Only rejected bodies are decoded a second time, to tell malformed JSON from a wrong schema
+        try:
+            context.payload
+        except ValueError:
+            metrics.failures.inc(cls.platform, "invalid_json")
+        else:
+            metrics.failures.inc(cls.platform, "invalid_payload")
 
     @staticmethod
     @abstractmethod
-    async def is_request_authentic(request: Request) -> bool:
+    async def is_request_authentic(context: RequestContext) -> bool:
         """
         A static method that checks if request comes from a valid place
-        :param request: an incoming request object
+        :param context: a context of an incoming request
         :return: True if request is valid, False otherwise
         """
         raise NotImplementedError("is_request_authentic is a subclass-implemented method")
 
     @staticmethod
     @abstractmethod
-    def is_json_valid(json_data: dict) -> BaseModel | None:
+    def is_json_valid(raw: bytes) -> BaseModel | None:
         """
-        A static method that checks if json is valid for this event
-        :param json_data: an incoming request body in json format
-        :return: True if json is valid, False otherwise
+        A static method that parses and validates a raw body in one pass
+        :param raw: an incoming request body as JSON bytes
+        :return: a parsed pydantic model if json is valid, None otherwise
         """
         raise NotImplementedError("is_json_valid is a subclass-implemented method")
 
@@ -130,19 +330,148 @@ class Event(metaclass=AbcNoPublicConstructor):
         """
         raise NotImplementedError("send_message is a subclass-implemented method")
 
+    @abstractmethod
+    async def send_message_async(self, text: str) -> Tuple[int, Any]:
+        """
+        Awaitable counterpart of `send_message` that sends through the pooled async client
+        :param text: a message to send
+        :return: int - response status, Any - response body
+        """
+        raise NotImplementedError("send_message_async is a subclass-implemented method")
+
+    @classmethod
+    async def send_batch_async(cls, chat_ids: List[int | str], text: str) -> List[str | None]:
+        """
+        A class method that sends one message to several chats in a single API call if the platform allows it
+        :param chat_ids: at most `broadcast_batch_size` chat ids
+        :param text: a message to send
+        :return: an error per chat id, None where the message was sent
+        """
+        raise NotImplementedError("send_batch_async is a subclass-implemented method")
+
+    async def enqueue_message(self, text: str) -> None:
+        """
+        A method that puts a message to the outbound queue instead of sending it inline.
+        Queue workers send it respecting rate limits of the platform
+        :param text: a message to send
+        :return: None
+        """
+        await outbound.queue.enqueue(type(self), self.chat_id, self.send_message_async, text)
+
+    async def get_state(self) -> dict | None:
+        """
+        A method that returns the conversation state of the chat of the event
+        :return: the state or None if the chat has none
+        """
+        return await state.store.get(self.platform, self.chat_id)
+
+    async def set_state(self, value: dict | None) -> None:
+        """
+        A method that sets the conversation state of the chat of the event
+        :param value: a JSON-serializable state, None deletes it
+        :return: None
+        """
+        await state.store.set(self.platform, self.chat_id, value)
+
+    async def reply(self, text: str) -> None:
+        """
+        A method that sends a message to the chat of the event: through the outbound queue
+        if SEND_MODE is queue, inline otherwise
+        :param text: a message to send
+        :return: None
+        """
+        if settings.send_mode == "queue":
+            await self.enqueue_message(text)
+        else:
+            with tracing.span("send_message"):
+                await self.send_message_async(text)
+
 
 class EventFactory:
     @staticmethod
-    async def create_event(request: Request) -> Event:
+    def register(header: str) -> Callable[[Type[Event]], Type[Event]]:
+        """
+        A class decorator that registers and enables an already imported platform event class.
+        Built-in platforms are registered lazily in unapi.platforms instead
+        :param header: name of a header only requests of the platform carry, e.g. X-Telegram-Bot-Api-Secret-Token
+        :return: a decorator that returns the class unchanged
+        """
+        def decorator(messenger: Type[Event]) -> Type[Event]:
+            spec = platforms.PlatformSpec(messenger.platform, f"{messenger.__module__}:{messenger.__qualname__}", header)
+            platforms.register(spec, enable=True).load()
+            return messenger
+
+        return decorator
+
+    @staticmethod
+    def resolve(request: Request) -> Type[Event] | None:
+        """
+        A static method that picks the platform event class by request headers, without touching the body.
+        The platform module is imported on first use
+        :param request: an incoming request object
+        :return: an event class or None if no header of an enabled platform is present
+        """
+        start = time.perf_counter()
+        for header_name in request.headers.keys():
+            spec = platforms.by_header(header_name)
+            if spec is not None:
+                messenger = spec.load()
+                metrics.webhooks.inc(spec.name)
+                metrics.stage_seconds.observe(time.perf_counter() - start, spec.name, "dispatch")
+                return messenger
+        metrics.failures.inc("unknown", "unknown_origin")
+        return None
+
+    @classmethod
+    async def create_event(cls, request: Request) -> Event:
         """
-        A static method that decides exact class for an event and creates it from json
+        A class method that decides exact class for an event and creates it from json
         :param request: an incoming request object
         :return: an event object
         """
-        for messenger in Event.__subclasses__():
-            evt = await messenger.create_if_valid(request)
-            if evt is None:
-                continue
-            return evt
+        messenger = cls.resolve(request)
+        if messenger is None:
+            raise ValueError("Unknown request origin")
+
+        context = await RequestContext.from_request(request)
+        evt = await messenger.create_if_valid(context)
+        if evt is None:
+            raise ValueError(f"Invalid {messenger.__name__} request")
+        return evt
+
+    @classmethod
+    async def authenticate(cls, request: Request) -> Tuple[Type[Event], RequestContext]:
+        """
+        A class method that decides exact class for a request and checks that it is authentic,
+        without validating its body
+        :param request: an incoming request object
+        :return: the event class and the request context
+        """
+        messenger = cls.resolve(request)
+        if messenger is None:
+            raise ValueError("Unknown request origin")
+
+        context = await RequestContext.from_request(request)
+        with metrics.stage_seconds.time(messenger.platform, "authentication"):
+            authentic = await messenger.is_request_authentic(context)
+        if not authentic:
+            metrics.failures.inc(messenger.platform, "bad_signature")
+            raise ValueError(f"Invalid {messenger.__name__} request")
+        return messenger, context
+
+    @classmethod
+    async def create_events(cls, request: Request) -> List[Event]:
+        """
+        A class method that decides exact class for a request and creates every event batched into it
+        :param request: an incoming request object
+        :return: a list of event objects, empty if the request carries nothing to handle
+        """
+        messenger = cls.resolve(request)
+        if messenger is None:
+            raise ValueError("Unknown request origin")
 
-        raise ValueError("Unknown request origin")
+        context = await RequestContext.from_request(request)
+        events = await messenger.create_all_if_valid(context)
+        if events is None:
+            raise ValueError(f"Invalid {messenger.__name__} request")
+        return events
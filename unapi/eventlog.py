@@ -0,0 +1,467 @@
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+from unapi.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the log directory is not locked there
+    fcntl = None
+
+# Every record is the length and crc32 of its body followed by the body: platform name, a zero byte, raw body
+_header = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".log"
+_OFFSET_SUFFIX = ".offset"
+_fsync = getattr(os, "fdatasync", os.fsync)
+
+
+class LogEntry:
+    __slots__ = ("offset", "next_offset", "platform", "raw")
+
+    def __init__(self, offset: int, next_offset: int, platform: str, raw: bytes) -> None:
+        self.offset = offset
+        self.next_offset = next_offset
+        self.platform = platform
+        self.raw = raw
+
+
+def _encode(platform: str, raw: bytes) -> bytes:
+    body = platform.encode("utf-8") + b"\0" + raw
+    return _header.pack(len(body), zlib.crc32(body)) + body
+
+
+class EventLog:
+    """
+    A durable, segmented, append-only log of raw webhook bodies. Offsets are byte positions in the
+    whole log, and a segment file is named by the offset it starts at. Appends are written right away
+    and made durable by group commit: one fsync, in a background thread, covers every append made
+    while the previous one ran, so an append waits for the disk but costs little more than a write.
+    Records are read through memory maps, only up to the last committed offset, and consumers
+    keep their committed offsets in files next to the segments
+    """
+
+    def __init__(self, path: str, segment_size: int = 64 * 1024 * 1024, commit_delay: float = 0.001) -> None:
+        """
+        :param path: a directory of the log, created if missing
+        :param segment_size: bytes after which a new segment is started
+        :param commit_delay: seconds a commit waits to group more appends, 0 commits right away
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.commit_delay = commit_delay
+        # Start offsets of the segments, in order
+        self._segments: List[int] = []
+        self._fd: int | None = None
+        self._lock_fd: int | None = None
+        self._base = 0
+        self._end = 0
+        self.committed = 0
+        # Files written since the last commit, and those of full segments to close after it
+        self._unsynced: Set[int] = set()
+        self._retired: List[int] = []
+        self._waiters: List[Tuple[int, asyncio.Future]] = []
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._offsets: Dict[str, int] = {}
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="unapi-eventlog")
+        self._task: asyncio.Task | None = None
+        self._commit_now: asyncio.Event | None = None
+        self._committed_event: asyncio.Event | None = None
+        self._stopping = False
+        # The error of a failed commit, after which nothing is committed
+        self._failed: OSError | None = None
+        self.appends = 0
+        self.commits = 0
+        self.commit_errors = 0
+        self.commit_time = 0.0
+        self.recovered = 0
+
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.path, f"{base:020d}{_SEGMENT_SUFFIX}")
+
+    def open(self) -> None:
+        """
+        Opens the log, truncating a record left incomplete by a crash at its end. Does nothing if it is open
+        :return: None
+        :raises ValueError: if another process holds the log
+        """
+        if self._fd is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        if fcntl is not None:
+            self._lock_fd = os.open(os.path.join(self.path, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+                raise ValueError(f"The event log {self.path} is used by another process")
+        self._segments = sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                                if name.endswith(_SEGMENT_SUFFIX)) or [0]
+        self._base = self._segments[-1]
+        self._fd = os.open(self._segment_path(self._base), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._end = self.committed = self._base + self._recover(self._fd)
+        for name in os.listdir(self.path):
+            if name.endswith(_OFFSET_SUFFIX):
+                self._offsets[name[:-len(_OFFSET_SUFFIX)]] = self._read_offset(name)
+
+    def _recover(self, fd: int) -> int:
+        with open(self._segment_path(self._base), "rb") as f:
+            data = f.read()
+        size = len(data)
+        position = 0
+        while position + _header.size <= size:
+            length, crc = _header.unpack_from(data, position)
+            end = position + _header.size + length
+            if end > size or zlib.crc32(data[position + _header.size:end]) != crc:
+                break
+            position = end
+        if position != size:
+            self.recovered += 1
+            logging.warning(f"Event log: dropped {size - position} bytes of an incomplete record "
+                            f"at offset {self._base + position}")
+            os.ftruncate(fd, position)
+        return position
+
+    def start(self) -> None:
+        """
+        Opens the log and starts committing in the running event loop. Does nothing if it is already started
+        :return: None
+        """
+        if self._task is None:
+            self.open()
+            self._stopping = False
+            self._commit_now = asyncio.Event()
+            self._committed_event = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._committer())
+
+    async def stop(self) -> None:
+        """
+        Commits pending appends and closes the log
+        :return: None
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._commit_now.set()
+            await self._task
+            self._task = None
+        await self._commit()
+        for view in self._maps.values():
+            view.close()
+        self._maps = {}
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def append(self, platform: str, raw: bytes) -> int:
+        """
+        Appends a raw body and waits until it is durable
+        :param platform: platform name
+        :param raw: an authenticated request body
+        :return: offset of the record
+        :raises ValueError: if a commit failed before
+        """
+        self.start()
+        if self._failed is not None:
+            raise ValueError(f"The event log {self.path} failed to commit, it has to be reopened")
+        record = _encode(platform, raw)
+        if self._end > self._base and self._end - self._base + len(record) > self.segment_size:
+            self._roll()
+        os.write(self._fd, record)
+        offset = self._end
+        self._end += len(record)
+        self._unsynced.add(self._fd)
+        self.appends += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((self._end, future))
+        self._commit_now.set()
+        await future
+        return offset
+
+    def _roll(self) -> None:
+        self._retired.append(self._fd)
+        self._base = self._end
+        self._segments.append(self._base)
+        self._fd = os.open(self._segment_path(self._base), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    async def _committer(self) -> None:
+        while not self._stopping:
+            await self._commit_now.wait()
+            if self.commit_delay:
+                await asyncio.sleep(self.commit_delay)
+            self._commit_now.clear()
+            await self._commit()
+
+    def _sync(self, fds: List[int], retired: List[int]) -> None:
+        for fd in fds:
+            _fsync(fd)
+        for fd in retired:
+            os.close(fd)
+        if retired and hasattr(os, "O_DIRECTORY"):
+            # New segment files are durable only once the directory is
+            directory = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    async def _commit(self) -> None:
+        if not self._waiters and not self._retired:
+            return
+        waiters, self._waiters = self._waiters, []
+        fds, self._unsynced = self._unsynced, set()
+        retired, self._retired = self._retired, []
+        start = time.monotonic()
+        if self._failed is None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._sync, list(fds), retired)
+            except OSError as e:
+                self.commit_errors += 1
+                logging.error(f"Error: could not commit the event log:\n{e}")
+                # A failed fsync can drop the dirty pages, so a later one may succeed without the
+                # records being durable: appends made since the last commit are never committed
+                self._failed = e
+        if self._failed is not None:
+            for _, future in waiters:
+                if not future.done():
+                    future.set_exception(self._failed)
+            return
+        self.commits += 1
+        self.commit_time += time.monotonic() - start
+        if waiters:
+            self.committed = max(self.committed, waiters[-1][0])
+        for _, future in waiters:
+            if not future.done():
+                future.set_result(None)
+        # Wakes up consumers waiting for new records
+        self._committed_event.set()
+        self._committed_event = asyncio.Event()
+
+    async def wait(self, offset: int, timeout: float | None = None) -> bool:
+        """
+        Waits until records after `offset` are committed
+        :param offset: an offset
+        :param timeout: seconds to wait, None to wait forever
+        :return: True if there are records after `offset`
+        """
+        self.start()
+        if self.committed <= offset:
+            try:
+                await asyncio.wait_for(self._committed_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.committed > offset
+
+    def _map(self, base: int, size: int) -> mmap.mmap:
+        view = self._maps.get(base)
+        if view is None or len(view) < size:
+            if view is not None:
+                view.close()
+            with open(self._segment_path(base), "rb") as f:
+                view = self._maps[base] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return view
+
+    def read(self, offset: int, limit: int = 1000) -> List[LogEntry]:
+        """
+        Reads committed records starting at an offset
+        :param offset: offset of the first record, e.g. a committed offset of a consumer
+        :param limit: records to read at most
+        :return: entries in the order of the log, empty if there are no committed records after `offset`
+        :raises ValueError: if the offset is before the start of the log or a record is corrupt
+        """
+        entries = []
+        while len(entries) < limit and offset < self.committed:
+            index = bisect.bisect_right(self._segments, offset) - 1
+            if index < 0:
+                raise ValueError(f"Offset {offset} is before the start of the event log")
+            base = self._segments[index]
+            end = self._segments[index + 1] if index + 1 < len(self._segments) else self.committed
+            view = self._map(base, end - base)
+            position = offset - base
+            while len(entries) < limit and position < end - base:
+                start = position + _header.size
+                corrupt = start > end - base
+                if not corrupt:
+                    length, crc = _header.unpack_from(view, position)
+                    body = view[start:start + length]
+                    corrupt = start + length > end - base or zlib.crc32(body) != crc
+                if corrupt:
+                    # Records before a corrupt one are returned, the next read raises at its offset
+                    if entries:
+                        return entries
+                    raise ValueError(f"The event log record at offset {base + position} is corrupt")
+                platform, _, raw = body.partition(b"\0")
+                position = start + length
+                entries.append(LogEntry(offset, base + position, platform.decode("utf-8"), raw))
+                offset = base + position
+        return entries
+
+    def next_segment(self, offset: int) -> int | None:
+        """
+        Returns the start of the segment after the one holding an offset, where reading can resume
+        past a corrupt record
+        :param offset: an offset
+        :return: start offset of the next segment or None if the offset is in the last one
+        """
+        index = bisect.bisect_right(self._segments, offset)
+        return self._segments[index] if index < len(self._segments) else None
+
+    def _read_offset(self, name: str) -> int:
+        with open(os.path.join(self.path, name), "r") as f:
+            return int(f.read())
+
+    def load_offset(self, consumer: str) -> int:
+        """
+        Returns the committed offset of a consumer, the start of the log for a new one
+        :param consumer: consumer name
+        :return: an offset
+        """
+        self.open()
+        return max(self._offsets.get(consumer, 0), self._segments[0])
+
+    def _write_offset(self, consumer: str, offset: int) -> None:
+        file_path = os.path.join(self.path, consumer + _OFFSET_SUFFIX)
+        with open(file_path + ".tmp", "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file_path + ".tmp", file_path)
+
+    async def commit_offset(self, consumer: str, offset: int) -> None:
+        """
+        Saves the offset a consumer resumes from. Segments every consumer is done with are deleted
+        :param consumer: consumer name
+        :param offset: offset after the last handled record
+        :return: None
+        """
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write_offset, consumer, offset)
+        self._offsets[consumer] = offset
+        self._delete_before(min(self._offsets.values()))
+
+    def _delete_before(self, offset: int) -> None:
+        # The active segment is never deleted
+        while len(self._segments) > 1 and self._segments[1] <= offset:
+            base = self._segments.pop(0)
+            view = self._maps.pop(base, None)
+            if view is not None:
+                view.close()
+            os.remove(self._segment_path(base))
+
+    def stats(self) -> dict:
+        """
+        Returns the size of the log, commit counters and the lag of every consumer in bytes
+        :return: dict of stats
+        """
+        return {
+            "segments": len(self._segments),
+            "end": self._end,
+            "committed": self.committed,
+            "appends": self.appends,
+            "commits": self.commits,
+            "appends_per_commit": self.appends / self.commits if self.commits else 0.0,
+            "avg_commit_time": self.commit_time / self.commits if self.commits else 0.0,
+            "commit_errors": self.commit_errors,
+            "failed": self._failed is not None,
+            "recovered": self.recovered,
+            "consumer_lag": {name: self.committed - offset for name, offset in self._offsets.items()},
+        }
+
+
+class LogConsumer:
+    """
+    Replays the event log from the committed offset of a named consumer. Every batch of records
+    is handled concurrently, and the offset is committed once the whole batch is done, so a record
+    is handled at least once even if the process crashes in the middle of it
+    """
+
+    def __init__(self, log: EventLog, name: str, handler: Callable[[str, bytes], Awaitable[None]],
+                 batch_size: int = 1000) -> None:
+        """
+        :param log: an event log
+        :param name: consumer name, the committed offset is kept under it
+        :param handler: a coroutine function called with platform name and raw body of every record
+        :param batch_size: records handled at once
+        """
+        self.log = log
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.offset = 0
+        self.handled = 0
+        self.failed = 0
+        # Bytes of the log skipped past corrupt records, and the error that stopped the consumer
+        self.skipped = 0
+        self.error: str | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self.error = None
+            self.offset = self.log.load_offset(self.name)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops after the batch in progress, whose offset is committed
+        :return: None
+        """
+        if self._task is not None:
+            self._stopping = True
+            await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                entries = self.log.read(self.offset, self.batch_size)
+            except Exception as e:
+                # The rest of a segment cannot be read past a corrupt record, reading resumes at the next one
+                next_offset = self.log.next_segment(self.offset)
+                if next_offset is None:
+                    self.error = str(e)
+                    logging.error(f"Error: the event log consumer {self.name} stopped:\n{e}")
+                    return
+                logging.error(f"Error: skipped {next_offset - self.offset} bytes of the event log:\n{e}")
+                self.skipped += next_offset - self.offset
+                self.offset = next_offset
+                await self.log.commit_offset(self.name, self.offset)
+                continue
+            if not entries:
+                await self.log.wait(self.offset, timeout=0.5)
+                continue
+            results = await asyncio.gather(*(self.handler(entry.platform, entry.raw) for entry in entries),
+                                           return_exceptions=True)
+            for entry, result in zip(entries, results):
+                if isinstance(result, Exception):
+                    # A failing record is not retried, so it cannot stop the log
+                    self.failed += 1
+                    logging.error(f"Error: could not handle the event log record at offset {entry.offset}:\n{result}")
+            self.handled += len(entries)
+            self.offset = entries[-1].next_offset
+            await self.log.commit_offset(self.name, self.offset)
+
+    def stats(self) -> dict:
+        return {
+            "offset": self.offset,
+            "lag": self.log.committed - self.offset,
+            "handled": self.handled,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "running": self._task is not None and not self._task.done(),
+            "error": self.error,
+        }
+
+
+log = EventLog(settings.event_log_path, settings.event_log_segment_size, settings.event_log_commit_delay)
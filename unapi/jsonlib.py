@@ -0,0 +1,35 @@
+import json
+from typing import Any
+
+from unapi.settings import settings
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup
+    orjson = None
+
+# JSON_BACKEND=json forces the standard library even if orjson is installed
+backend = "orjson" if orjson is not None and settings.json_backend == "orjson" else "json"
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    Decodes a JSON document with the selected backend
+    :param data: raw JSON as bytes or str
+    :return: decoded object
+    :raises ValueError: if data is not a valid JSON document
+    """
+    if backend == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encodes an object to compact UTF-8 JSON with the selected backend
+    :param obj: an object to encode
+    :return: encoded JSON as bytes
+    """
+    if backend == "orjson":
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
@@ -1,18 +1,88 @@
+import asyncio
+import hmac
 import logging
-
-from fastapi import FastAPI, HTTPException, Query, Request
-
-from unapi.event import EventFactory
+import signal
+from typing import List
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+
+from unapi.cache import TTLCache
+from unapi.client import ApiClient
+from unapi.event import Event, EventFactory
+from unapi import outbound
+from unapi import metrics
+from unapi import cluster
+from unapi import eventlog
+from unapi import profiling
+from unapi import sharding
+from unapi import tracing
+from unapi.dedup import deduplicator
+from unapi import storage
 from unapi import platforms
+from unapi import state
+from unapi.router import router
+from unapi.settings import settings
 
 from unapi.webhooks import init as webhooks_init
 
-from os import environ
-
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s")
+tracing.install_log_filter()
 app = FastAPI()
 
-webhook_path = environ["WEBHOOK_PATH"]
+webhook_path = settings.webhook_path
+# "queue" acks webhooks right away and sends replies from background workers, "inline" sends before acking
+send_mode = settings.send_mode
+# "log" acks webhooks once their bodies are durable in the event log, a consumer handles them from there
+ingest_mode = settings.ingest_mode
+consumer: eventlog.LogConsumer | None = None
+# TELEGRAM_INGEST=polling receives Telegram updates by long polling instead of webhooks
+poller = None
+
+
+@app.on_event("startup")
+async def startup():
+    global consumer, poller
+    # Platforms are imported on their first webhook unless PRELOAD_PLATFORMS is set
+    if settings.preload_platforms:
+        platforms.load_enabled()
+    if send_mode == "queue":
+        outbound.queue.start()
+    state.store.start()
+    sharding.executor.start()
+    if cluster.cluster is not None:
+        await cluster.cluster.start()
+    if ingest_mode == "log":
+        eventlog.log.start()
+        consumer = eventlog.LogConsumer(eventlog.log, "main", handle_logged, settings.event_log_batch)
+        consumer.start()
+    if settings.telegram_ingest == "polling" and any(spec.name == "telegram" for spec in platforms.enabled()):
+        from unapi.platforms.telegram.polling import create_poller
+        poller = create_poller(route_event)
+        poller.start()
+    if profiling.watchdog is not None:
+        profiling.watchdog.start()
+    # With PROFILING on, SIGUSR1 samples the event loop for PROFILE_DURATION seconds into PROFILE_PATH
+    if settings.profiling and hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, lambda: asyncio.ensure_future(profiling.profile_to_file(settings.profile_duration)))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if poller is not None:
+        await poller.stop()
+    if cluster.cluster is not None:
+        await cluster.cluster.stop()
+    if consumer is not None:
+        await consumer.stop()
+    await eventlog.log.stop()
+    await sharding.executor.stop(settings.shutdown_timeout)
+    await outbound.queue.stop(settings.shutdown_timeout)
+    await state.store.stop()
+    await ApiClient.close_all()
+    if profiling.watchdog is not None:
+        await profiling.watchdog.stop()
 
 
 @app.get("/")
@@ -20,6 +90,43 @@ async def index():
     return "I'm ok"
 
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "outbound": outbound.queue.stats(),
+        "throttled_by_platform": {client.name: client.throttled for client in ApiClient.instances},
+        "caches": {cache.name: cache.stats() for cache in TTLCache.instances},
+        "dedup": deduplicator.stats(),
+        "storage": storage.content_storage.stats() if storage.content_storage is not None else None,
+        "platforms": platforms.stats(),
+        "state": state.store.stats(),
+        "shards": sharding.executor.stats(),
+        "telegram_polling": poller.stats() if poller is not None else None,
+        "cluster": cluster.cluster.stats() if cluster.cluster is not None else None,
+        "event_log": {**eventlog.log.stats(), "consumer": consumer.stats()} if consumer is not None else None,
+        "loop_watchdog": profiling.watchdog.stats() if profiling.watchdog is not None else None,
+    }
+
+
+@app.post("/admin/profile")
+async def admin_profile(seconds: float = Query(None), admin_token: str = Header(None, alias="X-Admin-Token")):
+    # Available only with PROFILING on and ADMIN_TOKEN set, the token is sent in the X-Admin-Token header
+    if not settings.profiling or settings.admin_token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if admin_token is None or not hmac.compare_digest(admin_token.encode("utf-8"),
+                                                      settings.admin_token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid key")
+    if profiling.profiler.running:
+        raise HTTPException(status_code=409, detail="The profiler is already running")
+    await profiling.profile_to_file(seconds or settings.profile_duration)
+    return Response(profiling.profiler.collapsed(), media_type="text/plain")
+
+
 @app.get("/init")
 async def webhook_init():
     try:
@@ -29,26 +136,119 @@ async def webhook_init():
         return HTTPException(500, f"Error: {e}")
 
 
+@router.default
+async def echo(event: Event) -> None:
+    # Messages no registered route matches are echoed back, unless the app registers a default of its own
+    await event.reply(event.text)
+
+
+async def handle_event(event: Event) -> None:
+    # Platforms retry slow or failed webhooks; a redelivered event is acked without doing any work
+    if await deduplicator.is_duplicate(event):
+        return
+    try:
+        with metrics.stage_seconds.time(event.platform, "handler"):
+            await router.dispatch(event)
+    except Exception:
+        metrics.failures.inc(event.platform, "handler_error")
+        await deduplicator.forget(event)
+        raise
+
+
+async def route_event(event: Event, timeout: float | None = None) -> None:
+    # In cluster mode the node owning the chat handles it, so its state and ordering stay on one node.
+    # If the owner cannot be reached, the event is handled here rather than lost; if it failed to handle
+    # the event, the error is raised as if it failed here
+    if cluster.cluster is not None:
+        node_id, url = cluster.cluster.owner(event.platform, event.chat_id)
+        if node_id != cluster.cluster.node_id and await cluster.cluster.forward(url, event.platform, event.to_raw()):
+            return
+    await run_local(event, timeout)
+
+
+async def run_local(event: Event, timeout: float | None = None) -> None:
+    # With a timeout, an event still waiting behind the backlog of its shard is handled in the background
+    try:
+        await sharding.executor.run(event.platform, event.chat_id, handle_event, event, timeout=timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"{event.platform} chat {event.chat_id} is backlogged, its event is handled after the ack")
+
+
+async def handle_events(events: List[Event], timeout: float | None = None) -> None:
+    # Events of one chat are handled in the order they arrive, events of different chats concurrently,
+    # including those of batched requests (e.g. Facebook)
+    await asyncio.gather(*(route_event(event, timeout) for event in events))
+
+
+async def handle_logged(platform: str, raw: bytes) -> None:
+    # Bodies in the event log were authenticated before they were appended
+    with tracing.trace():
+        events = platforms.get(platform).load().create_all_from_raw(raw)
+        if events is None:
+            logging.warning(f"Error: invalid {platform} body in the event log")
+            return
+        await handle_events(events)
+
+
 @app.post(webhook_path)
 async def webhook_callback(request: Request):
-    event = None
+    metrics.in_flight.inc()
+    try:
+        with tracing.trace():
+            try:
+                if ingest_mode == "log":
+                    messenger, context = await EventFactory.authenticate(request)
+                else:
+                    events = await EventFactory.create_events(request)
+            except ValueError as e:
+                logging.warning(f"Error: {e}")
+                raise HTTPException(status_code=400, detail=str(e))
+            if ingest_mode == "log":
+                await eventlog.log.append(messenger.platform, context.raw)
+            else:
+                # Platforms retry webhooks that are not acked in time, so a backlogged event is acked first
+                await handle_events(events, settings.shard_wait_timeout)
+            return "OK"
+    finally:
+        metrics.in_flight.dec()
+
+
+@app.post(cluster.FORWARD_PATH)
+async def cluster_forward(request: Request, signature: str = Header(None, alias=cluster.SIGNATURE_HEADER),
+                          platform: str = Header(None, alias=cluster.PLATFORM_HEADER)):
+    # Events forwarded by other nodes are handled here without forwarding them again
+    if cluster.cluster is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    body = await request.body()
     try:
-        event = await EventFactory.create_event(request)
+        cluster.cluster.receive(platform, body, signature)
     except ValueError as e:
         logging.warning(f"Error: {e}")
-        return HTTPException(status_code=400, detail=str(e))
-    event.send_message(event.text)
+        raise HTTPException(status_code=403, detail="Invalid key")
+    with tracing.trace():
+        try:
+            events = platforms.get(platform).load().create_all_from_raw(body)
+        except KeyError:
+            events = None
+        if not events:
+            logging.warning(f"Error: invalid forwarded {platform} event")
+            raise HTTPException(status_code=400, detail="Invalid event")
+        # Like webhooks, a backlogged event is acked once queued and handled afterwards, before the sender
+        # times out. The sender does not handle an event it may have delivered, so it is never handled twice
+        for event in events:
+            await run_local(event, settings.shard_wait_timeout)
     return "OK"
 
 
 # Following code must be moved or removed
-facebook_verification_token = environ["FACEBOOK_VERIFICATION_TOKEN"]
+facebook_verification_token = settings.facebook_verification_token
 
 
 @app.get(webhook_path)
 async def facebook_subscribe(mode: str = Query(None, alias="hub.mode"),
                              verify_token: str = Query(None, alias="hub.verify_token"),
                              challenge: int = Query(None, alias="hub.challenge")):
-    if verify_token == facebook_verification_token and mode == "subscribe":
+    if facebook_verification_token is not None and verify_token == facebook_verification_token \
+            and mode == "subscribe":
         return challenge
     raise HTTPException(status_code=403, detail="Invalid key")
@@ -0,0 +1,160 @@
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+# Upper bounds of latency buckets in seconds, from parsing (sub-millisecond) to slow platform API calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric:
+    """
+    A named metric with a fixed set of label names. Every metric registers itself in `Metric.instances`,
+    from which `render` builds the Prometheus text exposition
+    """
+    instances: List["Metric"] = []
+    type_: str
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        Metric.instances.append(self)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError("_samples is a subclass-implemented method")
+
+    def render(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_}",
+            *self._samples(),
+        ])
+
+
+class Counter(Metric):
+    """
+    A value that only grows, e.g. a number of requests
+    """
+    type_ = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+                for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, e.g. a number of requests in flight
+    """
+    type_ = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(Metric):
+    """
+    A distribution of observed values over fixed buckets, e.g. latencies
+    """
+    type_ = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count of every bucket (not cumulative, the last one is +Inf), sum
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def time(self, *labels: str) -> _Timer:
+        """
+        A context manager that observes the time spent inside it
+        :param labels: label values
+        :return: a timer
+        """
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        entry = self.values.get(labels)
+        return sum(entry[0]) if entry is not None else 0
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                samples.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {repr(total[0])}")
+            samples.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return samples
+
+
+def render() -> str:
+    """
+    Renders every metric in the Prometheus text format
+    :return: the exposition
+    """
+    return "\n".join(metric.render() for metric in Metric.instances) + "\n"
+
+
+# Stages: dispatch, authentication, validation, handler, download, send
+stage_seconds = Histogram("unapi_stage_seconds", "Time spent in a stage of webhook processing",
+                          ("platform", "stage"))
+webhooks = Counter("unapi_webhooks_total", "Webhooks resolved to a platform", ("platform",))
+# Causes: unknown_origin, bad_signature, invalid_json, invalid_payload, handler_error, send_error
+failures = Counter("unapi_failures_total", "Failures by platform and cause", ("platform", "cause"))
+in_flight = Gauge("unapi_requests_in_flight", "Webhooks being processed")
+loop_blocks = Histogram("unapi_loop_blocked_seconds", "Blocking of the event loop over LOOP_BLOCK_THRESHOLD")
+outbound_responses = Counter("unapi_outbound_responses_total", "Responses of platform APIs by status",
+                             ("client", "status"))
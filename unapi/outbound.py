@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Set, Tuple, Type
+
+from unapi import metrics
+from unapi import tracing
+from unapi.ratelimit import RateLimiter
+from unapi.settings import settings
+
+
+class OutboundMessage:
+    __slots__ = ("platform", "chat_id", "send", "args", "enqueued_at", "throttled_at", "trace_id")
+
+    def __init__(self, platform: str, chat_id: Hashable, send: Callable[..., Awaitable[Any]], args: tuple) -> None:
+        self.platform = platform
+        self.chat_id = chat_id
+        self.send = send
+        self.args = args
+        self.enqueued_at = time.monotonic()
+        # When the rate limiter first held the message back, None if it did not
+        self.throttled_at: float | None = None
+        # Workers do not run in the context of the request, the trace id is carried over for logs
+        self.trace_id = tracing.trace_id_var.get()
+
+
+def _failed_status(result: Any) -> int | None:
+    # Senders return the (status, body) of the API response; an error status means the message was not sent
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], int) and result[0] >= 400:
+        return result[0]
+    return None
+
+
+class SendQueue:
+    """
+    Background queue of outbound messages drained by a pool of workers.
+    Every platform gets its own RateLimiter built from the limits its Event class declares.
+    Messages are kept in a FIFO per chat, and only chats whose next message may be sent are handed to
+    workers: a chat held back by its rate limit is rescheduled for when it has a token again, so workers
+    never wait on one busy chat, and messages of one chat are sent one at a time in order
+    """
+
+    def __init__(self, workers: int = 16, maxsize: int = 10000) -> None:
+        self.workers = workers
+        self.maxsize = maxsize
+        self.limiters: Dict[str, RateLimiter] = {}
+        # Pending messages by chat; a chat is either ready, deferred by its rate limit or being sent
+        self._chats: Dict[Tuple[str, Hashable], Deque[OutboundMessage]] = {}
+        self._ready: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._idle: asyncio.Event | None = None
+        self._timers: Set[asyncio.TimerHandle] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.depth = 0
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def limiter(self, messenger: Type["Event"]) -> RateLimiter:
+        """
+        Returns the rate limiter of a platform, creating it from the limits of its event class
+        :param messenger: an event class
+        :return: a rate limiter
+        """
+        limiter = self.limiters.get(messenger.platform)
+        if limiter is None:
+            limiter = self.limiters[messenger.platform] = RateLimiter(messenger.rate_limit,
+                                                                      messenger.chat_rate_limit)
+        return limiter
+
+    def _init(self) -> None:
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.maxsize)
+            self._idle = asyncio.Event()
+            self._idle.set()
+
+    def start(self) -> None:
+        """
+        Starts the workers in the running event loop. Does nothing if they are already running
+        :return: None
+        """
+        if self._tasks:
+            return
+        self._init()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float | None = 10) -> None:
+        """
+        Waits up to `timeout` seconds for queued messages to be sent and stops the workers
+        :param timeout: seconds to wait for the queue to drain, None to wait forever
+        :return: None
+        """
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Outbound queue stopped with {self.depth} unsent messages")
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, messenger: Type["Event"], chat_id: Hashable,
+                      send: Callable[..., Awaitable[Any]], *args: Any) -> None:
+        """
+        Puts a message to the queue, waiting for a free slot if the queue is full
+        :param messenger: event class of the platform the message goes to
+        :param chat_id: id of the chat the message goes to
+        :param send: a coroutine function that sends the message and returns the (status, body) of the response
+        :param args: arguments of `send`
+        :return: None
+        """
+        self.start()
+        self.limiter(messenger)
+        await self._slots.acquire()
+        message = OutboundMessage(messenger.platform, chat_id, send, args)
+        key = (messenger.platform, chat_id)
+        self.depth += 1
+        self.enqueued += 1
+        self._idle.clear()
+        messages = self._chats.get(key)
+        if messages is None:
+            self._chats[key] = deque([message])
+            self._ready.put_nowait(key)
+        else:
+            messages.append(message)
+
+    def _defer(self, key: Tuple[str, Hashable], delay: float) -> None:
+        def ready() -> None:
+            self._timers.discard(timer)
+            self._ready.put_nowait(key)
+
+        timer = asyncio.get_running_loop().call_later(delay, ready)
+        self._timers.add(timer)
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            messages = self._chats[key]
+            message = messages[0]
+            limiter = self.limiters[message.platform]
+            delay = limiter.reserve(message.chat_id)
+            if delay > 0:
+                if message.throttled_at is None:
+                    message.throttled_at = time.monotonic()
+                self._defer(key, delay)
+                continue
+            messages.popleft()
+            token = tracing.trace_id_var.set(message.trace_id)
+            try:
+                now = time.monotonic()
+                if message.throttled_at is not None:
+                    limiter.throttled += 1
+                    limiter.throttled_time += now - message.throttled_at
+                wait_time = now - message.enqueued_at
+                self.wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+                status = _failed_status(await message.send(*message.args))
+                if status is not None:
+                    raise ValueError(f"the API responded with {status}")
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                metrics.failures.inc(message.platform, "send_error")
+                logging.error(f"Error: could not send a message to {message.platform} chat {message.chat_id}:\n{e}")
+            finally:
+                tracing.trace_id_var.reset(token)
+                # The next message of the chat is scheduled only now, so messages of a chat never overlap
+                if messages:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                self.depth -= 1
+                self._slots.release()
+                if not self.depth:
+                    self._idle.set()
+
+    def stats(self) -> dict:
+        """
+        Returns queue depth, wait times and throttling counters
+        :return: dict of stats
+        """
+        done = self.sent + self.failed
+        return {
+            "depth": self.depth,
+            "chats": len(self._chats),
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "avg_wait_time": self.wait_time / done if done else 0.0,
+            "max_wait_time": self.max_wait_time,
+            "throttled": {platform: {"count": limiter.throttled, "time": limiter.throttled_time}
+                          for platform, limiter in self.limiters.items()},
+        }
+
+
+queue = SendQueue(settings.outbound_workers, settings.outbound_queue_size)
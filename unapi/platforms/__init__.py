@@ -1,16 +1,137 @@
-import os
-import glob
 import importlib
+import logging
+import time
+from importlib.metadata import entry_points
+from typing import Dict, List, Tuple, Type
 
-# Get the path to the platforms directory
-platforms_dir = os.path.dirname(__file__)
+from unapi.settings import settings
 
-# Find all platform directories in the platforms directory
-platform_dirs = glob.glob(os.path.join(platforms_dir, "*"))
 
-# Import all platform packages
-for platform_dir in platform_dirs:
-    platform_name = os.path.basename(platform_dir)
-    if os.path.exists(os.path.join(platform_dir, "__init__.py")):
-        package_name = f"{__package__}.{platform_name}"
-        importlib.import_module(package_name)
+class PlatformSpec:
+    """
+    A platform as it is known before it is imported: its name, the header that identifies its webhooks
+    and the settings it requires. The module with its event class is imported on first use
+    """
+
+    def __init__(self, name: str, event_class: str, header: str, required_settings: Tuple[str, ...] = ()) -> None:
+        """
+        :param name: platform name, as listed in PLATFORMS
+        :param event_class: import path of the event class in `module:Class` form
+        :param header: name of a header only webhooks of this platform carry
+        :param required_settings: names of settings without which the platform is disabled
+        """
+        self.name = name
+        self.event_class = event_class
+        self.header = header
+        self.required_settings = required_settings
+        self.import_time: float | None = None
+        self._loaded: Type["Event"] | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded is not None
+
+    @property
+    def missing_settings(self) -> List[str]:
+        return [name for name in self.required_settings if getattr(settings, name) is None]
+
+    def load(self) -> Type["Event"]:
+        """
+        Imports the event class on first call and returns it. Import time is recorded in `import_time`
+        :return: the event class
+        """
+        if self._loaded is None:
+            start = time.perf_counter()
+            module_name, class_name = self.event_class.split(":")
+            self._loaded = getattr(importlib.import_module(module_name), class_name)
+            self.import_time = time.perf_counter() - start
+            logging.info(f"Loaded platform {self.name} in {self.import_time * 1000:.1f} ms")
+        return self._loaded
+
+
+_specs: Dict[str, PlatformSpec] = {}
+# Discriminator headers of enabled platforms, lowercase
+_headers: Dict[str, PlatformSpec] = {}
+
+
+def register(spec: PlatformSpec, enable: bool | None = None) -> PlatformSpec:
+    """
+    Registers a platform
+    :param spec: the platform
+    :param enable: whether webhooks of the platform are accepted. By default, a platform is enabled
+    if it is listed in PLATFORMS and all its required settings are set
+    :return: the platform
+    """
+    header_name = spec.header.lower()
+    for other in _specs.values():
+        if other.header.lower() == header_name and other.name != spec.name:
+            raise ValueError(f"Header {spec.header} is already registered by {other.name}")
+
+    if enable is None:
+        enable = spec.name in settings.platforms
+        if enable and spec.missing_settings:
+            logging.warning(f"Platform {spec.name} is disabled, missing settings: "
+                            f"{', '.join(name.upper() for name in spec.missing_settings)}")
+            enable = False
+
+    _specs[spec.name] = spec
+    if enable:
+        _headers[header_name] = spec
+    return spec
+
+
+def get(name: str) -> PlatformSpec:
+    return _specs[name]
+
+
+def by_header(header_name: str) -> PlatformSpec | None:
+    """
+    Returns the enabled platform identified by a header
+    :param header_name: lowercase header name
+    :return: the platform or None
+    """
+    return _headers.get(header_name)
+
+
+def enabled() -> List[PlatformSpec]:
+    return list(_headers.values())
+
+
+def load_enabled() -> None:
+    """
+    Imports all enabled platforms at once, e.g. on startup of a long-running server
+    :return: None
+    """
+    for spec in enabled():
+        spec.load()
+
+
+def stats() -> dict:
+    return {
+        spec.name: {
+            "enabled": spec in _headers.values(),
+            "loaded": spec.loaded,
+            "import_time": spec.import_time,
+        }
+        for spec in _specs.values()
+    }
+
+
+register(PlatformSpec(
+    "telegram", "unapi.platforms.telegram.event:TelegramEvent", "X-Telegram-Bot-Api-Secret-Token",
+    ("telegram_token", "telegram_verification_token"),
+))
+register(PlatformSpec(
+    "viber", "unapi.platforms.viber.event:ViberEvent", "X-Viber-Content-Signature",
+    ("viber_token",),
+))
+register(PlatformSpec(
+    "facebook", "unapi.platforms.facebook.event:FacebookEvent", "X-Hub-Signature-256",
+    ("facebook_api_version", "facebook_page_id", "facebook_page_token", "facebook_app_secret"),
+))
+
+# Third-party platforms are registered through entry points of the unapi.platforms group that point to a
+# PlatformSpec. Scanning installed packages is slow, so it is only done when a platform is not built in
+if any(name not in _specs for name in settings.platforms):
+    for entry_point in entry_points(group="unapi.platforms"):
+        register(entry_point.load())
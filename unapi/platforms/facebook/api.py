@@ -1,21 +1,57 @@
-import requests
-from os import environ
+from urllib.parse import urlencode
+
+from unapi import jsonlib
+from unapi.client import ApiClient
+from unapi.settings import settings
+
+page_id, page_token, api_version = settings.facebook_page_id, settings.facebook_page_token, \
+    settings.facebook_api_version
+
+client = ApiClient('facebook', f'{settings.facebook_graph_url}/v{api_version}/')
+send_message_url = client.url(f'{page_id}/messages?access_token={page_token}')
+batch_url = client.url(f'?access_token={page_token}')
+# Requests per Graph API batch allowed by Facebook
+batch_size = 50
+
+
+def _message(chat_id, text: str) -> dict:
+    return {
+        "recipient": {
+            "id": chat_id
+        },
+        "messaging_type": "RESPONSE",
+        "message": {
+            "text": text
+        }
+    }
 
 
 def send_message(chat_id, text: str):
-    page_id, page_token, api_version = environ['FACEBOOK_PAGE_ID'], environ['FACEBOOK_PAGE_TOKEN'], \
-        environ['FACEBOOK_API_VERSION']
-    send_message_url = f'https://graph.facebook.com/v{api_version}/{page_id}/messages?access_token={page_token}'
-    resp = requests.post(send_message_url,
-                         json={
-                             "recipient": {
-                                 "id": chat_id
-                             },
-                             "messaging_type": "RESPONSE",
-                             "message": {
-                                 "text": text
-                             }
-                         },
-                         headers={
-                             'Content-Type': 'application/json',
-                         })
+    return client.post_sync(send_message_url, _message(chat_id, text))
+
+
+async def send_message_async(chat_id, text: str):
+    return await client.post(send_message_url, _message(chat_id, text))
+
+
+def _batch_item(chat_id, text: str) -> dict:
+    # Bodies of batched requests are form-encoded, with JSON in object parameters
+    return {
+        "method": "POST",
+        "relative_url": f"{page_id}/messages",
+        "body": urlencode({
+            "recipient": jsonlib.dumps({"id": chat_id}).decode("utf-8"),
+            "messaging_type": "UPDATE",
+            "message": jsonlib.dumps({"text": text}).decode("utf-8"),
+        }),
+    }
+
+
+async def send_batch_async(chat_ids: list, text: str):
+    """
+    Sends one message to up to `batch_size` users in a single Graph API batch request
+    :param chat_ids: ids of users
+    :param text: a message to send
+    :return: int - response status, Any - response body, a list with a response or None per user
+    """
+    return await client.post(batch_url, {"batch": [_batch_item(chat_id, text) for chat_id in chat_ids]})
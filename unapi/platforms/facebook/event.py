@@ -1,34 +1,66 @@
 import hashlib
 import hmac
-import json
 from typing import List
 
-from starlette.requests import Request
+from pydantic import ValidationError
 
+from unapi.context import RequestContext
 from unapi.event import Event
 from unapi.attachment import Attachment, AttachmentType
 from unapi.platforms.facebook import api
-from unapi.platforms.facebook.model import Model
+from unapi.platforms.facebook.model import Model, EntryItem, MessagingItem, Message, Sender
+from unapi.record import EventRecord
+from unapi.settings import settings
 
-from os import environ, path
-from dotenv import load_dotenv
+from os import path
 
-load_dotenv()
-facebook_verification_token = environ["FACEBOOK_VERIFICATION_TOKEN"]
-facebook_app_secret = environ["FACEBOOK_APP_SECRET"]
+facebook_app_secret = settings.facebook_app_secret
 
 
 class FacebookEvent(Event):
+    platform = 'facebook'
+    rate_limit = 250
+    chat_rate_limit = None
+    broadcast_batch_size = api.batch_size
+    json_marker = b'"entry"'
     original: Model  # this is needed to tell pydantic that original is a Model
 
+    @classmethod
+    def split(cls, data: Model) -> List[Model]:
+        # Facebook batches many entries and messaging items into one request under load.
+        # Every message becomes its own single-item body; delivery and read receipts are skipped
+        return [
+            Model.model_construct(object=data.object,
+                                  entry=[EntryItem.model_construct(id=entry.id, time=entry.time, messaging=[item])])
+            for entry in data.entry
+            for item in entry.messaging
+            if item.message is not None
+        ]
+
     @property
     def chat_id(self) -> int | str:
         return self.original.entry[0].messaging[0].sender.id
 
+    @property
+    def delivery_id(self) -> int | str:
+        return self.original.entry[0].messaging[0].message.mid
+
+    @property
+    def timestamp(self) -> float:
+        return self.original.entry[0].messaging[0].timestamp / 1000
+
     @property
     def text(self) -> str:
         return self.original.entry[0].messaging[0].message.text
 
+    @classmethod
+    def _original_from_record(cls, record: EventRecord) -> Model:
+        timestamp = round(record.timestamp * 1000)
+        item = MessagingItem.model_construct(
+            sender=Sender.model_construct(id=record.chat_id), timestamp=timestamp,
+            message=Message.model_construct(mid=record.message_id, text=record.text, attachments=None))
+        return Model.model_construct(object='page', entry=[EntryItem.model_construct(time=timestamp, messaging=[item])])
+
     def _get_attachments(self) -> List[Attachment]:
         attachments = []
         original_attachments = self.original.entry[0].messaging[0].message.attachments
@@ -54,24 +86,40 @@ class FacebookEvent(Event):
         return attachments
 
     @staticmethod
-    async def is_request_authentic(request: Request) -> bool:
+    async def is_request_authentic(context: RequestContext) -> bool:
         try:
-            raw_body = await request.body()
-            body = json.loads(raw_body.decode("utf-8"))
-            signature_hash = request.headers.get("X-Hub-Signature-256").split("=")[1]
-            h = hmac.new(facebook_app_secret.encode("utf-8"), raw_body, hashlib.sha256).hexdigest()
-            if signature_hash == h and body["object"] == "page":
-                return True
-        except:
+            signature_hash = context.headers["X-Hub-Signature-256"].split("=", 1)[1].encode("utf-8")
+            key = facebook_app_secret.encode("utf-8")
+        except (KeyError, IndexError, AttributeError):
             return False
-        return False
+        h = hmac.new(key, context.raw, hashlib.sha256).hexdigest().encode("utf-8")
+        return hmac.compare_digest(signature_hash, h)
 
     @staticmethod
-    def is_json_valid(json_data: dict) -> Model | None:
+    def is_json_valid(raw: bytes) -> Model | None:
         try:
-            return Model(**json_data)
-        except:
+            return Model.model_validate_json(raw)
+        except ValidationError:
             return None
 
+    @classmethod
+    async def send_batch_async(cls, chat_ids: list, text: str) -> list:
+        status, body = await api.send_batch_async(chat_ids, text)
+        if status != 200 or not isinstance(body, list):
+            return [f'{status}: {body}'] * len(chat_ids)
+        results = []
+        for item in body:
+            if item is None:
+                # A batched request that timed out has no response
+                results.append('timeout')
+            elif item.get('code') == 200:
+                results.append(None)
+            else:
+                results.append(f"{item.get('code')}: {item.get('body')}")
+        return results
+
     def send_message(self, text) -> None:
         api.send_message(self.chat_id, text)
+
+    async def send_message_async(self, text) -> tuple:
+        return await api.send_message_async(self.chat_id, text)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Literal
 from pydantic import BaseModel
 
 
@@ -22,14 +22,14 @@ class AttachmentItem(BaseModel):
 class Message(BaseModel):
     mid: str
     text: str = ''
-    attachments: List[AttachmentItem] | None
+    attachments: List[AttachmentItem] | None = None
 
 
 class MessagingItem(BaseModel):
     sender: Sender
     recipient: Recipient
     timestamp: int
-    message: Message
+    message: Message | None = None  # absent in delivery and read receipts
 
 
 class EntryItem(BaseModel):
@@ -39,5 +39,5 @@ class EntryItem(BaseModel):
 
 
 class Model(BaseModel):
-    object: str
+    object: Literal['page']
     entry: List[EntryItem]
@@ -1,15 +1,87 @@
-import requests
-from os import environ
+from unapi.cache import TTLCache
+from unapi.client import ApiClient
+from unapi.settings import settings
+
+token = settings.telegram_token
+
+client = ApiClient('telegram', f'{settings.telegram_api_url}/bot{token}/')
+send_message_url = client.url('sendMessage')
+get_file_url = client.url('getFile')
+get_updates_url = client.url('getUpdates')
+delete_webhook_url = client.url('deleteWebhook')
+file_base_url = f'{settings.telegram_api_url}/file/bot{token}/'
+
+# Long polling holds a request for up to TELEGRAM_POLL_TIMEOUT seconds, so it has a client with a longer timeout
+polling_client = ApiClient('telegram_polling', client.base_url, timeout=settings.telegram_poll_timeout + 10,
+                           pool_size=1, max_retries=0, stage='poll')
+
+# Telegram guarantees a file link to be valid for at least an hour
+file_path_cache = TTLCache('telegram_file_path', settings.telegram_file_cache_size, ttl=3600)
+
+
+def _message(chat_id, text: str) -> dict:
+    return {
+        'chat_id': chat_id,
+        'text': text,
+    }
 
 
 def send_message(chat_id, text: str):
-    token = environ['TELEGRAM_TOKEN']
-    send_message_url = f'https://api.telegram.org/bot{token}/sendMessage'
-    resp = requests.post(send_message_url,
-                         json={
-                             'chat_id': chat_id,
-                             'text': text,
-                         },
-                         headers={
-                             'Content-Type': 'application/json',
-                         })
+    return client.post_sync(send_message_url, _message(chat_id, text))
+
+
+async def send_message_async(chat_id, text: str):
+    return await client.post(send_message_url, _message(chat_id, text))
+
+
+def _file_path(status: int, body) -> str:
+    if not body or not body.get('ok'):
+        raise ValueError('Error getting file path')
+    return body['result']['file_path']
+
+
+def get_file(file_id: str, file_unique_id: str | None = None) -> str:
+    """
+    Resolves a file id to a path on Telegram servers. Results are cached by `file_unique_id`,
+    which, unlike `file_id`, is the same for every copy of a forwarded file
+    :param file_id: id of the file
+    :param file_unique_id: unique id of the file, used as the cache key if given
+    :return: file path, relative to `file_base_url`
+    """
+    return file_path_cache.get_or_load(
+        file_unique_id or file_id,
+        lambda: _file_path(*client.get_sync(get_file_url, {'file_id': file_id}))
+    )
+
+
+async def get_file_async(file_id: str, file_unique_id: str | None = None) -> str:
+    async def load() -> str:
+        return _file_path(*await client.get(get_file_url, {'file_id': file_id}))
+
+    return await file_path_cache.get_or_load_async(file_unique_id or file_id, load)
+
+
+def file_url(file_path: str) -> str:
+    return file_base_url + file_path
+
+
+async def get_updates_async(offset: int | None, limit: int, timeout: int):
+    """
+    Long-polls updates. Calling it with `offset` confirms every update before it,
+    so Telegram never returns them again
+    :param offset: id of the first update to return, None for the oldest unconfirmed one
+    :param limit: updates to return at most, up to 100
+    :param timeout: seconds to wait for an update
+    :return: int - response status, Any - response body with the list of updates in `result`
+    """
+    return await polling_client.post(get_updates_url, {
+        'offset': offset,
+        'limit': limit,
+        'timeout': timeout,
+        'allowed_updates': ['message'],
+    })
+
+
+async def delete_webhook_async():
+    # getUpdates is refused while a webhook is set; pending updates are kept
+    return await client.post(delete_webhook_url, {'drop_pending_updates': False})
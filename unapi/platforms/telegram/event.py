@@ -1,56 +1,77 @@
-import requests
-from pydantic import BaseModel
-from starlette.requests import Request
+from pydantic import BaseModel, ValidationError
+from unapi.context import RequestContext
 
 from unapi.attachment import Attachment, AttachmentType
 from unapi.platforms.telegram import api
-from unapi.platforms.telegram.model import Model
+from unapi.platforms.telegram.model import Model, Message, Chat
+from unapi.record import EventRecord
 from unapi.event import Event
+from unapi.settings import settings
 
-from os import environ, path
+from os import path
 
-telegram_verification_token = environ["TELEGRAM_VERIFICATION_TOKEN"]
-telegram_token = environ["TELEGRAM_TOKEN"]
+telegram_verification_token = settings.telegram_verification_token
 
 
 class TelegramEvent(Event):
+    platform = 'telegram'
+    rate_limit = 30
+    chat_rate_limit = 1
+    json_marker = b'"update_id"'
     original: Model  # this is needed to tell pydantic that original is a Model
 
     @property
     def chat_id(self) -> int | str:
         return self.original.message.chat.id
 
+    @property
+    def delivery_id(self) -> int | str:
+        return self.original.update_id
+
+    @property
+    def timestamp(self) -> float:
+        return self.original.message.date
+
     @property
     def text(self) -> str:
         return self.original.message.text
 
+    @classmethod
+    def _original_from_record(cls, record: EventRecord) -> Model:
+        return Model.model_construct(update_id=record.message_id, message=Message.model_construct(
+            chat=Chat.model_construct(id=record.chat_id), date=int(record.timestamp), text=record.text, photo=None))
+
     def _get_attachments(self) -> list:
-        attachments = []
+        if self.original.message.photo is None:
+            return []
+
+        photo = self.original.message.photo[-1]
+        file_path = api.get_file(photo.file_id, photo.file_unique_id)
+        return [self._photo_attachment(file_path, photo.file_unique_id)]
 
+    async def _get_attachments_async(self) -> list:
         if self.original.message.photo is None:
-            return attachments
-
-        file_id = self.original.message.photo[-1].file_id
-        file_url = f"https://api.telegram.org/bot{telegram_token}/getFile?file_id={file_id}"
-        response_json = requests.get(file_url).json()
-        if not response_json["ok"]:
-            raise ValueError('Error getting file path')
-        file_path = response_json["result"]["file_path"]
+            return []
+
+        photo = self.original.message.photo[-1]
+        file_path = await api.get_file_async(photo.file_id, photo.file_unique_id)
+        return [self._photo_attachment(file_path, photo.file_unique_id)]
+
+    @staticmethod
+    def _photo_attachment(file_path: str, file_unique_id: str) -> Attachment:
         file_name = path.splitext(file_path.split('/')[-1])
-        attachments.append(
-            Attachment(
-                name=file_name[0],
-                extension=file_name[-1],
-                type_=AttachmentType.Image,
-                url=f"https://api.telegram.org/file/bot{telegram_token}/{file_path}"
-            )
+        return Attachment(
+            name=file_name[0],
+            extension=file_name[-1],
+            type_=AttachmentType.Image,
+            url=api.file_url(file_path),
+            source_id=f'telegram:{file_unique_id}'
         )
-        return attachments
 
     @staticmethod
-    async def is_request_authentic(request: Request) -> bool:
+    async def is_request_authentic(context: RequestContext) -> bool:
         try:
-            verification_token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+            verification_token = context.headers.get("X-Telegram-Bot-Api-Secret-Token")
             if telegram_verification_token == verification_token:
                 return True
         except:
@@ -58,11 +79,23 @@ class TelegramEvent(Event):
         return False
 
     @staticmethod
-    def is_json_valid(json_data: dict) -> BaseModel | None:
+    def is_json_valid(raw: bytes) -> BaseModel | None:
         try:
-            return Model(**json_data)
-        except:
+            return Model.model_validate_json(raw)
+        except ValidationError:
             return None
 
+    @classmethod
+    async def send_batch_async(cls, chat_ids: list, text: str) -> list:
+        # Telegram has no batch method, every chat is a call of its own
+        results = []
+        for chat_id in chat_ids:
+            status, body = await api.send_message_async(chat_id, text)
+            results.append(None if status == 200 and body and body.get('ok') else f'{status}: {body}')
+        return results
+
     def send_message(self, text) -> None:
         api.send_message(self.chat_id, text)
+
+    async def send_message_async(self, text) -> tuple:
+        return await api.send_message_async(self.chat_id, text)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List
 
 
@@ -31,10 +31,9 @@ class Message(BaseModel):
     chat: Chat
     date: int
     text: str = Field(default='', alias='caption')  # caption is used for photos
-    photo: List[PhotoSize] | None
+    photo: List[PhotoSize] | None = None
 
-    class Config:
-        allow_population_by_field_name = True
+    model_config = ConfigDict(populate_by_name=True)
 
 
 class Model(BaseModel):
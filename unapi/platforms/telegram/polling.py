@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List
+
+from pydantic import ValidationError
+
+from unapi import metrics
+from unapi import tracing
+from unapi.platforms.telegram import api
+from unapi.platforms.telegram.event import TelegramEvent
+from unapi.platforms.telegram.model import Model
+from unapi.settings import settings
+
+
+class TelegramPoller:
+    """
+    Receives Telegram updates by long polling getUpdates instead of webhooks, which needs no public
+    HTTPS endpoint and fetches up to `limit` updates per request. Every batch is handled concurrently,
+    and its updates are confirmed by the next getUpdates call once the whole batch is done
+    """
+
+    def __init__(self, handler: Callable[[TelegramEvent], Awaitable[Any]], limit: int = 100,
+                 timeout: int = 30, max_backoff: float = 30) -> None:
+        """
+        :param handler: a coroutine function called with every event, e.g. the one webhooks use
+        :param limit: updates per getUpdates call, up to 100
+        :param timeout: seconds a getUpdates call waits for an update
+        :param max_backoff: seconds to wait at most before retrying after an error
+        """
+        self.handler = handler
+        self.limit = limit
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        # Id of the next update to fetch; updates before it are confirmed by the next call
+        self.offset: int | None = None
+        self.polls = 0
+        self.updates = 0
+        self.invalid = 0
+        self.failed = 0
+        self.errors = 0
+        self._task: asyncio.Task | None = None
+        self._batch: asyncio.Future | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops polling. Updates of a batch in progress are handled before it stops, and confirmed
+        :return: None
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._batch is not None:
+            await asyncio.gather(self._batch, return_exceptions=True)
+            self._batch = None
+        if self.offset is not None:
+            try:
+                await api.get_updates_async(self.offset, 1, 0)
+            except Exception as e:
+                logging.warning(f"Error: could not confirm Telegram updates:\n{e}")
+
+    async def _run(self) -> None:
+        try:
+            status, body = await api.delete_webhook_async()
+            if status != 200:
+                logging.warning(f"Error: could not delete the Telegram webhook: {status} {body}")
+        except Exception as e:
+            logging.warning(f"Error: could not delete the Telegram webhook:\n{e}")
+        backoff = 1.0
+        while True:
+            try:
+                updates = await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Error: Telegram getUpdates failed, retrying in {backoff:.0f} s:\n{e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = 1.0
+            if updates:
+                # Shielded, so stopping waits for the batch instead of dropping it half-handled
+                self._batch = asyncio.ensure_future(self.handle(updates))
+                await asyncio.shield(self._batch)
+                self._batch = None
+
+    async def poll(self) -> List[dict]:
+        """
+        Fetches the next batch of updates, confirming the previous one
+        :return: updates as decoded JSON
+        :raises ValueError: if Telegram refused the call
+        """
+        status, body = await api.get_updates_async(self.offset, self.limit, self.timeout)
+        if status != 200 or not body or not body.get('ok'):
+            raise ValueError(f"{status}: {body}")
+        self.polls += 1
+        return body['result']
+
+    async def handle(self, updates: List[dict]) -> None:
+        """
+        Handles a batch of updates concurrently and moves the offset past it
+        :param updates: updates as decoded JSON
+        :return: None
+        """
+        events = []
+        for update in updates:
+            try:
+                events.append(TelegramEvent.create(Model.model_validate(update)))
+            except ValidationError:
+                # Updates of other kinds than messages are skipped
+                self.invalid += 1
+                metrics.failures.inc(TelegramEvent.platform, "invalid_payload")
+        metrics.webhooks.inc(TelegramEvent.platform, amount=len(updates))
+
+        async def handle_event(event: TelegramEvent) -> None:
+            with tracing.trace():
+                await self.handler(event)
+
+        results = await asyncio.gather(*(handle_event(event) for event in events), return_exceptions=True)
+        for event, result in zip(events, results):
+            if isinstance(result, Exception):
+                # A failing update is not fetched again, so it cannot stop polling
+                self.failed += 1
+                logging.error(f"Error: could not handle Telegram update {event.delivery_id}:\n{result}")
+        self.updates += len(updates)
+        self.offset = updates[-1]['update_id'] + 1
+
+    def stats(self) -> dict:
+        return {
+            "offset": self.offset,
+            "polls": self.polls,
+            "updates": self.updates,
+            "updates_per_poll": self.updates / self.polls if self.polls else 0.0,
+            "invalid": self.invalid,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def create_poller(handler: Callable[[TelegramEvent], Awaitable[Any]]) -> TelegramPoller:
+    return TelegramPoller(handler, settings.telegram_poll_limit, settings.telegram_poll_timeout)
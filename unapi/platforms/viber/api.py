@@ -1,24 +1,54 @@
-import os
+from unapi.client import ApiClient
+from unapi.settings import settings
 
-import requests
-from os import environ
+viber_token, min_api_version = settings.viber_token, settings.viber_min_api_version
+
+client = ApiClient('viber', settings.viber_api_url, headers={
+    'X-Viber-Auth-Token': viber_token,
+})
+send_message_url = client.url('send_message')
+broadcast_message_url = client.url('broadcast_message')
+# Receivers per broadcast_message call allowed by Viber
+broadcast_size = 300
+
+
+def _message(chat_id, text: str) -> dict:
+    return {
+        "receiver": chat_id,
+        "min_api_version": min_api_version,
+        "sender": {
+            "name": "UnAPIBot"
+        },
+        "type": "text",
+        "text": text
+    }
+
+
+def _broadcast(chat_ids: list, text: str) -> dict:
+    return {
+        "broadcast_list": chat_ids,
+        "min_api_version": min_api_version,
+        "sender": {
+            "name": "UnAPIBot"
+        },
+        "type": "text",
+        "text": text
+    }
 
 
 def send_message(chat_id, text: str):
-    viber_token, min_api_version = environ['VIBER_TOKEN'], environ['VIBER_MIN_API_VERSION']
-
-    send_message_url = 'https://chatapi.viber.com/pa/send_message'
-    resp = requests.post(send_message_url,
-                         json={
-                             "receiver": chat_id,
-                             "min_api_version": min_api_version,
-                             "sender": {
-                                 "name": "UnAPIBot"
-                             },
-                             "type": "text",
-                             "text": text
-                         },
-                         headers={
-                             'Content-Type': 'application/json',
-                             'X-Viber-Auth-Token': viber_token
-                         })
+    return client.post_sync(send_message_url, _message(chat_id, text))
+
+
+async def send_message_async(chat_id, text: str):
+    return await client.post(send_message_url, _message(chat_id, text))
+
+
+async def broadcast_message_async(chat_ids: list, text: str):
+    """
+    Sends one message to up to `broadcast_size` users in a single call
+    :param chat_ids: ids of users
+    :param text: a message to send
+    :return: int - response status, Any - response body with `failed_list` of users the message was not sent to
+    """
+    return await client.post(broadcast_message_url, _broadcast(chat_ids, text))
@@ -1,31 +1,53 @@
 import hashlib
 import hmac
-import json
 from typing import List
 
-from starlette.requests import Request
+from pydantic import ValidationError
 
+from unapi.context import RequestContext
 from unapi.attachment import Attachment, AttachmentType
 from unapi.event import Event
 from unapi.platforms.viber import api
-from unapi.platforms.viber.model import Model
+from unapi.platforms.viber.model import Model, Message, Sender
+from unapi.record import EventRecord
+from unapi.settings import settings
 
-from os import environ, path
+from os import path
 
-viber_token = environ["VIBER_TOKEN"]
+viber_token = settings.viber_token
 
 
 class ViberEvent(Event):
+    platform = 'viber'
+    rate_limit = 100
+    chat_rate_limit = None
+    broadcast_batch_size = api.broadcast_size
+    json_marker = b'"message_token"'
     original: Model  # this is needed to tell pydantic that original is a Model
 
     @property
     def chat_id(self) -> int | str:
         return self.original.sender.id
 
+    @property
+    def delivery_id(self) -> int | str:
+        return self.original.message_token
+
+    @property
+    def timestamp(self) -> float:
+        return self.original.timestamp / 1000
+
     @property
     def text(self) -> str:
         return self.original.message.text
 
+    @classmethod
+    def _original_from_record(cls, record: EventRecord) -> Model:
+        return Model.model_construct(
+            message_token=record.message_id, timestamp=round(record.timestamp * 1000),
+            sender=Sender.model_construct(id=record.chat_id),
+            message=Message.model_construct(type='text', text=record.text, file_name=None))
+
     def _get_attachments(self) -> List[Attachment]:
         attachments = []
         message = self.original.message
@@ -54,30 +76,39 @@ class ViberEvent(Event):
                 name=file_name[0],
                 extension=file_name[-1],
                 type_=attachment_type,
-                url=message.media
+                url=message.media,
+                source_id=f'viber:{message.media}'
             )
         )
         return attachments
 
     @staticmethod
-    async def is_request_authentic(request: Request) -> bool:
+    async def is_request_authentic(context: RequestContext) -> bool:
         try:
-            raw_body = await request.body()
-            body = json.loads(raw_body.decode("utf-8"))
-            signature_hash = request.headers.get("X-Viber-Content-Signature")
-            h = hmac.new(viber_token.encode("utf-8"), raw_body, hashlib.sha256).hexdigest()
-            if signature_hash == h:
-                return True
-        except:
+            signature_hash = context.headers["X-Viber-Content-Signature"].encode("utf-8")
+            key = viber_token.encode("utf-8")
+        except (KeyError, AttributeError):
             return False
-        return False
+        h = hmac.new(key, context.raw, hashlib.sha256).hexdigest().encode("utf-8")
+        return hmac.compare_digest(signature_hash, h)
 
     @staticmethod
-    def is_json_valid(json_data: dict) -> Model | None:
+    def is_json_valid(raw: bytes) -> Model | None:
         try:
-            return Model(**json_data)
-        except:
+            return Model.model_validate_json(raw)
+        except ValidationError:
             return None
 
+    @classmethod
+    async def send_batch_async(cls, chat_ids: list, text: str) -> list:
+        status, body = await api.broadcast_message_async(chat_ids, text)
+        if status != 200 or not body or body.get('status') != 0:
+            return [f'{status}: {body}'] * len(chat_ids)
+        failed = {item.get('receiver'): item.get('status_message', 'failed') for item in body.get('failed_list', [])}
+        return [failed.get(chat_id) for chat_id in chat_ids]
+
     def send_message(self, text) -> None:
         api.send_message(self.chat_id, text)
+
+    async def send_message_async(self, text) -> tuple:
+        return await api.send_message_async(self.chat_id, text)
@@ -12,11 +12,11 @@ class Sender(BaseModel):
 
 class Message(BaseModel):
     type: str
-    text: str | None
-    media: str | None
-    thumbnail: str | None
-    file_name: str | None
-    size: int | None
+    text: str | None = None
+    media: str | None = None
+    thumbnail: str | None = None
+    file_name: str | None = None
+    size: int | None = None
 
 
 class Model(BaseModel):
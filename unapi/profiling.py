@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+from typing import Dict
+
+from unapi import metrics
+from unapi.settings import settings
+
+
+def _collapse(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread, normally the one running the event loop, from a background thread.
+    The result is in the collapsed stack format read by flamegraph.pl, speedscope and similar tools
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        """
+        :param interval: time between samples in seconds
+        """
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int | None = None) -> None:
+        """
+        Starts sampling
+        :param thread_id: id of the thread to sample, the calling thread by default
+        :return: None
+        """
+        if self._thread is not None:
+            raise ValueError("The profiler is already running")
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self.samples = Counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(target,), name="unapi-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self, thread_id: int) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.samples[_collapse(frame)] += 1
+
+    def stop(self) -> Dict[str, int]:
+        """
+        Stops sampling
+        :return: sample counts by collapsed stack
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return dict(self.samples)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def dump(self, directory: str) -> str:
+        """
+        Writes the samples to a new file in the collapsed stack format
+        :param directory: a directory to write to
+        :return: path of the file
+        """
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.collapsed")
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return file_path
+
+    async def profile(self, duration: float) -> str:
+        """
+        Samples the event loop thread for `duration` seconds
+        :param duration: duration in seconds
+        :return: the samples in the collapsed stack format
+        """
+        self.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.stop()
+        return self.collapsed()
+
+
+class LoopWatchdog:
+    """
+    Reports blocking of the event loop: a task updates a heartbeat, and a background thread logs
+    the stack of the loop thread once the heartbeat is older than `threshold`.
+    Blocking calls, e.g. of requests, inside a coroutine show up in these reports
+    """
+
+    def __init__(self, threshold: float) -> None:
+        """
+        :param threshold: blocking time in seconds that is reported
+        """
+        self.threshold = threshold
+        self.interval = threshold / 2
+        self.blocks = 0
+        self.max_block = 0.0
+        self._beat = time.monotonic()
+        self._reported = 0.0
+        self._thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """
+        Starts watching the running event loop
+        :return: None
+        """
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="unapi-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            block = now - self._beat - self.interval
+            if block > self.threshold:
+                self.blocks += 1
+                self.max_block = max(self.max_block, block)
+                metrics.loop_blocks.observe(block)
+                logging.warning(f"Event loop was blocked for {block * 1000:.0f} ms")
+            self._beat = now
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if time.monotonic() - beat > self.interval + self.threshold and self._reported != beat:
+                # Reported once per blocking, while the loop thread is still inside the blocking call
+                self._reported = beat
+                frame = sys._current_frames().get(self._thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+                logging.warning(f"Event loop is blocked for more than {self.threshold * 1000:.0f} ms at:\n{stack}")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "blocks": self.blocks,
+            "max_block": self.max_block,
+        }
+
+
+async def profile_to_file(duration: float) -> str | None:
+    """
+    Samples the event loop with the shared profiler and writes the result to PROFILE_PATH
+    :param duration: duration in seconds
+    :return: path of the profile or None if the profiler is already running
+    """
+    if profiler.running:
+        logging.warning("Error: the profiler is already running")
+        return None
+    await profiler.profile(duration)
+    file_path = profiler.dump(settings.profile_path)
+    logging.info(f"Profile of {duration} s written to {file_path}")
+    return file_path
+
+
+profiler = SamplingProfiler(settings.profile_interval)
+# LOOP_BLOCK_THRESHOLD of 0 disables the watchdog
+watchdog = LoopWatchdog(settings.loop_block_threshold) if settings.loop_block_threshold > 0 else None
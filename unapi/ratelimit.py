@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucket:
+    """
+    Token bucket that refills `rate` tokens per second up to `capacity`
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float, n: int = 1) -> float:
+        """
+        Refills the bucket and tells how long to wait until `n` tokens are available.
+        More tokens than the capacity are allowed once the bucket is full, leaving it in debt,
+        so later calls wait until the debt is paid and the rate holds on average
+        :param now: current monotonic time
+        :param n: tokens to take
+        :return: seconds to wait, 0 if the tokens can be taken right away
+        """
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        needed = min(n, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, n: int = 1) -> None:
+        self.tokens -= n
+
+
+class RateLimiter:
+    """
+    Rate limiter of a single platform with a global and a per-chat token bucket.
+    A limit of None means the respective bucket is not enforced.
+    Per-chat buckets are kept in an LRU of at most `max_chats` entries
+    """
+
+    def __init__(self, rate: float | None, chat_rate: float | None, max_chats: int = 100_000) -> None:
+        self.bucket = TokenBucket(rate) if rate else None
+        self.chat_rate = chat_rate
+        self.max_chats = max_chats
+        self.chat_buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.throttled = 0
+        self.throttled_time = 0.0
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket | None:
+        if not self.chat_rate:
+            return None
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1.0)
+            if len(self.chat_buckets) > self.max_chats:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def reserve(self, chat_id: Hashable, n: int = 1) -> float:
+        """
+        Takes tokens from both the global and the chat bucket if both allow the message, without waiting
+        :param chat_id: id of the chat the message goes to
+        :param n: messages the call sends, e.g. recipients of a broadcast call, each taking a global token.
+        The chat bucket is charged one token
+        :return: 0 if the tokens were taken, otherwise seconds until they are available
+        """
+        now = time.monotonic()
+        chat_bucket = self._chat_bucket(chat_id)
+        delay = max(
+            self.bucket.delay(now, n) if self.bucket else 0.0,
+            chat_bucket.delay(now) if chat_bucket else 0.0,
+        )
+        if delay > 0:
+            return delay
+        if self.bucket:
+            self.bucket.consume(n)
+        if chat_bucket:
+            chat_bucket.consume()
+        return 0.0
+
+    async def acquire(self, chat_id: Hashable, n: int = 1) -> float:
+        """
+        Waits until both the global and the chat bucket allow the message and takes their tokens
+        :param chat_id: id of the chat the message goes to
+        :param n: messages the call sends, see `reserve`
+        :return: seconds spent waiting
+        """
+        start = time.monotonic()
+        delay = self.reserve(chat_id, n)
+        if delay <= 0:
+            return 0.0
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.reserve(chat_id, n)
+        waited = time.monotonic() - start
+        self.throttled += 1
+        self.throttled_time += waited
+        return waited
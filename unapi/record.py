@@ -0,0 +1,93 @@
+from typing import Tuple
+
+from unapi import jsonlib
+from unapi import platforms
+
+try:
+    import msgpack
+except ImportError:  # msgpack is an optional speedup, JSON is used without it
+    msgpack = None
+
+# name, type, extension, url, source_id
+AttachmentDescriptor = Tuple[str, str, str, str, str | None]
+
+_MSGPACK = b"m"
+_JSON = b"j"
+
+
+class EventRecord:
+    """
+    A compact, platform-neutral copy of an event: the fields needed to handle it and reply,
+    without the original request body. Records are cheap to keep in memory and to pass
+    between processes, and are converted back to events with `to_event`
+    """
+    __slots__ = ("platform", "chat_id", "text", "message_id", "timestamp", "attachments")
+
+    def __init__(self, platform: str, chat_id: int | str, text: str | None, message_id: int | str,
+                 timestamp: float, attachments: Tuple[AttachmentDescriptor, ...] = ()) -> None:
+        """
+        :param platform: platform name, as registered in unapi.platforms
+        :param chat_id: a chat id
+        :param text: message text
+        :param message_id: the delivery id of the event
+        :param timestamp: Unix time the message was sent at, in seconds
+        :param attachments: attachment descriptors
+        """
+        self.platform = platform
+        self.chat_id = chat_id
+        self.text = text
+        self.message_id = message_id
+        self.timestamp = timestamp
+        self.attachments = attachments
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, EventRecord):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self) -> str:
+        return f"EventRecord({self.platform!r}, {self.chat_id!r}, message_id={self.message_id!r})"
+
+    def _fields(self) -> tuple:
+        return self.platform, self.chat_id, self.text, self.message_id, self.timestamp, self.attachments
+
+    def dumps(self) -> bytes:
+        """
+        Serializes the record with msgpack if it is installed, with JSON otherwise. Both are stable across
+        Python versions and safe to read from other processes. The first byte tags the format,
+        so `loads` reads records of either
+        :return: serialized record
+        """
+        if msgpack is not None:
+            return _MSGPACK + msgpack.packb(self._fields())
+        return _JSON + jsonlib.dumps(self._fields())
+
+    @classmethod
+    def loads(cls, data: bytes) -> "EventRecord":
+        """
+        A class method that deserializes a record
+        :param data: a record serialized by `dumps`
+        :return: the record
+        :raises ValueError: if data is not a serialized record
+        """
+        tag, body = data[:1], data[1:]
+        if tag == _MSGPACK:
+            if msgpack is None:
+                raise ValueError("The record is serialized with msgpack, which is not installed")
+            fields = msgpack.unpackb(body, use_list=False)
+        elif tag == _JSON:
+            fields = jsonlib.loads(body)
+        else:
+            raise ValueError(f"Unknown record format {tag!r}")
+        platform, chat_id, text, message_id, timestamp, attachments = fields
+        # JSON has no tuples, attachments are read back as lists
+        return cls(platform, chat_id, text, message_id, timestamp, tuple(tuple(a) for a in attachments))
+
+    def to_event(self) -> "Event":
+        """
+        Converts the record back to an event of its platform. The event has no request context,
+        and its original body holds only the fields the record keeps
+        :return: an event
+        """
+        return platforms.get(self.platform).load().from_record(self)
+
@@ -0,0 +1,211 @@
+import asyncio
+import inspect
+import re
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Pattern, Tuple
+
+from unapi.event import Event
+
+Handler = Callable[[Event], Awaitable[Any] | Any]
+
+
+class Route:
+    """
+    A handler with the platforms it applies to
+    """
+    __slots__ = ("handler", "platforms", "is_async")
+
+    def __init__(self, handler: Handler, platforms: Iterable[str] | None = None) -> None:
+        self.handler = handler
+        self.platforms = frozenset(platforms) if platforms is not None else None
+        self.is_async = inspect.iscoroutinefunction(handler)
+
+    def applies_to(self, platform: str) -> bool:
+        return self.platforms is None or platform in self.platforms
+
+
+class _TrieNode:
+    __slots__ = ("children", "routes")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, _TrieNode] = {}
+        self.routes: List[Route] = []
+
+
+def _first(routes: List[Route], platform: str) -> Route | None:
+    for route in routes:
+        if route.applies_to(platform):
+            return route
+    return None
+
+
+class Router:
+    """
+    Picks the handler of an event by its text. Routes are checked in this order:
+    commands (the first word of the text), prefixes (the longest one wins), regular expressions
+    (the earliest match in the text wins, then the first registered) and the default handler.
+    Commands and prefixes are case-insensitive. Commands are looked up in a dict and prefixes in a trie,
+    and all regular expressions are compiled into one alternation, so matching time does not grow with
+    the number of routes. Sync handlers run in a thread pool, so they cannot block the event loop
+    """
+
+    def __init__(self, executor: Executor | None = None) -> None:
+        """
+        :param executor: an executor for sync handlers, the default executor of the loop if None
+        """
+        self.executor = executor
+        self._commands: Dict[str, List[Route]] = {}
+        self._prefixes = _TrieNode()
+        self._patterns: List[Tuple[str, int, Route]] = []
+        # Combined expressions by platform, compiled on first use after a change
+        self._compiled: Dict[str, Tuple[Pattern, List[Route]] | None] = {}
+        self._default: List[Route] = []
+
+    def command(self, *names: str, platforms: Iterable[str] | None = None) -> Callable[[Handler], Handler]:
+        """
+        A decorator that routes messages whose first word is one of `names`, e.g. "/start".
+        Telegram bot mentions, as in "/start@my_bot", are ignored
+        :param names: commands
+        :param platforms: names of platforms the handler applies to, all if None
+        :return: a decorator that returns the handler unchanged
+        """
+        def decorator(handler: Handler) -> Handler:
+            route = Route(handler, platforms)
+            for name in names:
+                self._commands.setdefault(name.casefold(), []).append(route)
+            return handler
+
+        return decorator
+
+    def prefix(self, *prefixes: str, platforms: Iterable[str] | None = None) -> Callable[[Handler], Handler]:
+        """
+        A decorator that routes messages starting with one of `prefixes`, e.g. keyword triggers
+        :param prefixes: text prefixes
+        :param platforms: names of platforms the handler applies to, all if None
+        :return: a decorator that returns the handler unchanged
+        """
+        def decorator(handler: Handler) -> Handler:
+            route = Route(handler, platforms)
+            for text in prefixes:
+                if not text:
+                    raise ValueError("A prefix cannot be empty")
+                node = self._prefixes
+                for char in text.casefold():
+                    node = node.children.setdefault(char, _TrieNode())
+                node.routes.append(route)
+            return handler
+
+        return decorator
+
+    def regex(self, *patterns: str, platforms: Iterable[str] | None = None,
+              flags: int = 0) -> Callable[[Handler], Handler]:
+        """
+        A decorator that routes messages in which one of `patterns` is found.
+        Named groups must be unique across all patterns of the router
+        :param patterns: regular expressions
+        :param platforms: names of platforms the handler applies to, all if None
+        :param flags: flags of the expressions, e.g. re.IGNORECASE
+        :return: a decorator that returns the handler unchanged
+        """
+        def decorator(handler: Handler) -> Handler:
+            route = Route(handler, platforms)
+            for pattern in patterns:
+                re.compile(pattern, flags)
+                self._patterns.append((pattern, flags, route))
+            self._compiled.clear()
+            return handler
+
+        return decorator
+
+    def default(self, handler: Handler | None = None, *, platforms: Iterable[str] | None = None):
+        """
+        A decorator that registers a handler of messages no other route matches. Unlike other routes,
+        a default of some platforms overrides one of all platforms, and a later default overrides an earlier
+        one, so the app can replace a default registered before it, e.g. the built-in echo
+        :param handler: the handler, when used without arguments
+        :param platforms: names of platforms the handler applies to, all if None
+        :return: a decorator or the handler unchanged
+        """
+        def decorator(handler: Handler) -> Handler:
+            route = Route(handler, platforms)
+            # Defaults are kept platform-specific first, the latest of each kind first
+            index = 0 if route.platforms is not None else sum(r.platforms is not None for r in self._default)
+            self._default.insert(index, route)
+            return handler
+
+        return decorator(handler) if handler is not None else decorator
+
+    def _combined(self, platform: str) -> Tuple[Pattern, List[Route]] | None:
+        if platform not in self._compiled:
+            parts, routes = [], []
+            for pattern, flags, route in self._patterns:
+                if route.applies_to(platform):
+                    # Flags are scoped to their own alternative
+                    scoped = f"(?{_inline_flags(flags)}:{pattern})" if flags else pattern
+                    parts.append(f"(?P<_r{len(routes)}>{scoped})")
+                    routes.append(route)
+            try:
+                self._compiled[platform] = (re.compile("|".join(parts)), routes) if parts else None
+            except re.error as e:
+                raise ValueError(f"Patterns of the router cannot be combined: {e}")
+        return self._compiled[platform]
+
+    def match(self, event: Event) -> Route | None:
+        """
+        Picks the route of an event
+        :param event: an incoming event
+        :return: the route or None if none matches
+        """
+        text = event.text or ""
+        platform = event.platform
+
+        words = text.split(None, 1)
+        if words and self._commands:
+            name = words[0].casefold()
+            if name.startswith("/"):
+                name = name.split("@", 1)[0]
+            route = _first(self._commands.get(name, ()), platform)
+            if route is not None:
+                return route
+
+        node, found = self._prefixes, None
+        for char in text.casefold():
+            node = node.children.get(char)
+            if node is None:
+                break
+            found = _first(node.routes, platform) or found
+
+        if found is not None:
+            return found
+
+        combined = self._combined(platform) if self._patterns else None
+        if combined is not None:
+            matched = combined[0].search(text)
+            if matched is not None:
+                return combined[1][int(matched.lastgroup[2:])]
+
+        return _first(self._default, platform)
+
+    async def dispatch(self, event: Event) -> bool:
+        """
+        Calls the handler of an event. Sync handlers are run in the executor
+        :param event: an incoming event
+        :return: True if a handler was called, False if no route matches
+        """
+        route = self.match(event)
+        if route is None:
+            return False
+        if route.is_async:
+            await route.handler(event)
+        else:
+            await asyncio.get_running_loop().run_in_executor(self.executor, route.handler, event)
+        return True
+
+
+def _inline_flags(flags: int) -> str:
+    letters = {re.IGNORECASE: "i", re.MULTILINE: "m", re.DOTALL: "s", re.VERBOSE: "x", re.ASCII: "a"}
+    return "".join(letter for flag, letter in letters.items() if flags & flag)
+
+
+# The router of the app. Handlers are registered on it by decorators before the app starts
+router = Router()
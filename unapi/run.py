@@ -1,20 +1,68 @@
+import importlib.util
 import logging
 import uvicorn
 import ssl
-from dotenv import load_dotenv
-from os import environ
+
+from unapi.settings import settings
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def server_options() -> dict:
+    """
+    Builds uvicorn options for SERVER_MODE. Development mode runs a single process that reloads on changes.
+    Production mode runs on uvloop and httptools if they are installed, and recycles the worker after
+    LIMIT_MAX_REQUESTS requests if it is set. It runs a single worker process: to use more cores,
+    run several nodes in cluster mode.
+    On SIGTERM the server stops accepting connections and waits up to SHUTDOWN_TIMEOUT seconds
+    for requests in flight and queued outbound messages
+    :return: keyword arguments of uvicorn.run
+    """
+    options = {
+        "host": settings.host,
+        "port": settings.port,
+        "ssl_version": ssl.PROTOCOL_TLS,
+        "ssl_keyfile": settings.ssl_keyfile,
+        "ssl_certfile": settings.ssl_certfile,
+        "log_level": "info",
+        "timeout_keep_alive": settings.keep_alive_timeout,
+        "backlog": settings.backlog,
+        "timeout_graceful_shutdown": settings.shutdown_timeout,
+    }
+    if settings.server_mode == "development":
+        return {**options, "reload": True}
+    if settings.server_mode != "production":
+        raise ValueError(f"Unknown SERVER_MODE {settings.server_mode}")
+
+    workers = settings.workers or 1
+    # The event log is a local directory only one process may append to
+    if settings.ingest_mode == "log" and workers > 1:
+        raise ValueError("INGEST_MODE=log needs WORKERS=1")
+    # Telegram answers concurrent getUpdates calls of one bot with a conflict
+    if settings.telegram_ingest == "polling" and workers > 1:
+        raise ValueError("TELEGRAM_INGEST=polling needs WORKERS=1")
+    # Events of one chat are ordered by the shards of one process, and chat states are cached and written
+    # behind in every process: several processes would handle a chat out of order and overwrite its state
+    if workers > 1:
+        raise ValueError("Chat ordering and the chat state store need WORKERS=1, "
+                         "run several nodes in cluster mode to use more cores")
+    return {
+        **options,
+        "workers": workers,
+        "loop": "uvloop" if _installed("uvloop") else "asyncio",
+        "http": "httptools" if _installed("httptools") else "h11",
+        "limit_max_requests": settings.limit_max_requests,
+        # Every webhook is counted in /metrics, a log line per request only costs throughput
+        "access_log": False,
+    }
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
-    load_dotenv()
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=int(environ["PORT"]),
-        ssl_version=ssl.PROTOCOL_TLS,
-        ssl_keyfile=environ["SSL_KEYFILE"],
-        ssl_certfile=environ["SSL_CERTFILE"],
-        log_level="info",
-        reload=True
-    )
+    options = server_options()
+    logging.info(f"Starting in {settings.server_mode} mode with {options.get('workers', 1)} worker(s), "
+                 f"loop {options.get('loop', 'auto')}, http {options.get('http', 'auto')}")
+    uvicorn.run("main:app", **options)
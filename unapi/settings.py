@@ -0,0 +1,131 @@
+from os import environ
+from typing import List
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, field_validator
+
+
+class Settings(BaseModel):
+    """
+    Application settings, loaded once from the environment and .env.
+    Every field is read from the environment variable of the same name in upper case.
+    Platform credentials are optional: a platform whose credentials are missing is disabled, see unapi.platforms
+    """
+    # Platforms
+    platforms: List[str] = ["telegram", "viber", "facebook"]
+    preload_platforms: bool = False
+    telegram_token: str | None = None
+    telegram_verification_token: str | None = None
+    telegram_file_cache_size: int = 10000
+    # "webhook" or "polling", which long-polls getUpdates instead of receiving webhooks
+    telegram_ingest: str = "webhook"
+    telegram_poll_limit: int = 100
+    telegram_poll_timeout: int = 30
+    viber_token: str | None = None
+    viber_min_api_version: int = 1
+    facebook_api_version: str | None = None
+    facebook_verification_token: str | None = None
+    facebook_page_token: str | None = None
+    facebook_page_id: str | None = None
+    facebook_app_secret: str | None = None
+    # Base urls of platform APIs, overridden to point at stand-in servers in load tests
+    telegram_api_url: str = "https://api.telegram.org"
+    viber_api_url: str = "https://chatapi.viber.com/pa/"
+    facebook_graph_url: str = "https://graph.facebook.com"
+
+    # Server
+    api_url: str | None = None
+    webhook_path: str = "/webhook"
+    server_mode: str = "development"
+    host: str = "0.0.0.0"
+    port: int = 8443
+    workers: int = 1
+    keep_alive_timeout: int = 5
+    backlog: int = 2048
+    limit_max_requests: int | None = None
+    shutdown_timeout: float = 30
+    ssl_keyfile: str | None = None
+    ssl_certfile: str | None = None
+    json_backend: str = "orjson"
+
+    # Outbound messages
+    send_mode: str = "queue"
+    outbound_timeout: float = 10
+    outbound_pool_size: int = 100
+    outbound_max_retries: int = 3
+    outbound_workers: int = 16
+    outbound_queue_size: int = 10000
+    broadcast_concurrency: int = 16
+
+    # Event processing, events of one chat are handled in order
+    shards: int = 64
+    shard_queue_size: int = 1000
+    # Seconds a webhook or a forwarded event waits to be handled before it is acked, it is handled afterwards.
+    # Must stay below OUTBOUND_TIMEOUT, so nodes answer forwards before the sender times out
+    shard_wait_timeout: float = 5
+
+    # Ingestion, "direct" handles events before the ack, "log" acks once the body is in the event log
+    ingest_mode: str = "direct"
+    event_log_path: str = "eventlog"
+    event_log_segment_size: int = 64 * 1024 * 1024
+    event_log_commit_delay: float = 0.001
+    event_log_batch: int = 1000
+
+    # Cluster, chats are partitioned across nodes by consistent hashing. CLUSTER_BACKEND is none, memory or file
+    cluster_backend: str = "none"
+    cluster_membership_path: str = "cluster.json"
+    cluster_node_id: str | None = None
+    cluster_node_url: str | None = None
+    cluster_secret: str | None = None
+    cluster_vnodes: int = 128
+    cluster_heartbeat_interval: float = 2.0
+    cluster_node_ttl: float = 10
+
+    # Attachments
+    local_storage_path: str = "storage"
+    storage_mode: str = "unique"
+    download_max_size: int = 100 * 1024 * 1024
+    download_timeout: float = 30
+    max_concurrent_downloads: int = 32
+
+    # Deduplication
+    dedup_backend: str = "memory"
+    dedup_ttl: float = 600
+    dedup_max_size: int = 1000000
+    dedup_redis_url: str | None = None
+
+    # Conversation state
+    state_path: str = "state.sqlite3"
+    state_cache_size: int = 100000
+    state_ttl: float = 3600
+    state_flush_interval: float = 1.0
+    state_flush_batch: int = 1000
+
+    # Profiling and tracing, all off by default
+    admin_token: str | None = None
+    profiling: bool = False
+    profile_path: str = "profiles"
+    profile_interval: float = 0.005
+    profile_duration: float = 30
+    tracing: bool = False
+    trace_slow_threshold: float = 1.0
+    loop_block_threshold: float = 0
+
+    @field_validator("platforms", mode="before")
+    @classmethod
+    def split_platforms(cls, value):
+        if isinstance(value, str):
+            return [name.strip() for name in value.split(",") if name.strip()]
+        return value
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """
+        A class method that loads .env into the environment and builds settings from it
+        :return: settings
+        """
+        load_dotenv()
+        return cls(**{name: environ[name.upper()] for name in cls.model_fields if name.upper() in environ})
+
+
+settings = Settings.from_env()
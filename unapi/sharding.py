@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import logging
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Hashable, List, Set
+
+from unapi.settings import settings
+
+
+class _Job:
+    __slots__ = ("function", "args", "future", "context", "enqueued_at")
+
+    def __init__(self, function: Callable[..., Awaitable[Any]], args: tuple, future: asyncio.Future) -> None:
+        self.function = function
+        self.args = args
+        self.future = future
+        # The job runs in the context of the caller, so its trace id and spans are kept
+        self.context = contextvars.copy_context()
+        self.enqueued_at = time.monotonic()
+
+
+class Shard:
+    """
+    A bounded queue of jobs drained by a single worker, so its jobs run one at a time in order
+    """
+
+    def __init__(self, index: int, maxsize: int) -> None:
+        self.index = index
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.task: asyncio.Task | None = None
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+
+    async def run(self) -> None:
+        while True:
+            job = await self.queue.get()
+            start = time.monotonic()
+            self.wait_time += start - job.enqueued_at
+            task = asyncio.create_task(job.function(*job.args), context=job.context)
+            try:
+                # Waiting instead of awaiting the task tells the cancellation of the worker, which stops it,
+                # from a job that was cancelled or raised CancelledError, which is only a failed job
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                job.future.cancel()
+                raise
+            finally:
+                self.processed += 1
+                self.busy_time += time.monotonic() - start
+                self.queue.task_done()
+            if job.future.done():
+                continue
+            if task.cancelled():
+                self.failed += 1
+                job.future.set_exception(ValueError("The job was cancelled"))
+            elif task.exception() is not None:
+                self.failed += 1
+                job.future.set_exception(task.exception())
+            else:
+                job.future.set_result(task.result())
+
+    def stats(self) -> dict:
+        return {
+            "shard": self.index,
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "failed": self.failed,
+            "busy_time": self.busy_time,
+            "avg_wait_time": self.wait_time / self.processed if self.processed else 0.0,
+        }
+
+
+class ShardedExecutor:
+    """
+    Runs jobs keyed by chat: jobs of one key run strictly in the order they were submitted, while
+    jobs of different keys run in parallel. Keys are hashed onto a fixed number of shards, each with
+    a bounded queue and one worker, so a slow chat delays only the chats that share its shard.
+    The order holds within one process only, which is why the server runs a single worker per node
+    and cluster mode hands every chat to one node
+    """
+
+    def __init__(self, shards: int = 64, maxsize: int = 1000) -> None:
+        """
+        :param shards: number of shards, i.e. jobs running at once
+        :param maxsize: jobs waiting in the queue of a shard before submitting to it waits
+        """
+        if shards < 1:
+            raise ValueError("There must be at least one shard")
+        self.shard_count = shards
+        self.maxsize = maxsize
+        self.shards: List[Shard] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # Jobs whose callers stopped waiting for them
+        self._background: Set[asyncio.Task] = set()
+        self.timeouts = 0
+
+    def start(self) -> None:
+        """
+        Starts the workers in the running event loop. Does nothing if they are already running in it
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        if self.shards and self._loop is loop:
+            return
+        self._loop = loop
+        self.shards = [Shard(index, self.maxsize) for index in range(self.shard_count)]
+        for shard in self.shards:
+            shard.task = asyncio.create_task(shard.run())
+
+    async def stop(self, timeout: float | None = 10) -> None:
+        """
+        Waits up to `timeout` seconds for queued jobs to complete and stops the workers
+        :param timeout: seconds to wait, None to wait forever
+        :return: None
+        """
+        if not self.shards:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(shard.queue.join() for shard in self.shards)), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Shards stopped with {sum(shard.queue.qsize() for shard in self.shards)} jobs left")
+        for shard in self.shards:
+            shard.task.cancel()
+        await asyncio.gather(*(shard.task for shard in self.shards), return_exceptions=True)
+        for shard in self.shards:
+            # Callers of jobs that never ran are not left waiting
+            while not shard.queue.empty():
+                shard.queue.get_nowait().future.cancel()
+        self.shards = []
+        self._loop = None
+
+    def shard_of(self, platform: str, chat_id: Hashable) -> int:
+        """
+        Returns the shard of a chat. crc32 is used instead of hash(), so the mapping is the same
+        in every process
+        :param platform: platform name
+        :param chat_id: a chat id
+        :return: index of the shard
+        """
+        return zlib.crc32(f"{platform}:{chat_id}".encode("utf-8")) % self.shard_count
+
+    async def submit(self, platform: str, chat_id: Hashable, function: Callable[..., Awaitable[Any]],
+                     *args: Any) -> asyncio.Future:
+        """
+        Puts a job to the queue of its shard, waiting for a free slot if the queue is full
+        :param platform: platform name
+        :param chat_id: a chat id, jobs of one chat run in order
+        :param function: a coroutine function
+        :param args: arguments of `function`
+        :return: a future of the result of the job
+        """
+        self.start()
+        shard = self.shards[self.shard_of(platform, chat_id)]
+        future = asyncio.get_running_loop().create_future()
+        await shard.queue.put(_Job(function, args, future))
+        shard.max_depth = max(shard.max_depth, shard.queue.qsize())
+        return future
+
+    async def _run(self, platform: str, chat_id: Hashable, function: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        return await (await self.submit(platform, chat_id, function, *args))
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Error: a job failed after its caller stopped waiting:\n{task.exception()}")
+
+    async def run(self, platform: str, chat_id: Hashable, function: Callable[..., Awaitable[Any]], *args: Any,
+                  timeout: float | None = None) -> Any:
+        """
+        Submits a job and waits for its result
+        :param platform: platform name
+        :param chat_id: a chat id, jobs of one chat run in order
+        :param function: a coroutine function
+        :param args: arguments of `function`
+        :param timeout: seconds to wait for the job, including for a slot in its queue, None to wait forever.
+        A job still waiting or running when it runs out is not cancelled, it is completed in the background
+        :return: the result of the job, its exception is raised
+        :raises asyncio.TimeoutError: if the job did not complete in `timeout` seconds
+        """
+        if timeout is None:
+            return await self._run(platform, chat_id, function, *args)
+        task = asyncio.ensure_future(self._run(platform, chat_id, function, *args))
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._background.add(task)
+            task.add_done_callback(self._background_done)
+            raise
+
+    def stats(self, top: int = 5) -> dict:
+        """
+        Returns the total depth and the hottest shards by queue depth and then by jobs processed
+        :param top: number of hot shards to return
+        :return: dict of stats
+        """
+        shards = [shard.stats() for shard in self.shards]
+        return {
+            "shards": self.shard_count,
+            "depth": sum(shard["depth"] for shard in shards),
+            "max_depth": max((shard["max_depth"] for shard in shards), default=0),
+            "processed": sum(shard["processed"] for shard in shards),
+            "failed": sum(shard["failed"] for shard in shards),
+            "timeouts": self.timeouts,
+            "hot": sorted(shards, key=lambda shard: (shard["depth"], shard["processed"]), reverse=True)[:top],
+        }
+
+
+executor = ShardedExecutor(settings.shards, settings.shard_queue_size)
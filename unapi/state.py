@@ -0,0 +1,224 @@
+import asyncio
+import copy
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Hashable, List, Tuple
+
+from unapi import jsonlib
+from unapi.cache import TTLCache
+from unapi.settings import settings
+
+_missing = object()
+
+
+class ChatStateStore:
+    """
+    Conversation state of chats, keyed by platform and chat id. States are JSON-serializable dicts.
+    Reads and writes go to an in-memory LRU cache with TTL; a miss is read through from SQLite,
+    and writes are flushed to it in batches from the background, so hot chats never wait for the disk.
+    All disk access happens in a single dedicated thread
+    """
+
+    def __init__(self, path: str, maxsize: int = 100000, ttl: float = 3600, flush_interval: float = 1.0,
+                 flush_batch: int = 1000) -> None:
+        """
+        :param path: path of the SQLite database, created if missing
+        :param maxsize: states kept in memory
+        :param ttl: seconds a state stays in memory after it was last loaded or written
+        :param flush_interval: seconds between flushes
+        :param flush_batch: pending writes that trigger a flush before the interval ends
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.cache = TTLCache("chat_state", maxsize, ttl)
+        # Written but not yet flushed states by key, None for a deletion, with the time of the oldest write
+        self._dirty: Dict[Hashable, dict | None] = {}
+        self._dirty_since: float | None = None
+        # The batch being written by a flush in progress
+        self._flushing: Dict[Hashable, dict | None] = {}
+        # States written while their key is read from the disk; they win over the value read
+        self._loading: Dict[Hashable, Any] = {}
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="unapi-state")
+        self._connection: sqlite3.Connection | None = None
+        self._task: asyncio.Task | None = None
+        self._flush_now: asyncio.Event | None = None
+        self._stopping = False
+        self.flushes = 0
+        self.flushed = 0
+        self.flush_errors = 0
+        self.last_flush_time = 0.0
+        self.disk_reads = 0
+
+    @staticmethod
+    def key(platform: str, chat_id: int | str) -> Tuple[str, str]:
+        return platform, str(chat_id)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_state ("
+                "platform TEXT NOT NULL, chat_id TEXT NOT NULL, value BLOB NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (platform, chat_id)) WITHOUT ROWID"
+            )
+        return self._connection
+
+    def _read(self, key: Tuple[str, str]) -> dict | None:
+        row = self._connect().execute(
+            "SELECT value FROM chat_state WHERE platform = ? AND chat_id = ?", key
+        ).fetchone()
+        return jsonlib.loads(row[0]) if row is not None else None
+
+    def _write(self, batch: List[Tuple[Tuple[str, str], dict | None]]) -> None:
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            connection.executemany(
+                "INSERT INTO chat_state (platform, chat_id, value, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (platform, chat_id) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+                [(*key, jsonlib.dumps(value), now) for key, value in batch if value is not None],
+            )
+            connection.executemany(
+                "DELETE FROM chat_state WHERE platform = ? AND chat_id = ?",
+                [key for key, value in batch if value is None],
+            )
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def get(self, platform: str, chat_id: int | str) -> dict | None:
+        """
+        Returns the state of a chat, reading it from the disk on a miss
+        :param platform: platform name
+        :param chat_id: a chat id
+        :return: a copy of the state, changing it does not change the stored one, or None if the chat has none
+        """
+        key = self.key(platform, chat_id)
+
+        async def load() -> dict | None:
+            value = self._dirty.get(key, self._flushing.get(key, _missing))
+            if value is not _missing:
+                return value
+            self._loading[key] = _missing
+            try:
+                self.disk_reads += 1
+                value = await self._run(self._read, key)
+            finally:
+                written = self._loading.pop(key)
+            return value if written is _missing else written
+
+        return copy.deepcopy(await self.cache.get_or_load_async(key, load))
+
+    async def set(self, platform: str, chat_id: int | str, value: dict | None) -> None:
+        """
+        Sets the state of a chat. It is written to the disk by the next flush
+        :param platform: platform name
+        :param chat_id: a chat id
+        :param value: a JSON-serializable state, None deletes it
+        :return: None
+        """
+        key = self.key(platform, chat_id)
+        # The caller may keep changing its dict, the store keeps its own copy
+        value = copy.deepcopy(value)
+        self.cache.set(key, value)
+        if key in self._loading:
+            self._loading[key] = value
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        self._dirty[key] = value
+        if len(self._dirty) >= self.flush_batch and self._flush_now is not None:
+            self._flush_now.set()
+
+    async def delete(self, platform: str, chat_id: int | str) -> None:
+        await self.set(platform, chat_id, None)
+
+    async def flush(self) -> int:
+        """
+        Writes pending states to the disk in one transaction. On failure they stay pending
+        :return: number of states written
+        """
+        if not self._dirty:
+            return 0
+        batch, since = self._dirty, self._dirty_since
+        self._dirty, self._dirty_since, self._flushing = {}, None, batch
+        start = time.monotonic()
+        try:
+            await self._run(self._write, list(batch.items()))
+        except Exception as e:
+            self.flush_errors += 1
+            logging.error(f"Error: could not write chat states:\n{e}")
+            # Writes made during the flush are newer than the failed batch
+            self._dirty = {**batch, **self._dirty}
+            self._dirty_since = since
+            return 0
+        finally:
+            self._flushing = {}
+        self.flushes += 1
+        self.flushed += len(batch)
+        self.last_flush_time = time.monotonic() - start
+        return len(batch)
+
+    async def _flusher(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """
+        Starts flushing in the running event loop. Does nothing if it is already started
+        :return: None
+        """
+        if self._task is None:
+            self._stopping = False
+            self._flush_now = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._flusher())
+
+    async def stop(self) -> None:
+        """
+        Stops flushing, writes pending states and closes the database
+        :return: None
+        """
+        if self._task is not None:
+            # Not cancelled, so a flush in progress completes
+            self._stopping = True
+            self._flush_now.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+
+    def stats(self) -> dict:
+        """
+        Returns cache hit rate, disk reads and write-behind counters. Flush lag is the age
+        of the oldest write that is not on the disk yet
+        :return: dict of stats
+        """
+        return {
+            **self.cache.stats(),
+            "disk_reads": self.disk_reads,
+            "pending": len(self._dirty),
+            "flush_lag": time.monotonic() - self._dirty_since if self._dirty_since is not None else 0.0,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+            "last_flush_time": self.last_flush_time,
+        }
+
+
+store = ChatStateStore(settings.state_path, settings.state_cache_size, settings.state_ttl,
+                       settings.state_flush_interval, settings.state_flush_batch)
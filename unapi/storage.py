@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import AsyncIterable, Iterable
+
+from unapi.settings import settings
+
+
+class _HashingWriter:
+    """
+    Writes chunks to a temporary file while hashing them
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile("wb", dir=directory, prefix=".", suffix=".part", delete=False)
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self, file_path: str) -> str:
+        self.file.close()
+        if os.path.exists(file_path):
+            os.remove(self.file.name)
+        else:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.replace(self.file.name, file_path)
+        return file_path
+
+    def abort(self) -> None:
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+
+class ContentAddressedStorage:
+    """
+    Stores one copy of every distinct file under a name derived from the SHA-256 digest of its content.
+    Platform-stable source ids (e.g. Telegram file_unique_id) are indexed to stored paths,
+    so a file that was already stored is not downloaded again
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.temp_dir = os.path.join(root, ".tmp")
+        self.index_dir = os.path.join(root, ".index")
+        self.stored = 0
+        self.duplicates = 0
+        self.index_hits = 0
+
+    def file_path(self, digest: str, file_type: str, extension: str) -> str:
+        if extension and not extension.startswith("."):
+            extension = "." + extension
+        return os.path.normpath(os.path.join(self.root, file_type, digest[:2], digest + extension))
+
+    def _index_path(self, source_id: str) -> str:
+        key = hashlib.sha256(source_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.index_dir, key[:2], key)
+
+    def lookup(self, source_id: str | None) -> str | None:
+        """
+        Returns the stored path of a file by its source id
+        :param source_id: a platform-stable id of the file
+        :return: path of the stored file or None if it was never stored
+        """
+        if not source_id:
+            return None
+        try:
+            with open(self._index_path(source_id), encoding="utf-8") as f:
+                file_path = f.read()
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(file_path):
+            return None
+        self.index_hits += 1
+        return file_path
+
+    def remember(self, source_id: str | None, file_path: str) -> None:
+        """
+        Indexes a stored file by its source id
+        :param source_id: a platform-stable id of the file
+        :param file_path: path of the stored file
+        :return: None
+        """
+        if not source_id:
+            return
+        index_path = self._index_path(source_id)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(index_path), delete=False,
+                                         encoding="utf-8") as f:
+            f.write(file_path)
+        os.replace(f.name, index_path)
+
+    def _commit(self, writer: _HashingWriter, file_type: str, extension: str, source_id: str | None) -> str:
+        file_path = self.file_path(writer.hasher.hexdigest(), file_type, extension)
+        if os.path.exists(file_path):
+            self.duplicates += 1
+        else:
+            self.stored += 1
+        writer.commit(file_path)
+        self.remember(source_id, file_path)
+        return file_path
+
+    def store(self, chunks: Iterable[bytes], file_type: str, extension: str,
+              source_id: str | None = None) -> str | None:
+        """
+        Stores a file, hashing it while it is written. A duplicate of a stored file is discarded
+        :param chunks: an iterable of file chunks
+        :param file_type: type of the file, used as a directory name
+        :param extension: extension of the file
+        :param source_id: a platform-stable id of the file to index the result by
+        :return: path of the stored file or None if storing failed
+        """
+        writer = None
+        try:
+            writer = _HashingWriter(self.temp_dir)
+            for chunk in chunks:
+                writer.write(chunk)
+            return self._commit(writer, file_type, extension, source_id)
+        except Exception as e:
+            logging.error(f"Error: an unexpected error occurred while storing the file:\n{e}")
+            if writer is not None:
+                writer.abort()
+        return None
+
+    async def store_async(self, chunks: AsyncIterable[bytes], file_type: str, extension: str,
+                          source_id: str | None = None) -> str | None:
+        """
+        Awaitable counterpart of `store` that consumes an async chunk iterator. Writing, hashing and
+        renaming run in the default executor, so disk I/O never blocks the event loop
+        """
+        loop = asyncio.get_running_loop()
+        writer = None
+        try:
+            writer = await loop.run_in_executor(None, _HashingWriter, self.temp_dir)
+            async for chunk in chunks:
+                await loop.run_in_executor(None, writer.write, chunk)
+            return await loop.run_in_executor(None, self._commit, writer, file_type, extension, source_id)
+        except Exception as e:
+            logging.error(f"Error: an unexpected error occurred while storing the file:\n{e}")
+            if writer is not None:
+                await loop.run_in_executor(None, writer.abort)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "stored": self.stored,
+            "duplicates": self.duplicates,
+            "index_hits": self.index_hits,
+        }
+
+
+# STORAGE_MODE=unique saves every download under a new timestamp and uuid based name,
+# STORAGE_MODE=content stores one copy per distinct content
+content_storage = ContentAddressedStorage(settings.local_storage_path) if settings.storage_mode == "content" else None
@@ -0,0 +1,108 @@
+import logging
+import time
+import uuid
+from contextvars import ContextVar
+from typing import List, Tuple
+
+from unapi.settings import settings
+
+# Id of the trace of the current request, set for the request and every task it starts
+trace_id_var: ContextVar[str | None] = ContextVar("trace_id", default=None)
+# Spans of the current trace as name, start offset and duration in seconds, None if spans are not recorded
+_spans_var: ContextVar[List[Tuple[str, float, float]] | None] = ContextVar("spans", default=None)
+_start_var: ContextVar[float] = ContextVar("trace_start", default=0.0)
+
+
+class TraceIdFilter(logging.Filter):
+    """
+    Adds the trace id of the current request to log records as `trace_id`, "-" outside of requests
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get() or "-"
+        return True
+
+
+def install_log_filter(logger: logging.Logger | None = None) -> None:
+    """
+    Adds TraceIdFilter to every handler of a logger, so formats may use %(trace_id)s
+    :param logger: a logger, the root logger by default
+    :return: None
+    """
+    for handler in (logger or logging.getLogger()).handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+
+
+class _Span:
+    __slots__ = ("name", "spans", "start")
+
+    def __init__(self, name: str, spans: List[Tuple[str, float, float]]) -> None:
+        self.name = name
+        self.spans = spans
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        end = time.perf_counter()
+        self.spans.append((self.name, self.start - _start_var.get(), end - self.start))
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_no_span = _NoSpan()
+
+
+def span(name: str) -> _Span | _NoSpan:
+    """
+    A context manager that records the time spent inside it as a span of the current trace.
+    Outside of a trace, or with TRACING off, it does nothing
+    :param name: name of the span, e.g. is_json_valid
+    :return: a span
+    """
+    spans = _spans_var.get()
+    if spans is None:
+        return _no_span
+    return _Span(name, spans)
+
+
+class trace:
+    """
+    A context manager that starts a trace: a new trace id for logs and, with TRACING on, a list of spans.
+    The spans are logged when the trace ends, at INFO if it took longer than TRACE_SLOW_THRESHOLD
+    """
+
+    def __init__(self, trace_id: str | None = None) -> None:
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self._tokens = ()
+
+    def __enter__(self) -> "trace":
+        self._tokens = (trace_id_var.set(self.trace_id),)
+        if settings.tracing:
+            self._tokens += (_spans_var.set([]), _start_var.set(time.perf_counter()))
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        spans = _spans_var.get()
+        if spans is not None:
+            _log_spans(spans, time.perf_counter() - _start_var.get())
+        for token in reversed(self._tokens):
+            token.var.reset(token)
+
+
+def _log_spans(spans: List[Tuple[str, float, float]], total: float) -> None:
+    level = logging.INFO if total >= settings.trace_slow_threshold else logging.DEBUG
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    details = ", ".join(f"{name} +{start * 1000:.1f} ms {duration * 1000:.1f} ms" for name, start, duration in spans)
+    logging.log(level, f"Trace {total * 1000:.1f} ms: {details}")
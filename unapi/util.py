@@ -1,14 +1,27 @@
 import os
+import asyncio
 import logging
+import tempfile
 import uuid
 import datetime
 from abc import ABC
-from typing import Type, Any, TypeVar
+from typing import Type, Any, TypeVar, Iterable, Iterator, Tuple, AsyncIterable, AsyncIterator, Callable, Awaitable, BinaryIO
+import aiohttp
 import requests
-from dotenv import load_dotenv
 
-load_dotenv()
-local_storage_path = os.environ["LOCAL_STORAGE_PATH"]
+from unapi.client import ApiClient
+from unapi.settings import settings
+from unapi import storage
+
+local_storage_path = settings.local_storage_path
+download_chunk_size = 64 * 1024
+download_max_size = settings.download_max_size
+download_timeout = settings.download_timeout
+# Shared by all requests, so a burst of media-heavy webhooks cannot open unbounded connections
+download_semaphore = asyncio.Semaphore(settings.max_concurrent_downloads)
+download_client = ApiClient("download", "", timeout=download_timeout, stage="download")
+
+T = TypeVar("T")
 
 
 def generate_file_path(file_name: str, file_type: str) -> str:
@@ -41,29 +54,349 @@ def save_file(file_path: str, file_content: bytes, make_dirs=True) -> str | None
     return None
 
 
+def save_stream(file_path: str, chunks: Iterable[bytes], make_dirs=True) -> Tuple[str, int] | None:
+    """
+    Writes chunks to a temporary file next to `file_path` and atomically renames it once complete,
+    so a partially written file is never visible under `file_path`
+    :param file_path: final path of the file
+    :param chunks: an iterable of file chunks
+    :param make_dirs: if True, creates missing directories
+    :return: str - path of the saved file, int - its size in bytes, or None if saving failed
+    """
+    temp_path = None
+    try:
+        directory = os.path.dirname(file_path)
+        if make_dirs and directory:
+            os.makedirs(directory, exist_ok=True)
+        size = 0
+        with tempfile.NamedTemporaryFile("wb", dir=directory or None, prefix=".", suffix=".part",
+                                         delete=False) as f:
+            temp_path = f.name
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(temp_path, file_path)
+        return file_path, size
+    except Exception as e:
+        logging.error(f"Error: an unexpected error occurred while saving the file {file_path}:\n{e}")
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+    return None
+
+
 def save_image(file_name: str, file_content: bytes) -> str:
     local_path = generate_file_path(file_name, AttachmentType.Image.value)
     return save_file(local_path, file_content) or ""
 
 
-def download_file(url: str) -> bytes | None:
+
+
+class DownloadStream:
+    """
+    Iterator over chunks of a file being downloaded. Memory use does not depend on the file size.
+    It counts transferred bytes and raises ValueError once `max_size` is exceeded
+    """
+
+    def __init__(self, response: requests.Response, max_size: int | None = download_max_size,
+                 chunk_size: int = download_chunk_size) -> None:
+        self.response = response
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.bytes_transferred = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            for chunk in self.response.iter_content(self.chunk_size):
+                self.bytes_transferred += len(chunk)
+                if self.max_size and self.bytes_transferred > self.max_size:
+                    raise ValueError(f"file exceeds the maximum size of {self.max_size} bytes")
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.response.close()
+
+    def __enter__(self) -> "DownloadStream":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def open_download(url: str, max_size: int | None = download_max_size,
+                  timeout: float = download_timeout) -> DownloadStream | None:
+    """
+    Starts a streaming download
+    :param url: url of the file
+    :param max_size: maximum size of the file in bytes, None or 0 for no limit
+    :param timeout: connect and read timeout in seconds
+    :return: a chunk iterator or None if the file cannot be downloaded
+    """
+    try:
+        response = requests.get(url, stream=True, timeout=timeout)
+        if not response.ok:
+            response.close()
+            return None
+        content_length = int(response.headers.get("Content-Length") or 0)
+        if max_size and content_length > max_size:
+            response.close()
+            logging.error(f"Error: file of {content_length} bytes exceeds the maximum size of {max_size} bytes")
+            return None
+        return DownloadStream(response, max_size)
+    except Exception as e:
+        logging.error(f"Error: an unexpected error occurred while downloading the file:\n{e}")
+    return None
+
+
+def download_file(url: str, max_size: int | None = download_max_size,
+                  timeout: float = download_timeout) -> bytes | None:
+    """
+    Downloads a file to memory, with the timeout and size limit of `open_download`
+    :param url: url of the file
+    :param max_size: maximum size of the file in bytes, None or 0 for no limit
+    :param timeout: connect and read timeout in seconds
+    :return: file content or None if the file cannot be downloaded
+    """
+    stream = open_download(url, max_size, timeout)
+    if stream is None:
+        return None
     try:
-        response = requests.get(url)
-        if response.ok:
-            return response.content
+        return b"".join(stream)
     except Exception as e:
         logging.error(f"Error: an unexpected error occurred while downloading the file:\n{e}")
     return None
 
 
-def download_attachment(attachment: 'Attachment', save=True) -> str | bytes | None:
+def download_file_to(url: str, file_path: str, max_size: int | None = download_max_size,
+                     timeout: float = download_timeout) -> str | None:
+    """
+    Downloads a file chunk by chunk straight to `file_path`
+    :param url: url of the file
+    :param file_path: path to save the file to
+    :param max_size: maximum size of the file in bytes, None or 0 for no limit
+    :param timeout: connect and read timeout in seconds
+    :return: path of the saved file or None if downloading or saving failed
+    """
+    stream = open_download(url, max_size, timeout)
+    if stream is None:
+        return None
+    with stream:
+        result = save_stream(file_path, stream)
+    if result is None:
+        return None
+    logging.info(f"Downloaded {stream.bytes_transferred} bytes to {file_path}")
+    return result[0]
+
+
+def store_attachment(attachment: 'Attachment', content_storage: storage.ContentAddressedStorage) -> str | None:
+    """
+    Saves an attachment to content-addressed storage, skipping the download if its source id was already stored
+    :param attachment: an attachment to save
+    :param content_storage: the storage to save to
+    :return: path of the stored file or None on failure
+    """
+    path = content_storage.lookup(attachment.source_id)
+    if path is not None:
+        return path
+    stream = open_download(attachment.url)
+    if stream is None:
+        return None
+    with stream:
+        return content_storage.store(stream, attachment.type_.value, attachment.extension, attachment.source_id)
+
+
+def download_attachment(attachment: 'Attachment', save=True, stream=False) -> str | bytes | DownloadStream | None:
+    """
+    Downloads an attachment. With STORAGE_MODE=content saved attachments are deduplicated by content
+    :param attachment: an attachment to download
+    :param save: if True, saves the attachment to local storage and returns its path. It is streamed to disk
+    :param stream: without `save`, if True a chunk iterator is returned instead of bytes
+    :return: a path, bytes or a chunk iterator depending on `save` and `stream`, None on failure
+    """
+    if save and storage.content_storage is not None:
+        return store_attachment(attachment, storage.content_storage)
     if save:
         path = generate_file_path(f'{attachment.name}.{attachment.extension}', attachment.type_.value)
-        return save_file(path, download_file(attachment.url))
+        return download_file_to(attachment.url, path)
+    if stream:
+        return open_download(attachment.url)
     return download_file(attachment.url)
 
 
-T = TypeVar("T")
+def _open_temp(file_path: str, make_dirs: bool) -> Tuple[str, BinaryIO]:
+    directory = os.path.dirname(file_path)
+    if make_dirs and directory:
+        os.makedirs(directory, exist_ok=True)
+    f = tempfile.NamedTemporaryFile("wb", dir=directory or None, prefix=".", suffix=".part", delete=False)
+    return f.name, f
+
+
+def _remove(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def save_stream_async(file_path: str, chunks: AsyncIterable[bytes], make_dirs=True) -> Tuple[str, int] | None:
+    """
+    Awaitable counterpart of `save_stream` that consumes an async chunk iterator.
+    Opening, writing and renaming the file run in the default executor, so disk I/O never blocks the event loop
+    """
+    loop = asyncio.get_running_loop()
+    temp_path = None
+    try:
+        temp_path, f = await loop.run_in_executor(None, _open_temp, file_path, make_dirs)
+        size = 0
+        try:
+            async for chunk in chunks:
+                await loop.run_in_executor(None, f.write, chunk)
+                size += len(chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        await loop.run_in_executor(None, os.replace, temp_path, file_path)
+        return file_path, size
+    except Exception as e:
+        logging.error(f"Error: an unexpected error occurred while saving the file {file_path}:\n{e}")
+        if temp_path is not None:
+            await loop.run_in_executor(None, _remove, temp_path)
+    return None
+
+
+class AsyncDownloadStream:
+    """
+    Async iterator over chunks of a file being downloaded through the pooled session, the awaitable
+    counterpart of DownloadStream. It holds a download slot until it is exhausted or closed
+    """
+
+    def __init__(self, response: aiohttp.ClientResponse, max_size: int | None = download_max_size,
+                 chunk_size: int = download_chunk_size) -> None:
+        self.response = response
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.bytes_transferred = 0
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.response.content.iter_chunked(self.chunk_size):
+                self.bytes_transferred += len(chunk)
+                if self.max_size and self.bytes_transferred > self.max_size:
+                    raise ValueError(f"file exceeds the maximum size of {self.max_size} bytes")
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.response.release()
+            download_semaphore.release()
+
+    async def __aenter__(self) -> "AsyncDownloadStream":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.close()
+
+
+async def open_download_async(url: str, max_size: int | None = download_max_size) -> AsyncDownloadStream | None:
+    """
+    Starts a streaming download through the pooled session. At most MAX_CONCURRENT_DOWNLOADS downloads
+    run at once, the stream must be exhausted or closed to free its slot
+    :param url: url of the file
+    :param max_size: maximum size of the file in bytes, None or 0 for no limit
+    :return: an async chunk iterator or None if the file cannot be downloaded
+    """
+    await download_semaphore.acquire()
+    try:
+        resp = await download_client.session.get(url)
+    except Exception as e:
+        download_semaphore.release()
+        logging.error(f"Error: an unexpected error occurred while downloading the file:\n{e}")
+        return None
+    stream = AsyncDownloadStream(resp, max_size)
+    if resp.status >= 400:
+        stream.close()
+        return None
+    if max_size and (resp.content_length or 0) > max_size:
+        stream.close()
+        logging.error(f"Error: file of {resp.content_length} bytes exceeds the maximum size of {max_size} bytes")
+        return None
+    return stream
+
+
+async def consume_download_async(url: str, consume: Callable[[AsyncIterator[bytes]], Awaitable[T]],
+                                 max_size: int | None = download_max_size) -> T | None:
+    """
+    Downloads a file through the pooled session and passes its chunks to `consume`.
+    At most MAX_CONCURRENT_DOWNLOADS downloads run at once
+    :param url: url of the file
+    :param consume: a coroutine function that consumes an async chunk iterator
+    :param max_size: maximum size of the file in bytes, None or 0 for no limit
+    :return: result of `consume` or None on failure
+    """
+    stream = await open_download_async(url, max_size)
+    if stream is None:
+        return None
+    async with stream:
+        try:
+            return await consume(stream.__aiter__())
+        except Exception as e:
+            logging.error(f"Error: an unexpected error occurred while downloading the file:\n{e}")
+    return None
+
+
+async def download_file_async(url: str, file_path: str | None = None,
+                              max_size: int | None = download_max_size) -> str | bytes | None:
+    """
+    Downloads a file through the pooled session
+    :param url: url of the file
+    :param file_path: if given, the file is streamed to this path, otherwise it is returned as bytes
+    :param max_size: maximum size of the file in bytes, None or 0 for no limit
+    :return: path of the saved file or file content, None on failure
+    """
+    async def consume(chunks: AsyncIterator[bytes]) -> str | bytes | None:
+        if file_path is None:
+            return b"".join([chunk async for chunk in chunks])
+        result = await save_stream_async(file_path, chunks)
+        return result[0] if result is not None else None
+
+    return await consume_download_async(url, consume, max_size)
+
+
+async def store_attachment_async(attachment: 'Attachment',
+                                 content_storage: storage.ContentAddressedStorage) -> str | None:
+    """
+    Awaitable counterpart of `store_attachment`
+    """
+    path = await asyncio.get_running_loop().run_in_executor(None, content_storage.lookup, attachment.source_id)
+    if path is not None:
+        return path
+
+    async def consume(chunks: AsyncIterator[bytes]) -> str | None:
+        return await content_storage.store_async(chunks, attachment.type_.value, attachment.extension,
+                                                 attachment.source_id)
+
+    return await consume_download_async(attachment.url, consume)
+
+
+async def download_attachment_async(attachment: 'Attachment', save=True,
+                                    stream=False) -> str | bytes | AsyncDownloadStream | None:
+    """
+    Awaitable counterpart of `download_attachment`. Saved attachments are streamed to disk
+    :param attachment: an attachment to download
+    :param save: if True, saves the attachment to local storage and returns its path
+    :param stream: without `save`, if True an async chunk iterator is returned instead of bytes
+    :return: a path, bytes or an async chunk iterator depending on `save` and `stream`, None on failure
+    """
+    if save and storage.content_storage is not None:
+        return await store_attachment_async(attachment, storage.content_storage)
+    if save:
+        path = generate_file_path(f'{attachment.name}.{attachment.extension}', attachment.type_.value)
+        return await download_file_async(attachment.url, path)
+    if stream:
+        return await open_download_async(attachment.url)
+    return await download_file_async(attachment.url)
 
 
 class NoPublicConstructor(type):
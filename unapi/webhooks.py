@@ -1,23 +1,20 @@
 import logging
 from urllib.parse import urljoin
-from os import environ
 
 import asyncio
 import aiohttp
 
-from dotenv import load_dotenv
+from unapi import platforms
+from unapi.settings import settings
 
-
-load_dotenv()
-
-telegram_token = environ["TELEGRAM_TOKEN"]
-telegram_verification_token = environ["TELEGRAM_VERIFICATION_TOKEN"]
-viber_token = environ["VIBER_TOKEN"]
-facebook_api_version = environ["FACEBOOK_API_VERSION"]
-facebook_verification_token = environ["FACEBOOK_VERIFICATION_TOKEN"]
-facebook_page_token = environ["FACEBOOK_PAGE_TOKEN"]
-api_url = environ["API_URL"]
-webhook_path = environ["WEBHOOK_PATH"]
+telegram_token = settings.telegram_token
+telegram_verification_token = settings.telegram_verification_token
+viber_token = settings.viber_token
+facebook_api_version = settings.facebook_api_version
+facebook_verification_token = settings.facebook_verification_token
+facebook_page_token = settings.facebook_page_token
+api_url = settings.api_url
+webhook_path = settings.webhook_path
 
 
 async def set_webhook(url, headers, body) -> (bool, dict):
@@ -42,7 +39,7 @@ async def set_telegram_webhook() -> None:
     Set webhook for Telegram
     :return:
     """
-    url = f"https://api.telegram.org/bot{telegram_token}/setWebhook"
+    url = f"{settings.telegram_api_url}/bot{telegram_token}/setWebhook"
     headers = {}
     body = {
         "url": urljoin(api_url, webhook_path),
@@ -63,7 +60,7 @@ async def set_viber_webhook() -> None:
     Set webhook for Viber
     :return:
     """
-    url = "https://chatapi.viber.com/pa/set_webhook"
+    url = urljoin(settings.viber_api_url, "set_webhook")
     headers = {
         "X-Viber-Auth-Token": viber_token,
         "Content-Type": "application/json",
@@ -92,7 +89,7 @@ async def set_facebook_webhook() -> None:
     Set webhook for Facebook
     :return:
     """
-    url = f"https://graph.facebook.com/v{facebook_api_version}/me/subscribed_apps"
+    url = f"{settings.facebook_graph_url}/v{facebook_api_version}/me/subscribed_apps"
     headers = {}
     body = {
         "access_token": facebook_page_token,
@@ -111,11 +108,15 @@ async def set_facebook_webhook() -> None:
 
 async def init() -> None:
     """
-    Set webhooks for all platforms
+    Set webhooks for all enabled platforms
     :return:
     """
-    await asyncio.gather(
-        set_telegram_webhook(),
-        set_viber_webhook(),
-        set_facebook_webhook()
-    )
+    setters = {
+        "telegram": set_telegram_webhook,
+        "viber": set_viber_webhook,
+        "facebook": set_facebook_webhook,
+    }
+    if settings.telegram_ingest == "polling":
+        # Telegram updates are long-polled, and getUpdates is refused while a webhook is set
+        setters.pop("telegram")
+    await asyncio.gather(*(setters[spec.name]() for spec in platforms.enabled() if spec.name in setters))